@@ -0,0 +1,28 @@
+# Hooks for gunicorn --preload --config core/gunicorn.conf.py. BOOT_STARTED (unix time) is set
+# by the container command before warm_start, so the reported cold start covers both.
+import os
+import time
+
+master_started = time.monotonic()
+
+def when_ready(server):
+    from properties.warmup import warm_up_master
+    warm_up_master()
+    message = f'Ready in {time.monotonic() - master_started:.1f}s'
+    if os.getenv('BOOT_STARTED'):
+        message += f', cold start {time.time() - float(os.environ["BOOT_STARTED"]):.1f}s'
+    server.log.info(message)
+
+def post_fork(server, worker):
+    from properties.metrics import metrics
+    from properties.warmup import prime_connections
+    prime_connections()
+    metrics.start_flushing()
+
+def worker_exit(server, worker):
+    from django.db import DatabaseError
+    from properties.metrics import metrics
+    try:
+        metrics.stop()
+    except DatabaseError:
+        server.log.exception('Flushing metrics on exit failed')
@@ -8,6 +8,9 @@ DEBUG = os.getenv('DEBUG', 'False') == 'True'
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '*').split(',')
 ROOT_URLCONF = 'core.urls'
 WSGI_APPLICATION = 'core.wsgi.application'
+ASGI_APPLICATION = 'core.asgi.application'
+# Serve the list and retrieve endpoints with async views, enable when running under ASGI
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') == 'True'
 
 # Database
 DATABASES = {
@@ -18,12 +21,59 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Keep connections open between requests and check them before reuse
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas as comma separated host:port pairs, GET requests on the API are spread over them
+REPLICA_DATABASES = []
+for index, replica in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    host, _, port = replica.strip().partition(':')
+    alias = f'replica_{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+DATABASE_ROUTERS = ['properties.routers.ReplicaRouter']
+# Seconds a client reads from the primary after writing, so it sees its own changes
+REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', '5'))
+
+# Queries slower than this are logged with their EXPLAIN plan
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', '500'))
+
+# How property list pages are counted by default: exact, cached, estimate or none
+PROPERTY_COUNT_STRATEGY = os.getenv('PROPERTY_COUNT_STRATEGY', 'exact')
+
+# Binary COPY snapshot of the seed data, written by the first warm_start and restored by later ones
+SEED_SNAPSHOT_DIR = Path(os.getenv('SEED_SNAPSHOT_DIR', BASE_DIR / 'seed'))
+
+# Cache
+# The api cache lives in PostgreSQL so all gunicorn workers share cached responses
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'api': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'api_cache',
+        'TIMEOUT': 300,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
 # Rest
 REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Per client rates for the property and portfolio endpoints, raise them when load testing
+    'DEFAULT_THROTTLE_RATES': {
+        'property_read': os.getenv('PROPERTY_READ_THROTTLE_RATE', '100/minute'),
+        'property_write': os.getenv('PROPERTY_WRITE_THROTTLE_RATE', '30/minute'),
+    },
 }
 SPECTACULAR_SETTINGS = {
     'TITLE': 'TS Full Stack Case API',
@@ -35,13 +85,17 @@ INSTALLED_APPS = [
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.gis',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework_gis',
     'drf_spectacular',
     'properties',
 ]
 MIDDLEWARE = [
+    'properties.metrics.InstrumentationMiddleware',
+    'properties.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -1,7 +1,9 @@
 from django.urls import path, include
-from drf_spectacular.views import SpectacularAPIView
+from properties.metrics import metrics_view
+from properties.warmup import SchemaView
 
 urlpatterns = [
     path('api/', include('properties.urls')),
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
+    path('api/schema/', SchemaView.as_view(), name='schema'),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -0,0 +1,106 @@
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage
+from django.http import Http404
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from typing import Any
+from .pagination import GeoPropertyPagination
+from .renderers import ColumnarRenderer
+from .views import PortfolioViewSet, PropertyViewSet
+
+# Natively async GET handlers for the list and retrieve routes, used when serving through ASGI.
+# They reuse the viewsets for negotiation, throttling, filtering and serialization and only
+# swap the database access for the async ORM. Other methods and unsupported modes (cursor
+# pagination, the columnar format, delta syncs, inexact counts, the browsable API) are handed
+# to the regular DRF views.
+
+async def property_list(view: Any, request: Any) -> Response:
+    queryset = view._feature_rows(view.filter_queryset(view.get_queryset()))
+    paginator = view.paginator
+    page_size = paginator.get_page_size(request)
+    count = await queryset.acount()
+
+    # Validate the page number against a lazy range so no rows are loaded
+    django_paginator = paginator.django_paginator_class(range(count), page_size)
+    page_number = paginator.get_page_number(request, django_paginator)
+    try:
+        paginator.page = django_paginator.page(page_number)
+    except InvalidPage as exc:
+        raise NotFound(paginator.invalid_page_message.format(page_number=page_number, message=str(exc)))
+    paginator.request = request
+
+    offset = (paginator.page.number - 1) * page_size
+    rows = [row async for row in queryset[offset:offset + page_size].aiterator()]
+    return paginator.get_paginated_response({'features': view.features(rows)})
+
+async def instance_retrieve(view: Any, request: Any, pk: Any) -> Response:
+    queryset = view.filter_queryset(view.get_queryset())
+    try:
+        instance = await queryset.aget(**{view.lookup_field: pk})
+    except (queryset.model.DoesNotExist, ValueError, TypeError):
+        raise Http404
+    return Response(view.serialized(instance))
+
+async def portfolio_list(view: Any, request: Any) -> Response:
+    portfolios = [portfolio async for portfolio in view.filter_queryset(view.get_queryset())]
+    return Response(view.serialized(portfolios, many=True))
+
+def _supports_async(view: Any, request: Any) -> bool:
+    try:
+        renderer, _ = view.perform_content_negotiation(request)
+    except APIException:
+        # Let the sync view produce the error response
+        return False
+    if not isinstance(renderer, JSONRenderer) or isinstance(renderer, ColumnarRenderer):
+        return False
+    if request.query_params.get('pagination') == 'cursor' or 'since' in request.query_params:
+        return False
+    if view.action == 'list' and isinstance(view.paginator, GeoPropertyPagination):
+        # The async list always counts exactly
+        try:
+            return view.paginator.get_count_strategy(request) == 'exact'
+        except APIException:
+            return False
+    return True
+
+def async_read_view(viewset: Any, actions: dict, handler: Any) -> Any:
+    sync_view = viewset.as_view(actions)
+
+    async def view(request, *args, **kwargs):
+        if request.method == 'GET':
+            instance = viewset(action_map=actions, args=args, kwargs=kwargs, format_kwarg=None)
+            drf_request = instance.initialize_request(request, *args, **kwargs)
+            instance.request = drf_request
+            instance.headers = instance.default_response_headers
+            if _supports_async(instance, drf_request):
+                try:
+                    # Authentication, permissions and throttling may touch the database
+                    await sync_to_async(instance.initial)(drf_request, *args, **kwargs)
+                    response = await handler(instance, drf_request, **kwargs)
+                except Exception as exc:
+                    response = instance.handle_exception(exc)
+                response = instance.finalize_response(drf_request, response, *args, **kwargs)
+                return response.render()
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    view.actions = actions
+    return view
+
+property_list_view = async_read_view(
+    PropertyViewSet, {'get': 'list', 'post': 'create'}, property_list
+)
+property_detail_view = async_read_view(
+    PropertyViewSet,
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    instance_retrieve
+)
+portfolio_list_view = async_read_view(
+    PortfolioViewSet, {'get': 'list', 'post': 'create'}, portfolio_list
+)
+portfolio_detail_view = async_read_view(
+    PortfolioViewSet,
+    {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'},
+    instance_retrieve
+)
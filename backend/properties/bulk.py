@@ -0,0 +1,149 @@
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .cache import invalidate_portfolios
+from .models import Property
+from .serializers import BulkPropertySerializer
+
+BULK_BATCH_SIZE = 1000
+BULK_MAX_FEATURES = 50000
+# Existing properties are matched on these fields when upserting features without an id
+NATURAL_KEY = ('portfolio_id', 'address', 'zip_code')
+WRITE_FIELDS = [
+    'portfolio', 'name', 'address', 'zip_code', 'city', 'location',
+    'estimated_value', 'relevant_risks', 'handled_risks', 'total_financial_risk'
+]
+
+def _natural_key(attrs: dict) -> tuple:
+    portfolio = attrs.get('portfolio')
+    return (portfolio.pk if portfolio else None, attrs['address'], attrs['zip_code'])
+
+def _is_id(pk) -> bool:
+    # bool is a subclass of int, but true is not a property id
+    return isinstance(pk, int) and not isinstance(pk, bool)
+
+def _repeats(keys: list) -> dict:
+    # Maps the index of every repeated key to the index it first appeared at
+    first = {}
+    repeats = {}
+    for index, key in enumerate(keys):
+        if key is None:
+            continue
+        if key in first:
+            repeats[index] = first[key]
+        else:
+            first[key] = index
+    return repeats
+
+def _raise_errors(errors: dict) -> None:
+    if errors:
+        raise ValidationError({
+            'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)]
+        })
+
+def _batches(items: list, size: int = BULK_BATCH_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def validate_collection(data) -> list:
+    if not isinstance(data, dict) or data.get('type') != 'FeatureCollection':
+        raise ValidationError({'type': 'Expected a GeoJSON FeatureCollection'})
+    features = data.get('features')
+    if not isinstance(features, list) or not features:
+        raise ValidationError({'features': 'Expected a non-empty list of features'})
+    if len(features) > BULK_MAX_FEATURES:
+        raise ValidationError({'features': f'At most {BULK_MAX_FEATURES} features per request'})
+    if not all(isinstance(feature, dict) for feature in features):
+        raise ValidationError({'features': 'Every feature must be an object'})
+    return features
+
+def save_features(data, upsert: bool = False) -> dict:
+    features = validate_collection(data)
+    serializer = BulkPropertySerializer(data=features, many=True)
+    serializer.is_valid()
+    errors = {index: error for index, error in enumerate(serializer.errors or []) if error}
+
+    ids = [feature.get('id') for feature in features]
+    for index, pk in enumerate(ids):
+        if pk is not None and not _is_id(pk):
+            errors.setdefault(index, {})['id'] = ['Id must be a whole number']
+    requested_ids = [pk if _is_id(pk) else None for pk in ids]
+    for index, first in _repeats(requested_ids).items():
+        errors.setdefault(index, {})['id'] = [f'Repeats the id of feature {first}']
+
+    previous_portfolios = dict(
+        Property.objects.filter(id__in=[pk for pk in requested_ids if pk is not None])
+        .values_list('id', 'portfolio_id')
+    )
+    for index, pk in enumerate(requested_ids):
+        if pk is not None and pk not in previous_portfolios:
+            errors.setdefault(index, {})['id'] = ['Property does not exist']
+    _raise_errors(errors)
+
+    validated = serializer.validated_data
+    if upsert:
+        # Features without an id that share a natural key would all write the same row
+        keys = [_natural_key(attrs) if pk is None else None for pk, attrs in zip(ids, validated)]
+        _raise_errors({
+            index: {'non_field_errors': [f'Repeats the portfolio, address and zip code of feature {first}']}
+            for index, first in _repeats(keys).items()
+        })
+        ids = _match_natural_keys(validated, ids, previous_portfolios)
+        _raise_errors({
+            index: {'non_field_errors': [f'Matches the same property as feature {first}']}
+            for index, first in _repeats(ids).items()
+        })
+
+    to_create = [Property(**attrs) for pk, attrs in zip(ids, validated) if pk is None]
+    to_update = [Property(id=pk, **attrs) for pk, attrs in zip(ids, validated) if pk is not None]
+
+    for batch in _batches(to_create):
+        with transaction.atomic():
+            Property.objects.bulk_create(batch)
+    for batch in _batches(to_update):
+        with transaction.atomic():
+            Property.objects.bulk_update(batch, WRITE_FIELDS)
+
+    invalidate_portfolios([
+        *(prop.portfolio_id for prop in to_create + to_update),
+        *(previous_portfolios[prop.id] for prop in to_update),
+    ])
+
+    created = iter(to_create)
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'ids': [pk if pk is not None else next(created).pk for pk in ids],
+    }
+
+def _match_natural_keys(validated: list, ids: list, previous_portfolios: dict) -> list:
+    keys = {_natural_key(attrs) for pk, attrs in zip(ids, validated) if pk is None}
+    existing = {}
+    for batch in _batches(sorted(keys, key=str)):
+        rows = Property.objects.filter(
+            address__in={key[1] for key in batch}, zip_code__in={key[2] for key in batch}
+        ).order_by('-id').values_list('id', *NATURAL_KEY)
+        for pk, *key in rows:
+            # Ordered newest first so the oldest duplicate wins
+            existing[tuple(key)] = (pk, key[0])
+
+    matched = []
+    for pk, attrs in zip(ids, validated):
+        if pk is None and _natural_key(attrs) in existing:
+            pk, portfolio_id = existing[_natural_key(attrs)]
+            previous_portfolios[pk] = portfolio_id
+        matched.append(pk)
+    return matched
+
+def delete_properties(ids) -> dict:
+    if not isinstance(ids, list) or not all(_is_id(pk) for pk in ids):
+        raise ValidationError({'ids': 'Expected a list of property ids'})
+    ids = list(dict.fromkeys(ids))
+    deleted = 0
+    portfolio_ids = set()
+    for batch in _batches(ids):
+        with transaction.atomic():
+            rows = Property.objects.filter(id__in=batch)
+            portfolio_ids.update(rows.values_list('portfolio_id', flat=True).distinct())
+            deleted += rows.delete()[1].get(Property._meta.label, 0)
+    invalidate_portfolios(portfolio_ids)
+    return {'deleted': deleted}
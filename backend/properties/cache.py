@@ -0,0 +1,150 @@
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import partial, wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.http import HttpResponse
+from django.utils.connection import ConnectionProxy
+from .routers import read_alias
+
+# Shared between the gunicorn workers through the database cache backend
+api_cache = ConnectionProxy(caches, 'api')
+
+RESPONSE_TIMEOUT = 300
+ALL_SCOPE = 'all'
+
+def portfolio_scope(portfolio_id) -> str:
+    # ?portfolio=01 reads the same rows as 1, so it must be invalidated by the same writes
+    return f'portfolio:{int(portfolio_id)}'
+
+def _version_key(scope: str) -> str:
+    return f'version:{scope}'
+
+def _new_version() -> str:
+    # Starts with the time of the bump, so a read can tell whether a replica may still lag behind it
+    return f'{time.time():.3f}-{uuid.uuid4().hex}'
+
+def _bumped_at(version: str) -> float:
+    try:
+        return float(version.partition('-')[0])
+    except ValueError:
+        return 0.0
+
+def can_store(versions: list[str]) -> bool:
+    # A replica read within the sticky window of a bump may return the rows from before the
+    # write, storing it would serve them under the new version to every client, the writer too
+    if read_alias() == DEFAULT_DB_ALIAS or not versions:
+        return True
+    return time.time() - max(map(_bumped_at, versions)) >= settings.REPLICA_STICKY_SECONDS
+
+def get_versions(scopes: list[str]) -> list[str]:
+    keys = [_version_key(scope) for scope in scopes]
+    versions = api_cache.get_many(keys)
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        api_cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+def _set_new_versions(scopes: list[str]) -> None:
+    # A fresh random version orphans every cached response that was keyed on the old one
+    api_cache.set_many({_version_key(scope): _new_version() for scope in scopes}, timeout=None)
+
+def bump_versions(scopes: list[str]) -> None:
+    # Only once the write is committed, before that another connection still reads the old
+    # rows and would cache them under the new version
+    transaction.on_commit(partial(_set_new_versions, list(dict.fromkeys(scopes))), using=DEFAULT_DB_ALIAS)
+
+def invalidate_portfolios(portfolio_ids) -> None:
+    bump_versions([ALL_SCOPE, *(portfolio_scope(pk) for pk in sorted(set(portfolio_ids) - {None}))])
+
+class CacheStats:
+    # Counts locally and flushes to the shared cache in batches to keep the hot path cheap
+    flush_every = 50
+
+    def __init__(self):
+        self.pending = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, event: str) -> None:
+        with self.lock:
+            self.pending[event] += 1
+            should_flush = sum(self.pending.values()) >= self.flush_every
+        if should_flush:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+        for event, count in pending.items():
+            key = f'stats:{event}'
+            if not api_cache.add(key, count, timeout=None):
+                api_cache.incr(key, count)
+
+    def snapshot(self) -> dict:
+        self.flush()
+        hits = api_cache.get('stats:hits', 0)
+        misses = api_cache.get('stats:misses', 0)
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_ratio': hits / total if total else None}
+
+stats = CacheStats()
+
+def response_cache_key(view, request, kwargs, versions) -> str:
+    parts = [
+        view.basename,
+        view.action,
+        repr(sorted(kwargs.items())),
+        request.accepted_media_type,
+        repr(sorted(request.query_params.lists())),
+        *versions,
+    ]
+    return 'response:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+def count_cache_key(view, request, ignored_params, versions) -> str:
+    # Same filters on the same view share a count until a write bumps one of its scopes
+    params = [(key, values) for key, values in request.query_params.lists() if key not in ignored_params]
+    parts = [
+        view.basename,
+        view.action,
+        repr(sorted(view.kwargs.items())),
+        repr(sorted(params)),
+        *versions,
+    ]
+    return 'count:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+def _store_response(key, response):
+    etag = f'"{hashlib.md5(response.content).hexdigest()}"'
+    response['ETag'] = etag
+    api_cache.set(key, {
+        'content': response.content,
+        'content_type': response['Content-Type'],
+        'etag': etag,
+    }, timeout=RESPONSE_TIMEOUT)
+
+def cache_response(method):
+    # Serves rendered responses from the shared cache. ETag/If-None-Match handling
+    # is left to ConditionalGetMiddleware, which answers 304 when the tags match.
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        versions = get_versions(view.get_cache_scopes())
+        key = response_cache_key(view, request, kwargs, versions)
+        cached = api_cache.get(key)
+        if cached is not None:
+            stats.record('hits')
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+            response['ETag'] = cached['etag']
+            response['X-Cache'] = 'HIT'
+            return response
+
+        stats.record('misses')
+        response = method(view, request, *args, **kwargs)
+        if response.status_code == 200 and can_store(versions):
+            response.add_post_render_callback(partial(_store_response, key))
+        response['X-Cache'] = 'MISS'
+        return response
+    return wrapper
@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from itertools import islice
+from .serializers import PROPERTY_FEATURE_FIELDS, property_features
+
+EXPORT_CHUNK_SIZE = 2000
+CSV_COLUMNS = ['id', 'lon', 'lat', *PROPERTY_FEATURE_FIELDS]
+
+def _chunks(rows, size=EXPORT_CHUNK_SIZE):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+
+def stream_geojson(rows):
+    yield '{"type":"FeatureCollection","features":['
+    separator = ''
+    for chunk in _chunks(rows):
+        yield separator + ','.join(_dumps(feature) for feature in property_features(chunk))
+        separator = ','
+    yield ']}'
+
+def stream_ndjson(rows):
+    for chunk in _chunks(rows):
+        yield ''.join(_dumps(feature) + '\n' for feature in property_features(chunk))
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for chunk in _chunks(rows):
+        writer.writerows([row[column] for column in CSV_COLUMNS] for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # Flushes the header when there are no rows
+    yield buffer.getvalue()
+
+EXPORT_FORMATS = {
+    'geojson': (stream_geojson, 'application/geo+json'),
+    'ndjson': (stream_ndjson, 'application/x-ndjson'),
+    'csv': (stream_csv, 'text/csv'),
+}
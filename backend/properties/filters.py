@@ -0,0 +1,133 @@
+import math
+from django.contrib.gis.db.models import PointField
+from django.contrib.gis.geos import Point
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import BooleanField, Case, FloatField, Func, Q, Value, When
+from django.db.models.functions import Cast, Greatest
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+MAX_NEAR_K = 1000
+MAX_SEARCH_LENGTH = 100
+# Matched by trigram word similarity, each has a gin_trgm_ops index
+SEARCH_FIELDS = ('name', 'address', 'city')
+
+def location_geography():
+    # Must match the expression of property_location_geog_idx for the planner to use it
+    return Cast('location', output_field=PointField(geography=True))
+
+def parse_near(request) -> Point | None:
+    near = request.query_params.get('near')
+    if near is None:
+        return None
+    try:
+        lon, lat = (float(part) for part in near.split(','))
+    except ValueError:
+        raise ValidationError({'near': 'Expected near=lon,lat'})
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValidationError({'near': 'Longitude must be between -180 and 180 and latitude between -90 and 90'})
+    return Point(lon, lat, srid=4326)
+
+def parse_search(request) -> str | None:
+    term = request.query_params.get('search', '').strip()
+    if not term:
+        return None
+    if len(term) > MAX_SEARCH_LENGTH:
+        raise ValidationError({'search': f'Search must be at most {MAX_SEARCH_LENGTH} characters'})
+    return term
+
+class NearFilter(BaseFilterBackend):
+    # ?near=lon,lat annotates the distance in metres, narrowed by ?radius_m= (ST_DWithin)
+    # and/or ?k= (the k nearest). Both run on the geography index of location.
+    def filter_queryset(self, request, queryset, view):
+        point = parse_near(request)
+        radius = self._radius(request)
+        k = self._k(request)
+        if point is None:
+            if radius is not None or k is not None:
+                raise ValidationError({'near': 'radius_m and k need a near=lon,lat point'})
+            return queryset
+
+        target = Cast(Value(point, output_field=PointField()), output_field=PointField(geography=True))
+        queryset = queryset.annotate(distance=Func(
+            location_geography(), target, arg_joiner=' <-> ', template='(%(expressions)s)',
+            output_field=FloatField()
+        ))
+        if radius is not None:
+            queryset = queryset.filter(Func(
+                location_geography(), target, Value(radius), function='ST_DWithin',
+                output_field=BooleanField()
+            ))
+        if k is not None:
+            # KNN index scan for the ids, the outer query keeps ordering and pagination. Runs after
+            # the other filters, so k counts matching properties rather than all of them.
+            nearest = queryset.order_by('distance', 'id').values('id')[:k]
+            queryset = queryset.filter(id__in=nearest)
+        return queryset
+
+    @staticmethod
+    def _radius(request) -> float | None:
+        radius = request.query_params.get('radius_m')
+        if radius is None:
+            return None
+        try:
+            value = float(radius)
+        except ValueError:
+            value = 0
+        if not (value > 0 and math.isfinite(value)):
+            raise ValidationError({'radius_m': 'Radius must be a positive number of metres'})
+        return value
+
+    @staticmethod
+    def _k(request) -> int | None:
+        k = request.query_params.get('k')
+        if k is None:
+            return None
+        if not k.isdecimal() or not 1 <= int(k) <= MAX_NEAR_K:
+            raise ValidationError({'k': f'k must be a whole number between 1 and {MAX_NEAR_K}'})
+        return int(k)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': 'near', 'required': False, 'in': 'query',
+                'description': 'Point as lon,lat, adds the distance in metres and orders by it',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': 'radius_m', 'required': False, 'in': 'query',
+                'description': 'Only properties within this many metres of near',
+                'schema': {'type': 'number'},
+            },
+            {
+                'name': 'k', 'required': False, 'in': 'query',
+                'description': 'Only the k properties closest to near',
+                'schema': {'type': 'integer', 'maximum': MAX_NEAR_K},
+            },
+        ]
+
+class TrigramSearchFilter(BaseFilterBackend):
+    # ?search= keeps properties whose name, address or city contain a close match of the term
+    # (pg_trgm word similarity) or whose zip code starts with it, and annotates the best
+    # similarity as search_rank (1 for zip code matches)
+    def filter_queryset(self, request, queryset, view):
+        term = parse_search(request)
+        if term is None:
+            return queryset
+        matches = Q(zip_code__startswith=term)
+        for field in SEARCH_FIELDS:
+            matches |= Q(**{f'{field}__trigram_word_similar': term})
+        return queryset.filter(matches).annotate(search_rank=Greatest(
+            *[TrigramWordSimilarity(term, field) for field in SEARCH_FIELDS],
+            Case(When(zip_code__startswith=term, then=Value(1.0)), default=Value(0.0)),
+            output_field=FloatField()
+        ))
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': 'search', 'required': False, 'in': 'query',
+                'description': 'Fuzzy match on name, address and city or a zip code prefix, best matches first',
+                'schema': {'type': 'string', 'maxLength': MAX_SEARCH_LENGTH},
+            },
+        ]
@@ -0,0 +1,191 @@
+import logging
+import os
+import socket
+from datetime import timedelta
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.db.models.functions import Now
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotFound, ValidationError
+from rest_framework.request import Request
+from .bulk import save_features, validate_collection
+from .export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS
+from .models import Job, JobResultChunk
+
+logger = logging.getLogger(__name__)
+
+# A running job without a heartbeat for this long is handed to another worker
+JOB_LEASE = timedelta(minutes=5)
+HEARTBEAT_SECONDS = 30
+MAX_JOB_ATTEMPTS = 3
+# Finished jobs and their results are deleted after this long
+JOB_RETENTION = timedelta(days=7)
+RESULT_CHUNK_BYTES = 1024 * 1024
+
+# The row lock is only held while claiming, SKIP LOCKED lets other workers pass over the
+# job meanwhile. Holding it for the whole job would keep a transaction open, which holds
+# back vacuum and the delta sync watermark, so running jobs are leased instead.
+CLAIM_SQL = f'''
+    UPDATE {Job._meta.db_table} SET status = %(running)s, worker = %(worker)s, attempts = attempts + 1,
+        processed = 0, started_at = now(), heartbeat_at = now()
+    WHERE id = (
+        SELECT id FROM {Job._meta.db_table} WHERE status = %(queued)s
+        ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id
+'''
+
+class JobNotFinished(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The job has not finished successfully, poll its status first'
+    default_code = 'job_not_finished'
+
+def worker_name() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def submit_job(kind: str, params: dict, portfolio=None) -> Job:
+    return Job.objects.create(kind=kind, params=params, portfolio=portfolio)
+
+def export_params(data: dict, query: str) -> dict:
+    export_format = data.get('format', 'geojson')
+    if export_format not in EXPORT_FORMATS:
+        raise ValidationError({'format': f'Expected one of {", ".join(EXPORT_FORMATS)}'})
+    # Invalid filters fail the request rather than the job
+    view = property_view(query)
+    view.filter_queryset(view.get_queryset())
+    return {'format': export_format, 'query': query}
+
+def import_params(data: dict) -> dict:
+    validate_collection(data.get('collection'))
+    return {'collection': data['collection'], 'upsert': data.get('upsert') is True}
+
+def get_job(job_id, **filters) -> Job:
+    # Always read from the primary, a lagging replica would report a stale status
+    job = Job.objects.using(DEFAULT_DB_ALIAS).filter(pk=job_id, **filters).first()
+    if job is None:
+        raise NotFound('Job not found')
+    return job
+
+def result_chunks(job: Job):
+    chunks = JobResultChunk.objects.using(DEFAULT_DB_ALIAS).filter(job=job).order_by('index')
+    for data in chunks.values_list('data', flat=True).iterator(chunk_size=4):
+        yield bytes(data)
+
+def claim_job(worker: str) -> Job | None:
+    with connection.cursor() as cursor:
+        cursor.execute(CLAIM_SQL, {'running': Job.RUNNING, 'queued': Job.QUEUED, 'worker': worker})
+        row = cursor.fetchone()
+    return Job.objects.get(pk=row[0]) if row else None
+
+def heartbeat(worker: str) -> None:
+    Job.objects.filter(status=Job.RUNNING, worker__startswith=f'{worker}:').update(heartbeat_at=Now())
+
+def requeue_stale_jobs() -> int:
+    # Jobs of workers that died, retried until they used up their attempts
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=timezone.now() - JOB_LEASE)
+    stale.filter(attempts__gte=MAX_JOB_ATTEMPTS).update(
+        status=Job.FAILED, error={'detail': 'The worker running the job stopped'}, finished_at=Now()
+    )
+    return stale.update(status=Job.QUEUED, worker='')
+
+def purge_jobs() -> int:
+    return Job.objects.filter(finished_at__lt=timezone.now() - JOB_RETENTION).delete()[0]
+
+def run_job(job: Job) -> None:
+    # Chunks left by an earlier attempt
+    JobResultChunk.objects.filter(job=job).delete()
+    try:
+        JOB_HANDLERS[job.kind](job)
+    except APIException as exc:
+        # The same errors the API would have returned for the request
+        _finish(job, Job.FAILED, error=exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail})
+    except Exception:
+        logger.exception('Job %s failed', job.pk)
+        _finish(job, Job.FAILED, error={'detail': 'The job failed unexpectedly'})
+    else:
+        _finish(job, Job.SUCCEEDED)
+
+def _finish(job: Job, job_status: str, error=None) -> None:
+    # Left alone when the lease expired and another worker took the job over
+    Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker).update(
+        status=job_status, processed=job.processed, total=job.total, result=job.result,
+        content_type=job.content_type, filename=job.filename, error=error, finished_at=Now()
+    )
+
+def _report(job: Job, processed: int, total: int | None = None) -> None:
+    job.processed = processed
+    if total is not None:
+        job.total = total
+    Job.objects.filter(pk=job.pk).update(processed=job.processed, total=job.total)
+
+def _view(viewset, query: str, action: str, **kwargs):
+    # The viewset of the submitting request, so the job filters and serializes the same way
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(query)
+    view = viewset(action=action, args=(), kwargs=kwargs, format_kwarg=None)
+    view.request = Request(request)
+    return view
+
+def property_view(query: str):
+    # views imports this module
+    from .views import PropertyViewSet
+    return _view(PropertyViewSet, query, 'export')
+
+class ResultWriter:
+    def __init__(self, job: Job):
+        self.job = job
+        self.index = 0
+        self.buffer = bytearray()
+
+    def write(self, data: bytes) -> None:
+        self.buffer += data
+        if len(self.buffer) >= RESULT_CHUNK_BYTES:
+            self.flush()
+
+    def flush(self) -> None:
+        if self.buffer:
+            JobResultChunk.objects.create(job=self.job, index=self.index, data=bytes(self.buffer))
+            self.index += 1
+            self.buffer = bytearray()
+
+def run_export(job: Job) -> None:
+    export_format = job.params['format']
+    stream, content_type = EXPORT_FORMATS[export_format]
+    view = property_view(job.params.get('query', ''))
+    queryset = view.filter_queryset(view.get_queryset())
+    _report(job, 0, queryset.count())
+
+    def counted(rows):
+        processed = 0
+        for processed, row in enumerate(rows, 1):
+            if processed % EXPORT_CHUNK_SIZE == 0:
+                _report(job, processed)
+            yield row
+        _report(job, processed)
+
+    writer = ResultWriter(job)
+    for part in stream(counted(view.export_rows(queryset))):
+        writer.write(part.encode())
+    writer.flush()
+    job.content_type = content_type
+    job.filename = f'properties.{export_format}'
+
+def run_import(job: Job) -> None:
+    collection = job.params['collection']
+    _report(job, 0, len(collection['features']))
+    job.result = save_features(collection, upsert=job.params.get('upsert', False))
+    job.processed = job.total
+
+def run_summary(job: Job) -> None:
+    from .views import PortfolioViewSet
+    view = _view(PortfolioViewSet, 'view=summary', 'retrieve', pk=job.portfolio_id)
+    job.result = view.get_serializer(view.get_object()).data
+
+# Job kind -> handler, which stores a JSON result on the job or writes a file result
+JOB_HANDLERS = {
+    'export': run_export,
+    'import': run_import,
+    'summary': run_summary,
+}
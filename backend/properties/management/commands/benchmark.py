@@ -0,0 +1,217 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from properties.models import Job, JobResultChunk, Portfolio, Property, ThrottleBucket
+from properties.pagination import GeoCursorPagination
+from properties.views import PropertyViewSet
+import io
+import json
+import platform
+import statistics
+import time
+
+# Viewports centred on Oslo, from a city block to most of Europe (degrees per side)
+BBOX_SIZES = {'city': 0.1, 'region': 2, 'country': 10, 'continent': 40}
+BBOX_CENTER = (10.7522, 59.9139)
+SCAN_NODES = {'Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan'}
+PAGE_SIZE = 100
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+def rows_scanned(plan):
+    rows = 0
+    if plan.get('Node Type') in SCAN_NODES:
+        loops = plan.get('Actual Loops', 1)
+        rows += (plan.get('Actual Rows', 0) + plan.get('Rows Removed by Filter', 0)) * loops
+    for child in plan.get('Plans', []):
+        rows += rows_scanned(child)
+    return rows
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the properties API against seeded datasets and print the results as JSON. '
+        'Seeding runs inside a transaction that is rolled back, but it locks the property tables '
+        'while running, so use a dedicated database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000], help='Dataset sizes to seed')
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per scenario')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--workers', type=int, default=1, help='Fixture generator worker processes')
+        parser.add_argument('--output', help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--compare', help='Earlier results file to compare p95 latencies against')
+        parser.add_argument('--threshold', type=float, default=1.2, help='p95 ratio that counts as a regression')
+
+    def handle(self, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        self.client = Client(SERVER_NAME=self._server_name())
+        results = {
+            'meta': {
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'iterations': options['iterations'],
+                'seed': options['seed'],
+                'python': platform.python_version(),
+                'postgres': connection.pg_version,
+            },
+            'runs': [],
+        }
+        # The seeded rows are never committed, so replicas would not see them
+        with override_settings(REPLICA_DATABASES=[]):
+            for size in options['sizes']:
+                results['runs'].append(self._run_size(size, options))
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self._compare(results, options['compare'], options['threshold'])
+
+    def _server_name(self):
+        hosts = [host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')]
+        return hosts[0] if hosts else 'localhost'
+
+    def _run_size(self, size, options):
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                # Jobs reference their portfolio
+                cursor.execute(
+                    f'TRUNCATE {Property._meta.db_table}, {Portfolio._meta.db_table}, '
+                    f'{Job._meta.db_table}, {JobResultChunk._meta.db_table}'
+                )
+            started = time.monotonic()
+            call_command(
+                'generate_fixtures', properties=size, seed=options['seed'],
+                workers=options['workers'], stdout=io.StringIO()
+            )
+            seed_seconds = time.monotonic() - started
+            self.stderr.write(f'Seeded {size} properties in {seed_seconds:.1f}s')
+
+            scenarios = [
+                self._measure(name, url, options['iterations'])
+                for name, url in self._scenarios(size)
+            ]
+            transaction.set_rollback(True)
+        return {'size': size, 'seed_seconds': round(seed_seconds, 3), 'scenarios': scenarios}
+
+    def _scenarios(self, size):
+        scenarios = []
+        for field in PropertyViewSet.ordering_fields:
+            scenarios.append((f'list_order_{field}', f'/api/properties/?ordering={field}&page_size={PAGE_SIZE}'))
+            scenarios.append((f'list_order_-{field}', f'/api/properties/?ordering=-{field}&page_size={PAGE_SIZE}'))
+
+        lon, lat = BBOX_CENTER
+        for name, side in BBOX_SIZES.items():
+            bbox = f'{lon - side / 2},{lat - side / 2},{lon + side / 2},{lat + side / 2}'
+            scenarios.append((f'bbox_{name}', f'/api/properties/?in_bbox={bbox}&page_size={PAGE_SIZE}'))
+            # A few thousand cells per viewport at every size
+            cell_size = side * 111000 / 50
+            scenarios.append((f'heatmap_{name}', f'/api/properties/heatmap/?in_bbox={bbox}&cell_size={cell_size}'))
+
+        # Map layer payload: only the risk per point with coordinates rounded to about a metre
+        scenarios.append((
+            'list_sparse', f'/api/properties/?fields=total_financial_risk&precision=5&page_size={PAGE_SIZE}'
+        ))
+        scenarios.append(('search', f'/api/properties/?search=Karl+Johans+gate+12&page_size={PAGE_SIZE}'))
+        scenarios.append(('autocomplete', '/api/properties/autocomplete/?search=Karl+Joh'))
+        scenarios.append(('list_columnar', f'/api/properties/?format=columnar&page_size={PAGE_SIZE}'))
+
+        portfolio = Portfolio.objects.order_by('id').first()
+        if portfolio is not None:
+            scenarios.append(('portfolio_filter', f'/api/properties/?portfolio={portfolio.pk}&page_size={PAGE_SIZE}'))
+
+        last_page = max(1, -(-size // PAGE_SIZE))
+        scenarios.append(('page_middle', f'/api/properties/?page={max(1, last_page // 2)}&page_size={PAGE_SIZE}'))
+        scenarios.append(('page_last', f'/api/properties/?page={last_page}&page_size={PAGE_SIZE}'))
+        deep_id = Property.objects.order_by('id').values_list('id', flat=True)[max(0, size - PAGE_SIZE - 1):].first()
+        if deep_id is not None:
+            cursor = GeoCursorPagination.encode_position([deep_id])
+            scenarios.append(('cursor_last', f'/api/properties/?pagination=cursor&cursor={cursor}&page_size={PAGE_SIZE}'))
+
+        scenarios.append(('portfolio_list', '/api/portfolios/'))
+        scenarios.append(('portfolio_summary', '/api/portfolios/?view=summary'))
+        return scenarios
+
+    def _measure(self, name, url, iterations):
+        # Cached responses and throttle history are cleared so every request does the full work
+        self._reset_caches()
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url)
+        queries = [query['sql'] for query in captured.captured_queries]
+        compressed = {}
+        for encoding in ('gzip', 'br'):
+            self._reset_caches()
+            compressed[encoding] = len(self.client.get(url, HTTP_ACCEPT_ENCODING=encoding).content)
+
+        timings = []
+        for _ in range(iterations):
+            self._reset_caches()
+            started = time.perf_counter()
+            self.client.get(url)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        return {
+            'name': name,
+            'url': url,
+            'status': response.status_code,
+            'bytes': len(response.content),
+            'bytes_gzip': compressed['gzip'],
+            'bytes_br': compressed['br'],
+            'queries': len(queries),
+            'sql_ms': round(sum(float(query['time']) for query in captured.captured_queries) * 1000, 3),
+            'rows_scanned': self._rows_scanned(queries),
+            'latency_ms': {
+                'min': round(min(timings), 3),
+                'mean': round(statistics.fmean(timings), 3),
+                'p50': round(percentile(timings, 0.50), 3),
+                'p90': round(percentile(timings, 0.90), 3),
+                'p95': round(percentile(timings, 0.95), 3),
+                'p99': round(percentile(timings, 0.99), 3),
+                'max': round(max(timings), 3),
+            },
+        }
+
+    def _reset_caches(self):
+        caches['api'].clear()
+        ThrottleBucket.objects.all().delete()
+
+    def _rows_scanned(self, queries):
+        rows = 0
+        with connection.cursor() as cursor:
+            for sql in queries:
+                if not sql.lstrip().upper().startswith('SELECT') or 'properties_' not in sql:
+                    continue
+                cursor.execute(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}')
+                rows += rows_scanned(cursor.fetchone()[0][0]['Plan'])
+        return rows
+
+    def _compare(self, results, path, threshold):
+        with open(path) as file:
+            baseline = json.load(file)
+        previous = {
+            (run['size'], scenario['name']): scenario['latency_ms']['p95']
+            for run in baseline['runs'] for scenario in run['scenarios']
+        }
+        regressions = []
+        for run in results['runs']:
+            for scenario in run['scenarios']:
+                before = previous.get((run['size'], scenario['name']))
+                after = scenario['latency_ms']['p95']
+                if before and after / before > threshold:
+                    regressions.append(f"{scenario['name']} @ {run['size']}: p95 {before}ms -> {after}ms")
+        if regressions:
+            raise CommandError('Performance regressions found:\n' + '\n'.join(regressions))
+        self.stderr.write(self.style.SUCCESS('No p95 regressions against the baseline'))
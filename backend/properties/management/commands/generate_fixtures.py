@@ -1,113 +1,168 @@
-from django.core.management.base import BaseCommand
-from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from multiprocessing import Pool
+from properties.cache import invalidate_portfolios
 from properties.models import Portfolio, Property
+import io
 import random
+import time
+
+PORTFOLIO_NAMES = [
+    "Oslo Portfolio",
+    "Bergen Portfolio",
+    "Trondheim Portfolio",
+    "Stavanger Portfolio",
+    "Nordic Portfolio",
+    "Central Europe Portfolio",
+    "Southern Europe Portfolio",
+]
+
+# 'group' points at the portfolio in PORTFOLIO_NAMES that owns the city
+CITIES = {
+    'Oslo': {'lat': 59.9139, 'lon': 10.7522, 'radius': 0.05, 'group': 0},
+    'Bergen': {'lat': 60.3913, 'lon': 5.3242, 'radius': 0.04, 'group': 1},
+    'Trondheim': {'lat': 63.4305, 'lon': 10.3951, 'radius': 0.04, 'group': 2},
+    'Stavanger': {'lat': 58.9700, 'lon': 5.7331, 'radius': 0.03, 'group': 3},
+    'Stockholm': {'lat': 59.3293, 'lon': 18.0686, 'radius': 0.06, 'group': 4},
+    'Copenhagen': {'lat': 55.6761, 'lon': 12.5683, 'radius': 0.05, 'group': 4},
+    'Helsinki': {'lat': 60.1699, 'lon': 24.9384, 'radius': 0.05, 'group': 4},
+    'Berlin': {'lat': 52.5200, 'lon': 13.4050, 'radius': 0.08, 'group': 5},
+    'Munich': {'lat': 48.1351, 'lon': 11.5820, 'radius': 0.06, 'group': 5},
+    'Amsterdam': {'lat': 52.3676, 'lon': 4.9041, 'radius': 0.05, 'group': 5},
+    'Brussels': {'lat': 50.8503, 'lon': 4.3517, 'radius': 0.05, 'group': 5},
+    'Paris': {'lat': 48.8566, 'lon': 2.3522, 'radius': 0.07, 'group': 5},
+    'Vienna': {'lat': 48.2082, 'lon': 16.3738, 'radius': 0.06, 'group': 5},
+    'Zurich': {'lat': 47.3769, 'lon': 8.5417, 'radius': 0.04, 'group': 5},
+    'Madrid': {'lat': 40.4168, 'lon': -3.7038, 'radius': 0.07, 'group': 6},
+    'Barcelona': {'lat': 41.3851, 'lon': 2.1734, 'radius': 0.06, 'group': 6},
+    'Rome': {'lat': 41.9028, 'lon': 12.4964, 'radius': 0.07, 'group': 6},
+    'Milan': {'lat': 45.4642, 'lon': 9.1900, 'radius': 0.06, 'group': 6},
+    'Athens': {'lat': 37.9838, 'lon': 23.7275, 'radius': 0.06, 'group': 6},
+    'Lisbon': {'lat': 38.7223, 'lon': -9.1393, 'radius': 0.05, 'group': 6},
+}
+
+NORWEGIAN_STREETS = {
+    'Oslo': ['Karl Johans gate', 'Grønland', 'Torggata', 'Bogstadveien', 'Møllergata'],
+    'Bergen': ['Torgallmenningen', 'Bryggen', 'Strandgaten', 'Kong Oscars gate', 'Marken'],
+    'Trondheim': ['Munkegata', 'Nordre gate', 'Olav Tryggvasons gate', 'Thomas Angells gate', 'Fjordgata'],
+    'Stavanger': ['Øvre Holmegate', 'Kirkegata', 'Pedersgata', 'Kongsgata', 'Løkkeveien']
+}
+
+EUROPEAN_STREET_PATTERNS = [
+    "Main Street", "High Street", "Church Street", "Market Street",
+    "Station Road", "Park Avenue", "Royal Street", "Castle Road",
+    "Harbor Street", "Lake View", "Mountain Road", "River Street",
+    "Old Town Road", "New Street", "West Street", "East Street"
+]
+
+EUROPEAN_CITIES = [city for city in CITIES if city not in NORWEGIAN_STREETS]
+
+# Same split as the original 50 Norwegian / 450 European fixtures
+NORWEGIAN_SHARE = 0.1
+
+COPY_COLUMNS = [
+    'portfolio_id', 'name', 'address', 'zip_code', 'city', 'location',
+    'estimated_value', 'relevant_risks', 'handled_risks', 'total_financial_risk'
+]
+
+def generate_rows(args):
+    # Runs in worker processes, so it only returns text ready for COPY
+    chunk_index, size, seed, group_portfolio_ids = args
+    rng = random.Random(seed * 1000003 + chunk_index)
+    buffer = io.StringIO()
+    for _ in range(size):
+        if rng.random() < NORWEGIAN_SHARE:
+            city = rng.choice(list(NORWEGIAN_STREETS))
+            street = rng.choice(NORWEGIAN_STREETS[city])
+            street_number = rng.randint(1, 100)
+            value = rng.randint(5000000, 50000000)
+            relevant_risks = rng.randint(1, 10)
+            risk_percentage = rng.uniform(0.02, 0.10)
+        else:
+            city = rng.choice(EUROPEAN_CITIES)
+            street = f"{rng.choice(EUROPEAN_STREET_PATTERNS)} {rng.choice(['North', 'South', 'East', 'West', ''])}".strip()
+            street_number = rng.randint(1, 200)
+            value = rng.randint(200000, 10000000)
+            relevant_risks = rng.randint(1, 15)
+            risk_percentage = rng.uniform(0.02, 0.15)
+        city_data = CITIES[city]
+        lat = city_data['lat'] + rng.uniform(-city_data['radius'], city_data['radius'])
+        lon = city_data['lon'] + rng.uniform(-city_data['radius'], city_data['radius'])
+        handled_risks = rng.randint(0, relevant_risks)
+        portfolio_id = rng.choice(group_portfolio_ids[city_data['group']])
+        name = f"{street} {street_number}"
+        zip_code = f"{rng.randint(0, 9999):04d}"
+        buffer.write(
+            f"{portfolio_id}\t{name}\t{name}\t{zip_code}\t{city}\tSRID=4326;POINT({lon} {lat})\t"
+            f"{value}\t{relevant_risks}\t{handled_risks}\t{int(value * risk_percentage)}\n"
+        )
+    return buffer.getvalue()
 
 class Command(BaseCommand):
-    def handle(self, **_):
-        norwegian_portfolios = [
-            Portfolio.objects.create(name="Oslo Portfolio"),
-            Portfolio.objects.create(name="Bergen Portfolio"),
-            Portfolio.objects.create(name="Trondheim Portfolio"),
-            Portfolio.objects.create(name="Stavanger Portfolio")
-        ]
+    help = 'Generate portfolios and properties spread across Norwegian and European cities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--properties', type=int, default=500, help='Number of properties to create')
+        parser.add_argument('--portfolios', type=int, default=len(PORTFOLIO_NAMES), help='Number of portfolios to create')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible data')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per COPY batch')
+        parser.add_argument('--workers', type=int, default=1, help='Processes generating rows in parallel')
 
-        european_portfolios = [
-            Portfolio.objects.create(name="Nordic Portfolio"),
-            Portfolio.objects.create(name="Central Europe Portfolio"),
-            Portfolio.objects.create(name="Southern Europe Portfolio"),
+    def handle(self, **options):
+        total = options['properties']
+        portfolio_count = options['portfolios']
+        batch_size = options['batch_size']
+        workers = options['workers']
+        seed = options['seed'] if options['seed'] is not None else random.randrange(2 ** 31)
+        if total < 0 or portfolio_count < 1 or batch_size < 1 or workers < 1:
+            raise CommandError('--properties must be >= 0 and --portfolios, --batch-size and --workers >= 1')
+
+        started = time.monotonic()
+        portfolios = Portfolio.objects.bulk_create([
+            Portfolio(name=self._portfolio_name(index)) for index in range(portfolio_count)
+        ])
+        # Every city group gets the portfolios index % 7 == group, wrapping when there are fewer than 7
+        group_portfolio_ids = [
+            [p.pk for index, p in enumerate(portfolios) if index % len(PORTFOLIO_NAMES) == group]
+            or [portfolios[group % portfolio_count].pk]
+            for group in range(len(PORTFOLIO_NAMES))
         ]
 
-        cities = {
-            'Oslo': {'lat': 59.9139, 'lon': 10.7522, 'radius': 0.05, 'portfolio': norwegian_portfolios[0]},
-            'Bergen': {'lat': 60.3913, 'lon': 5.3242, 'radius': 0.04, 'portfolio': norwegian_portfolios[1]},
-            'Trondheim': {'lat': 63.4305, 'lon': 10.3951, 'radius': 0.04, 'portfolio': norwegian_portfolios[2]},
-            'Stavanger': {'lat': 58.9700, 'lon': 5.7331, 'radius': 0.03, 'portfolio': norwegian_portfolios[3]},
-            'Stockholm': {'lat': 59.3293, 'lon': 18.0686, 'radius': 0.06, 'portfolio': european_portfolios[0]},
-            'Copenhagen': {'lat': 55.6761, 'lon': 12.5683, 'radius': 0.05, 'portfolio': european_portfolios[0]},
-            'Helsinki': {'lat': 60.1699, 'lon': 24.9384, 'radius': 0.05, 'portfolio': european_portfolios[0]},
-            'Berlin': {'lat': 52.5200, 'lon': 13.4050, 'radius': 0.08, 'portfolio': european_portfolios[1]},
-            'Munich': {'lat': 48.1351, 'lon': 11.5820, 'radius': 0.06, 'portfolio': european_portfolios[1]},
-            'Amsterdam': {'lat': 52.3676, 'lon': 4.9041, 'radius': 0.05, 'portfolio': european_portfolios[1]},
-            'Brussels': {'lat': 50.8503, 'lon': 4.3517, 'radius': 0.05, 'portfolio': european_portfolios[1]},
-            'Paris': {'lat': 48.8566, 'lon': 2.3522, 'radius': 0.07, 'portfolio': european_portfolios[1]},
-            'Vienna': {'lat': 48.2082, 'lon': 16.3738, 'radius': 0.06, 'portfolio': european_portfolios[1]},
-            'Zurich': {'lat': 47.3769, 'lon': 8.5417, 'radius': 0.04, 'portfolio': european_portfolios[1]},
-            'Madrid': {'lat': 40.4168, 'lon': -3.7038, 'radius': 0.07, 'portfolio': european_portfolios[2]},
-            'Barcelona': {'lat': 41.3851, 'lon': 2.1734, 'radius': 0.06, 'portfolio': european_portfolios[2]},
-            'Rome': {'lat': 41.9028, 'lon': 12.4964, 'radius': 0.07, 'portfolio': european_portfolios[2]},
-            'Milan': {'lat': 45.4642, 'lon': 9.1900, 'radius': 0.06, 'portfolio': european_portfolios[2]},
-            'Athens': {'lat': 37.9838, 'lon': 23.7275, 'radius': 0.06, 'portfolio': european_portfolios[2]},
-            'Lisbon': {'lat': 38.7223, 'lon': -9.1393, 'radius': 0.05, 'portfolio': european_portfolios[2]},
-        }
-
-        norwegian_streets = {
-            'Oslo': ['Karl Johans gate', 'Grønland', 'Torggata', 'Bogstadveien', 'Møllergata'],
-            'Bergen': ['Torgallmenningen', 'Bryggen', 'Strandgaten', 'Kong Oscars gate', 'Marken'],
-            'Trondheim': ['Munkegata', 'Nordre gate', 'Olav Tryggvasons gate', 'Thomas Angells gate', 'Fjordgata'],
-            'Stavanger': ['Øvre Holmegate', 'Kirkegata', 'Pedersgata', 'Kongsgata', 'Løkkeveien']
-        }
-
-        european_street_patterns = [
-            "Main Street", "High Street", "Church Street", "Market Street",
-            "Station Road", "Park Avenue", "Royal Street", "Castle Road",
-            "Harbor Street", "Lake View", "Mountain Road", "River Street",
-            "Old Town Road", "New Street", "West Street", "East Street"
+        chunks = [
+            (index, min(batch_size, total - start), seed, group_portfolio_ids)
+            for index, start in enumerate(range(0, total, batch_size))
         ]
+        copy_sql = f"COPY {Property._meta.db_table} ({', '.join(COPY_COLUMNS)}) FROM STDIN"
+        created = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            if workers > 1:
+                with Pool(workers) as pool:
+                    for rows in pool.imap(generate_rows, chunks):
+                        created = self._copy(cursor, copy_sql, rows, created, total)
+            else:
+                for chunk in chunks:
+                    created = self._copy(cursor, copy_sql, generate_rows(chunk), created, total)
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Property._meta.db_table}")
 
-        for _ in range(50):
-            city = random.choice(['Oslo', 'Bergen', 'Trondheim', 'Stavanger'])
-            city_data = cities[city]
-            lat = city_data['lat'] + random.uniform(-city_data['radius'], city_data['radius'])
-            lon = city_data['lon'] + random.uniform(-city_data['radius'], city_data['radius'])
-            street = random.choice(norwegian_streets[city])
-            street_number = random.randint(1, 100)
-            relevant_risks = random.randint(1, 10)
-            handled_risks = random.randint(0, relevant_risks)
-            value = random.randint(5000000, 50000000)
-            risk_percentage = random.uniform(0.02, 0.10)
-            financial_risk = int(value * risk_percentage)
-
-            Property.objects.create(
-                portfolio=city_data['portfolio'],
-                name=f"{street} {street_number}",
-                address=f"{street} {street_number}",
-                zip_code=f"{random.randint(0, 9)}{random.randint(0, 9)}{random.randint(0, 9)}{random.randint(0, 9)}",
-                city=city,
-                location=Point(lon, lat),
-                estimated_value=value,
-                relevant_risks=relevant_risks,
-                handled_risks=handled_risks,
-                total_financial_risk=financial_risk
-            )
-
-        for _ in range(450):
-            city = random.choice([c for c in cities.keys() if c not in norwegian_streets])
-            city_data = cities[city]
-            lat = city_data['lat'] + random.uniform(-city_data['radius'], city_data['radius'])
-            lon = city_data['lon'] + random.uniform(-city_data['radius'], city_data['radius'])
-            street = f"{random.choice(european_street_patterns)} {random.choice(['North', 'South', 'East', 'West', ''])}"
-            street_number = random.randint(1, 200)
-            value = random.randint(200000, 10000000)
-            relevant_risks = random.randint(1, 15)
-            handled_risks = random.randint(0, relevant_risks)
-            risk_percentage = random.uniform(0.02, 0.15)
-            financial_risk = int(value * risk_percentage)
-
-            Property.objects.create(
-                portfolio=city_data['portfolio'],
-                name=f"{street.strip()} {street_number}",
-                address=f"{street.strip()} {street_number}",
-                zip_code=f"{random.randint(0, 9)}{random.randint(0, 9)}{random.randint(0, 9)}{random.randint(0, 9)}",
-                city=city,
-                location=Point(lon, lat),
-                estimated_value=value,
-                relevant_risks=relevant_risks,
-                handled_risks=handled_risks,
-                total_financial_risk=financial_risk
-            )
+        # Property writes do not invalidate cached API responses by themselves
+        invalidate_portfolios([p.pk for p in portfolios])
 
         self.stdout.write(self.style.SUCCESS(
-            f'Successfully created {len(norwegian_portfolios) + len(european_portfolios)} portfolios '
-            f'and {Property.objects.count()} properties across Europe'
+            f'Successfully created {len(portfolios)} portfolios '
+            f'and {created} properties across Europe in {time.monotonic() - started:.1f}s (seed {seed})'
         ))
+
+    def _copy(self, cursor, copy_sql, rows, created, total):
+        cursor.copy_expert(copy_sql, io.StringIO(rows))
+        created += rows.count('\n')
+        if total > 100000:
+            self.stdout.write(f'{created}/{total} properties')
+        return created
+
+    @staticmethod
+    def _portfolio_name(index):
+        name = PORTFOLIO_NAMES[index % len(PORTFOLIO_NAMES)]
+        if index < len(PORTFOLIO_NAMES):
+            return name
+        return f"{name} {index // len(PORTFOLIO_NAMES) + 1}"
@@ -0,0 +1,69 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from urllib.request import urlopen
+from .benchmark import percentile
+import json
+import statistics
+import time
+
+class Command(BaseCommand):
+    help = (
+        'Send concurrent GET requests to a running server and print throughput and latency as JSON. '
+        'Run it against both the WSGI and ASGI deployments to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs to request, cycled through by every client')
+        parser.add_argument('--concurrency', type=int, default=50, help='Simultaneous clients')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request fails')
+
+    def handle(self, **options):
+        if options['concurrency'] < 1 or options['duration'] <= 0:
+            raise CommandError('--concurrency must be at least 1 and --duration positive')
+
+        deadline = time.monotonic() + options['duration']
+        started = time.monotonic()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            clients = [
+                pool.submit(self._client, options['urls'], index, deadline, options['timeout'])
+                for index in range(options['concurrency'])
+            ]
+            results = [client.result() for client in clients]
+        elapsed = time.monotonic() - started
+
+        timings = [timing for client_timings, _ in results for timing in client_timings]
+        errors = sum(client_errors for _, client_errors in results)
+        summary = {
+            'urls': options['urls'],
+            'concurrency': options['concurrency'],
+            'duration_s': round(elapsed, 3),
+            'requests': len(timings) + errors,
+            'errors': errors,
+            'rps': round(len(timings) / elapsed, 2),
+        }
+        if timings:
+            summary['latency_ms'] = {
+                'mean': round(statistics.fmean(timings), 3),
+                'p50': round(percentile(timings, 0.50), 3),
+                'p95': round(percentile(timings, 0.95), 3),
+                'p99': round(percentile(timings, 0.99), 3),
+                'max': round(max(timings), 3),
+            }
+        self.stdout.write(json.dumps(summary, indent=2))
+
+    def _client(self, urls, index, deadline, timeout):
+        timings = []
+        errors = 0
+        while time.monotonic() < deadline:
+            url = urls[index % len(urls)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                with urlopen(url, timeout=timeout) as response:
+                    response.read()
+            except OSError:
+                errors += 1
+                continue
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings, errors
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from properties.models import Portfolio
+from properties.partitions import (
+    PARTITION_MIN_ROWS, PartitionBusy, attach_portfolio_partition, drop_orphaned_partitions, partition_candidates,
+    partition_name
+)
+import time
+
+class Command(BaseCommand):
+    help = 'Move large portfolios from the default property partition into partitions of their own'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-rows', type=int, default=PARTITION_MIN_ROWS,
+            help='Partition every portfolio with at least this many properties'
+        )
+        parser.add_argument(
+            '--portfolio', type=int, action='append', default=[],
+            help='Partition this portfolio regardless of its size, may be repeated'
+        )
+
+    def handle(self, **options):
+        try:
+            self.partition(options)
+        except PartitionBusy as exc:
+            raise CommandError(f'{exc.detail}, the partitions moved so far are kept')
+
+    def partition(self, options):
+        started = time.monotonic()
+        for portfolio_id in drop_orphaned_partitions():
+            self.stdout.write(f'Dropped {partition_name(portfolio_id)}, its portfolio no longer exists')
+
+        portfolio_ids = options['portfolio'] or partition_candidates(options['min_rows'])
+        missing = set(portfolio_ids) - set(Portfolio.objects.filter(pk__in=portfolio_ids).values_list('pk', flat=True))
+        if missing:
+            raise CommandError(f'Unknown portfolios: {", ".join(map(str, sorted(missing)))}')
+
+        moved = 0
+        for portfolio_id in portfolio_ids:
+            step = time.monotonic()
+            if attach_portfolio_partition(portfolio_id):
+                moved += 1
+                self.stdout.write(f'Moved portfolio {portfolio_id} to {partition_name(portfolio_id)} ({time.monotonic() - step:.1f}s)')
+            else:
+                self.stdout.write(f'Portfolio {portfolio_id} already has a partition')
+        self.stdout.write(self.style.SUCCESS(
+            f'Partitioned {moved} portfolios in {time.monotonic() - started:.1f}s'
+        ))
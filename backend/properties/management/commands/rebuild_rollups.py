@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from properties.rollups import check_rollups, rebuild_rollups
+import time
+
+class Command(BaseCommand):
+    help = 'Recompute the portfolio and city risk rollups from the property table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only compare the stored rollups with a full recompute and fail on differences'
+        )
+
+    def handle(self, **options):
+        started = time.monotonic()
+        if options['check']:
+            differences = check_rollups()
+            if differences:
+                raise CommandError(f'{len(differences)} rollup rows differ:\n' + '\n'.join(differences))
+            self.stdout.write(self.style.SUCCESS(f'Rollups are consistent ({time.monotonic() - started:.1f}s)'))
+            return
+
+        rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups in {time.monotonic() - started:.1f}s'))
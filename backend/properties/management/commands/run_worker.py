@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, close_old_connections, connections
+from properties.jobs import (
+    HEARTBEAT_SECONDS, claim_job, heartbeat, purge_jobs, requeue_stale_jobs, run_job, worker_name
+)
+import logging
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (exports, imports, portfolio summaries) until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Jobs run at the same time, one thread each')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between queue checks when idle')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('Concurrency must be at least 1')
+        name = worker_name()
+        stopping = threading.Event()
+        # Running jobs are finished on SIGTERM, a job cut off by SIGKILL is requeued once its lease expires
+        previous = {
+            signum: signal.signal(signum, lambda *args: stopping.set()) for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        threads = [
+            threading.Thread(target=self.work, args=(f'{name}:{index}', stopping, options), daemon=True)
+            for index in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'Worker {name} running {len(threads)} jobs at a time')
+        try:
+            last_maintenance = 0.0
+            while alive := [thread for thread in threads if thread.is_alive()]:
+                if time.monotonic() - last_maintenance >= HEARTBEAT_SECONDS:
+                    self.maintain(name)
+                    last_maintenance = time.monotonic()
+                alive[0].join(timeout=1)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def maintain(self, name):
+        try:
+            heartbeat(name)
+            if requeued := requeue_stale_jobs():
+                self.stdout.write(f'Requeued {requeued} jobs of stopped workers')
+            purge_jobs()
+        except DatabaseError:
+            logger.exception('Job maintenance failed')
+
+    def work(self, name, stopping, options):
+        try:
+            while not stopping.is_set():
+                close_old_connections()
+                try:
+                    job = claim_job(name)
+                except DatabaseError:
+                    # The database may still be starting or migrating
+                    logger.exception('Claiming a job failed')
+                    job = None
+                if job is None:
+                    if options['burst']:
+                        return
+                    stopping.wait(options['poll_interval'])
+                    continue
+                started = time.monotonic()
+                run_job(job)
+                job.refresh_from_db(fields=['status'])
+                self.stdout.write(f'{name} {job.kind} job {job.pk} {job.status} in {time.monotonic() - started:.1f}s')
+        finally:
+            connections.close_all()
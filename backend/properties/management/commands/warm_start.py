@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from pathlib import Path
+from properties.models import Portfolio
+from properties.snapshot import restore_snapshot, save_snapshot, snapshot_matches
+import time
+
+class Command(BaseCommand):
+    help = 'Prepare the database for serving, skipping migrations and seed data that are already in place'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--snapshot', type=Path, default=settings.SEED_SNAPSHOT_DIR,
+            help='Directory of the binary COPY snapshot of the seed data'
+        )
+        parser.add_argument('--properties', type=int, default=None, help='Properties to generate without a snapshot')
+        parser.add_argument('--seed', type=int, default=None, help='Seed for the generated data')
+
+    def handle(self, **options):
+        started = time.monotonic()
+        timings = []
+
+        step = time.monotonic()
+        executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            call_command('migrate', interactive=False, stdout=self.stdout)
+            timings.append(f'migrate {time.monotonic() - step:.1f}s')
+        else:
+            timings.append('migrations up to date')
+        # Checks for the table itself and only creates it when missing
+        call_command('createcachetable')
+
+        step = time.monotonic()
+        snapshot = options['snapshot']
+        if Portfolio.objects.using(DEFAULT_DB_ALIAS).exists():
+            timings.append('data already loaded')
+        elif snapshot_matches(snapshot):
+            counts = restore_snapshot(snapshot)
+            rows = ', '.join(f'{count} {table}' for table, count in counts.items())
+            timings.append(f'restored {rows} from {snapshot} in {time.monotonic() - step:.1f}s')
+        else:
+            fixtures = {key: options[key] for key in ('properties', 'seed') if options[key] is not None}
+            call_command('generate_fixtures', stdout=self.stdout, **fixtures)
+            save_snapshot(snapshot)
+            timings.append(f'generated seed data and saved a snapshot in {time.monotonic() - step:.1f}s')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Warm start in {time.monotonic() - started:.1f}s: {"; ".join(timings)}'
+        ))
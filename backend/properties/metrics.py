@@ -0,0 +1,258 @@
+import json
+import logging
+import threading
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from collections import Counter
+from contextlib import ExitStack, contextmanager, nullcontext
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, connections
+from django.http import HttpResponse
+from .models import MetricSample
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds for the latency histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Family name -> (type, help)
+METRICS = {
+    'api_requests_total': ('counter', 'Requests handled, by view, action, method and status'),
+    'api_request_duration_seconds': ('histogram', 'Total request latency'),
+    'api_db_queries_total': ('counter', 'SQL queries run by requests'),
+    'api_db_duration_seconds_total': ('counter', 'Time spent in SQL queries'),
+    'api_serialize_duration_seconds_total': ('counter', 'Time spent serializing rows, without their queries'),
+    'api_render_duration_seconds_total': ('counter', 'Time spent rendering responses'),
+}
+
+UPSERT_SQL = f'''
+    INSERT INTO {MetricSample._meta.db_table} AS sample (name, labels, value)
+    VALUES {{values}}
+    ON CONFLICT (name, labels) DO UPDATE SET value = sample.value + EXCLUDED.value
+'''
+
+class RequestTimings:
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+        self.render_started = None
+        self.explaining = False
+
+    def execute(self, execute, sql, params, many, context):
+        if self.explaining:
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        elapsed = time.perf_counter() - started
+        self.queries += 1
+        self.sql_seconds += elapsed
+        if elapsed * 1000 >= settings.SLOW_QUERY_MS:
+            self.log_slow_query(context['connection'], sql, params, many, elapsed)
+        return result
+
+    def log_slow_query(self, db, sql, params, many, elapsed):
+        plan = None
+        if not many and sql.lstrip().upper().startswith('SELECT'):
+            # A separate cursor, the results of the slow query may not have been read yet
+            self.explaining = True
+            try:
+                with db.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN {sql}', params)
+                    plan = '\n'.join(row[0] for row in cursor.fetchall())
+            finally:
+                self.explaining = False
+        logger.warning('Slow query (%.1f ms): %s\n%s', elapsed * 1000, sql, plan or 'No plan')
+
+    @contextmanager
+    def serializing(self):
+        # Lazy querysets run their query while being serialized, that time counts as SQL
+        started, sql_before = time.perf_counter(), self.sql_seconds
+        try:
+            yield
+        finally:
+            self.serialize_seconds += time.perf_counter() - started - (self.sql_seconds - sql_before)
+
+    def start_render(self, response):
+        self.render_started = time.perf_counter()
+        response.add_post_render_callback(self.end_render)
+
+    def end_render(self, response):
+        self.render_seconds = time.perf_counter() - self.render_started
+
+class MetricsRegistry:
+    # Samples are summed in memory and added to the shared table in one upsert, so every
+    # worker contributes to the same series without a query per request
+    flush_seconds = 10
+
+    def __init__(self):
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        self.last_flush = time.monotonic()
+        self.stopping = threading.Event()
+
+    def record(self, view, action, method, status, duration, timings):
+        labels = {'view': view, 'action': action}
+        with self.lock:
+            self.pending['api_requests_total', _label_key({**labels, 'method': method, 'status': str(status)})] += 1
+            # Every bucket is written, even with 0, so each series exposes the full histogram
+            for bound in LATENCY_BUCKETS:
+                self.pending['api_request_duration_seconds_bucket', _label_key({**labels, 'le': str(bound)})] += int(duration <= bound)
+            self.pending['api_request_duration_seconds_bucket', _label_key({**labels, 'le': '+Inf'})] += 1
+            self.pending['api_request_duration_seconds_sum', _label_key(labels)] += duration
+            self.pending['api_request_duration_seconds_count', _label_key(labels)] += 1
+            self.pending['api_db_queries_total', _label_key(labels)] += timings.queries
+            self.pending['api_db_duration_seconds_total', _label_key(labels)] += timings.sql_seconds
+            self.pending['api_serialize_duration_seconds_total', _label_key(labels)] += timings.serialize_seconds
+            self.pending['api_render_duration_seconds_total', _label_key(labels)] += timings.render_seconds
+
+    def flush_due(self) -> bool:
+        return time.monotonic() - self.last_flush >= self.flush_seconds
+
+    def flush(self) -> None:
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.last_flush = time.monotonic()
+        if not pending:
+            return
+        rows = sorted(pending.items())
+        values = ', '.join(['(%s, %s, %s)'] * len(rows))
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    UPSERT_SQL.format(values=values),
+                    [param for (name, labels), value in rows for param in (name, labels, value)]
+                )
+        except DatabaseError:
+            # Kept for the next flush rather than lost
+            with self.lock:
+                self.pending.update(pending)
+            raise
+
+    def start_flushing(self) -> threading.Thread:
+        # Runs in each worker after the fork, an idle worker still flushes its last samples
+        thread = threading.Thread(target=self._flush_periodically, name='metrics-flush', daemon=True)
+        thread.start()
+        return thread
+
+    def _flush_periodically(self) -> None:
+        while not self.stopping.wait(self.flush_seconds):
+            close_old_connections()
+            try:
+                self.flush()
+            except DatabaseError:
+                logger.exception('Flushing metrics failed')
+        connection.close()
+
+    def stop(self) -> None:
+        # On worker exit, whatever was recorded since the last flush
+        self.stopping.set()
+        self.flush()
+
+    def render(self) -> str:
+        self.flush()
+        samples = {}
+        for name, labels, value in MetricSample.objects.values_list('name', 'labels', 'value'):
+            family = name
+            for suffix in ('_bucket', '_sum', '_count'):
+                if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                    family = name[:-len(suffix)]
+            samples.setdefault(family, []).append((name, json.loads(labels), value))
+
+        lines = []
+        for family, (kind, description) in METRICS.items():
+            lines.append(f'# HELP {family} {description}')
+            lines.append(f'# TYPE {family} {kind}')
+            for name, labels, value in sorted(samples.get(family, []), key=_sample_order):
+                keys = sorted(key for key in labels if key != 'le') + (['le'] if 'le' in labels else [])
+                label_text = ','.join(f'{key}="{_escape(labels[key])}"' for key in keys)
+                lines.append(f'{name}{{{label_text}}} {value!r}')
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+
+def _label_key(labels: dict) -> str:
+    return json.dumps(labels, sort_keys=True)
+
+def _sample_order(sample):
+    name, labels, _ = sample
+    others = sorted((key, value) for key, value in labels.items() if key != 'le')
+    le = labels.get('le')
+    return (name, others, float('inf') if le == '+Inf' else float(le or 0))
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def serializing(request):
+    timings = getattr(request, 'timings', None)
+    return timings.serializing() if timings is not None else nullcontext()
+
+def _view_labels(request):
+    match = request.resolver_match
+    if match is None:
+        # Unmatched paths share one series so 404 scans cannot blow up the label count
+        return 'unmatched', request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return match.view_name, actions.get(request.method.lower(), request.method.lower())
+
+class InstrumentationMiddleware:
+    # Times SQL, rendering and the whole request, reports them in Server-Timing and feeds
+    # the /metrics histograms. Async views only get latency and render timings, their
+    # queries run on threads the execute wrapper is not installed on.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        request.timings = RequestTimings()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(request.timings.execute))
+            response = self.get_response(request)
+        self.finish(request, response, started)
+        if metrics.flush_due():
+            try:
+                metrics.flush()
+            except DatabaseError:
+                # The response is ready, the samples are kept for the next flush
+                logger.exception('Flushing metrics failed')
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        request.timings = RequestTimings()
+        response = await self.get_response(request)
+        self.finish(request, response, started)
+        if metrics.flush_due():
+            try:
+                await sync_to_async(metrics.flush)()
+            except DatabaseError:
+                logger.exception('Flushing metrics failed')
+        return response
+
+    def process_template_response(self, request, response):
+        request.timings.start_render(response)
+        return response
+
+    def finish(self, request, response, started):
+        timings = request.timings
+        duration = time.perf_counter() - started
+        response['Server-Timing'] = (
+            f'db;dur={timings.sql_seconds * 1000:.1f};desc="{timings.queries} queries", '
+            f'serialize;dur={timings.serialize_seconds * 1000:.1f}, '
+            f'render;dur={timings.render_seconds * 1000:.1f}, '
+            f'total;dur={duration * 1000:.1f}'
+        )
+        view, action = _view_labels(request)
+        metrics.record(view, action, request.method, response.status_code, duration, timings)
+
+def metrics_view(request):
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0002_property_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThrottleBucket',
+            fields=[
+                ('key', models.TextField(primary_key=True, serialize=False)),
+                ('tokens', models.FloatField()),
+                ('updated_at', models.FloatField(help_text='Unix time of the last refill')),
+            ],
+        ),
+        migrations.RunSQL(
+            'ALTER TABLE properties_throttlebucket SET UNLOGGED',
+            'ALTER TABLE properties_throttlebucket SET LOGGED',
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0003_throttlebucket'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('labels', models.TextField(help_text='Label names and values as a JSON object')),
+                ('value', models.FloatField()),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='metricsample',
+            constraint=models.UniqueConstraint(fields=('name', 'labels'), name='metric_sample_name_labels_uniq'),
+        ),
+        migrations.RunSQL(
+            'ALTER TABLE properties_metricsample SET UNLOGGED',
+            'ALTER TABLE properties_metricsample SET LOGGED',
+        ),
+    ]
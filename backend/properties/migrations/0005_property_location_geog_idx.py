@@ -0,0 +1,25 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:40
+
+import django.contrib.gis.db.models.fields
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0004_metricsample'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='property',
+            index=django.contrib.postgres.indexes.GistIndex(
+                django.db.models.functions.comparison.Cast(
+                    'location', output_field=django.contrib.gis.db.models.fields.PointField(geography=True)
+                ),
+                name='property_location_geog_idx'
+            ),
+        ),
+    ]
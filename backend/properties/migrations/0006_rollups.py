@@ -0,0 +1,128 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TOTALS = ['estimated_value', 'total_financial_risk', 'relevant_risks', 'handled_risks']
+ROLLUPS = [
+    # (table, key column)
+    ('properties_portfoliorollup', 'portfolio_id'),
+    ('properties_cityrollup', 'city'),
+]
+
+
+def _deltas(sign, source, where=''):
+    columns = ', '.join(f'{sign}{column} AS {column}' for column in TOTALS)
+    return f'SELECT portfolio_id, city, {sign}1 AS property_count, {columns} FROM {source} {where}'
+
+
+def _apply(deltas):
+    statements = []
+    for table, key in ROLLUPS:
+        rollup_columns = ['property_count', 'total_estimated_value', *TOTALS[1:]]
+        sums = ', '.join(f'SUM({column})' for column in ['property_count', *TOTALS])
+        updates = ', '.join(f'{column} = rollup.{column} + EXCLUDED.{column}' for column in rollup_columns)
+        statements.append(f'''
+        INSERT INTO {table} AS rollup ({key}, {', '.join(rollup_columns)})
+        SELECT {key}, {sums} FROM ({deltas}) AS deltas
+        WHERE {key} IS NOT NULL
+        GROUP BY {key} ORDER BY {key}
+        ON CONFLICT ({key}) DO UPDATE SET {updates};
+        DELETE FROM {table} WHERE property_count = 0;''')
+    return ''.join(statements)
+
+
+CHANGED = f'''
+    WHERE id IN (
+        SELECT new_rows.id FROM new_rows JOIN old_rows ON old_rows.id = new_rows.id
+        WHERE (new_rows.portfolio_id, new_rows.city, {', '.join(f'new_rows.{c}' for c in TOTALS)})
+        IS DISTINCT FROM (old_rows.portfolio_id, old_rows.city, {', '.join(f'old_rows.{c}' for c in TOTALS)})
+    )'''
+
+TRIGGERS = {
+    'insert': _apply(_deltas('', 'new_rows')),
+    'delete': _apply(_deltas('-', 'old_rows')),
+    'update': _apply(f"{_deltas('', 'new_rows', CHANGED)} UNION ALL {_deltas('-', 'old_rows', CHANGED)}"),
+}
+TRANSITIONS = {
+    'insert': 'REFERENCING NEW TABLE AS new_rows',
+    'delete': 'REFERENCING OLD TABLE AS old_rows',
+    'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+}
+
+CREATE_SQL = ''.join(
+    f'''
+    CREATE FUNCTION properties_rollup_{operation}() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN{body}
+        RETURN NULL;
+    END $$;
+    CREATE TRIGGER properties_rollup_{operation} AFTER {operation.upper()} ON properties_property
+    {TRANSITIONS[operation]} FOR EACH STATEMENT EXECUTE FUNCTION properties_rollup_{operation}();
+    '''
+    for operation, body in TRIGGERS.items()
+) + '''
+    CREATE FUNCTION properties_rollup_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        TRUNCATE properties_portfoliorollup, properties_cityrollup;
+        RETURN NULL;
+    END $$;
+    CREATE TRIGGER properties_rollup_truncate AFTER TRUNCATE ON properties_property
+    FOR EACH STATEMENT EXECUTE FUNCTION properties_rollup_truncate();
+'''
+
+DROP_SQL = ''.join(
+    f'''
+    DROP TRIGGER properties_rollup_{operation} ON properties_property;
+    DROP FUNCTION properties_rollup_{operation}();
+    '''
+    for operation in [*TRIGGERS, 'truncate']
+)
+
+# Fills the rollups from the rows that exist when the migration runs
+BACKFILL_SQL = ''.join(
+    f'''
+    INSERT INTO {table} ({key}, property_count, total_estimated_value, total_financial_risk, relevant_risks, handled_risks)
+    SELECT {key}, COUNT(*), SUM(estimated_value), SUM(total_financial_risk), SUM(relevant_risks), SUM(handled_risks)
+    FROM properties_property WHERE {key} IS NOT NULL GROUP BY {key};
+    '''
+    for table, key in ROLLUPS
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0005_property_location_geog_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityRollup',
+            fields=[
+                ('property_count', models.BigIntegerField(default=0)),
+                ('total_estimated_value', models.BigIntegerField(default=0)),
+                ('total_financial_risk', models.BigIntegerField(default=0)),
+                ('relevant_risks', models.BigIntegerField(default=0)),
+                ('handled_risks', models.BigIntegerField(default=0)),
+                ('city', models.CharField(max_length=255, primary_key=True, serialize=False)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='PortfolioRollup',
+            fields=[
+                ('property_count', models.BigIntegerField(default=0)),
+                ('total_estimated_value', models.BigIntegerField(default=0)),
+                ('total_financial_risk', models.BigIntegerField(default=0)),
+                ('relevant_risks', models.BigIntegerField(default=0)),
+                ('handled_risks', models.BigIntegerField(default=0)),
+                ('portfolio', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='rollup', serialize=False, to='properties.portfolio')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.RunSQL(CREATE_SQL + BACKFILL_SQL, DROP_SQL),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:40
+
+import properties.models
+from django.db import migrations, models
+
+# clock_timestamp() rather than now(), see properties.sync.sync_watermark
+CREATE_SQL = '''
+    CREATE FUNCTION properties_touch() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        IF NEW IS DISTINCT FROM OLD THEN
+            NEW.updated_at := clock_timestamp();
+        END IF;
+        RETURN NEW;
+    END $$;
+    CREATE TRIGGER properties_touch BEFORE UPDATE ON properties_property
+    FOR EACH ROW EXECUTE FUNCTION properties_touch();
+
+    CREATE FUNCTION properties_tombstone_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO properties_propertytombstone (property_id, portfolio_id, deleted_at)
+        SELECT id, portfolio_id, clock_timestamp() FROM old_rows;
+        RETURN NULL;
+    END $$;
+    CREATE TRIGGER properties_tombstone_delete AFTER DELETE ON properties_property
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION properties_tombstone_delete();
+
+    CREATE FUNCTION properties_tombstone_update() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        -- A property moved to another portfolio is gone for syncs of the old one
+        INSERT INTO properties_propertytombstone (property_id, portfolio_id, deleted_at)
+        SELECT old_rows.id, old_rows.portfolio_id, clock_timestamp()
+        FROM old_rows JOIN new_rows ON new_rows.id = old_rows.id
+        WHERE old_rows.portfolio_id IS NOT NULL AND old_rows.portfolio_id IS DISTINCT FROM new_rows.portfolio_id;
+        RETURN NULL;
+    END $$;
+    CREATE TRIGGER properties_tombstone_update AFTER UPDATE ON properties_property
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION properties_tombstone_update();
+
+    CREATE FUNCTION properties_tombstone_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+    BEGIN
+        INSERT INTO properties_propertytombstone (property_id, portfolio_id, deleted_at)
+        VALUES (NULL, NULL, clock_timestamp());
+        RETURN NULL;
+    END $$;
+    CREATE TRIGGER properties_tombstone_truncate AFTER TRUNCATE ON properties_property
+    FOR EACH STATEMENT EXECUTE FUNCTION properties_tombstone_truncate();
+'''
+
+DROP_SQL = ''.join(
+    f'''
+    DROP TRIGGER {name} ON properties_property;
+    DROP FUNCTION {name}();
+    '''
+    for name in [
+        'properties_touch', 'properties_tombstone_delete', 'properties_tombstone_update',
+        'properties_tombstone_truncate'
+    ]
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0007_property_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PropertyTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('property_id', models.BigIntegerField(null=True)),
+                ('portfolio_id', models.BigIntegerField(null=True)),
+                ('deleted_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='property',
+            name='updated_at',
+            field=models.DateTimeField(db_default=properties.models.ClockTimestamp(), db_index=True, editable=False),
+        ),
+        migrations.RunSQL(CREATE_SQL, DROP_SQL),
+    ]
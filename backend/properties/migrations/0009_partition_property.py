@@ -0,0 +1,120 @@
+# Generated by Django 5.1.7 on 2026-10-18 22:10
+
+from django.db import migrations
+
+# The table is list partitioned by portfolio_id and the existing table becomes the default
+# partition, so no rows are copied. properties.partitions moves large portfolios into their
+# own partitions later. Indexes, triggers and the foreign key move to the parent: indexes on
+# the parent are created on every partition, and statement triggers with transition tables
+# on the parent see the rows of all partitions. The parent cannot have a primary key without
+# portfolio_id, each partition keeps one on id instead.
+CREATE_SQL = '''
+    ALTER TABLE properties_property RENAME TO properties_property_default;
+    -- Identity columns are not supported on partitioned tables before PostgreSQL 17
+    ALTER TABLE properties_property_default ALTER COLUMN id DROP IDENTITY IF EXISTS;
+    CREATE TABLE properties_property (LIKE properties_property_default INCLUDING DEFAULTS INCLUDING STORAGE)
+    PARTITION BY LIST (portfolio_id);
+    CREATE SEQUENCE properties_property_id_seq OWNED BY properties_property.id;
+    SELECT setval('properties_property_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM properties_property_default;
+    ALTER TABLE properties_property ALTER COLUMN id SET DEFAULT nextval('properties_property_id_seq');
+    ALTER TABLE properties_property ATTACH PARTITION properties_property_default DEFAULT;
+
+    DO $$
+    DECLARE
+        item record;
+        statements text[] := '{}';
+        statement text;
+    BEGIN
+        FOR item IN
+            SELECT tgname AS name, pg_get_triggerdef(oid) AS definition FROM pg_trigger
+            WHERE tgrelid = 'properties_property_default'::regclass AND NOT tgisinternal
+        LOOP
+            EXECUTE format('DROP TRIGGER %I ON properties_property_default', item.name);
+            statements := statements || regexp_replace(item.definition, ' ON \\S+ ', ' ON properties_property ');
+        END LOOP;
+        FOR item IN
+            SELECT conname AS name, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+            WHERE conrelid = 'properties_property_default'::regclass AND contype = 'f'
+        LOOP
+            EXECUTE format('ALTER TABLE properties_property_default DROP CONSTRAINT %I', item.name);
+            statements := statements || format('ALTER TABLE properties_property ADD CONSTRAINT %I %s', item.name, item.definition);
+        END LOOP;
+        -- The parent index takes the original name and the existing index is attached, not rebuilt
+        FOR item IN
+            SELECT idx.relname AS name, pg_get_indexdef(idx.oid) AS definition
+            FROM pg_index JOIN pg_class idx ON idx.oid = pg_index.indexrelid
+            WHERE pg_index.indrelid = 'properties_property_default'::regclass AND NOT pg_index.indisprimary
+        LOOP
+            EXECUTE format('ALTER INDEX %I RENAME TO %I', item.name, left(item.name, 55) || '_default');
+            statements := statements
+                || regexp_replace(item.definition, ' ON \\S+ USING ', ' ON ONLY properties_property USING ')
+                || format('ALTER INDEX %I ATTACH PARTITION %I', item.name, left(item.name, 55) || '_default');
+        END LOOP;
+        FOREACH statement IN ARRAY statements LOOP
+            EXECUTE statement;
+        END LOOP;
+    END $$;
+'''
+
+# Merges the portfolio partitions back into the default partition and turns it into the plain table again
+DROP_SQL = '''
+    DO $$
+    DECLARE
+        item record;
+        statements text[] := '{}';
+        statement text;
+    BEGIN
+        FOR item IN
+            SELECT child.relname AS name FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE pg_inherits.inhparent = 'properties_property'::regclass AND child.relname <> 'properties_property_default'
+        LOOP
+            EXECUTE format('ALTER TABLE properties_property DETACH PARTITION %I', item.name);
+            EXECUTE format('INSERT INTO properties_property_default SELECT * FROM %I', item.name);
+            EXECUTE format('DROP TABLE %I', item.name);
+        END LOOP;
+        FOR item IN
+            SELECT tgname AS name, pg_get_triggerdef(oid) AS definition FROM pg_trigger
+            WHERE tgrelid = 'properties_property'::regclass AND NOT tgisinternal
+        LOOP
+            EXECUTE format('DROP TRIGGER %I ON properties_property', item.name);
+            statements := statements || regexp_replace(item.definition, ' ON \\S+ ', ' ON properties_property ');
+        END LOOP;
+        FOR item IN
+            SELECT conname AS name, pg_get_constraintdef(oid) AS definition FROM pg_constraint
+            WHERE conrelid = 'properties_property'::regclass AND contype = 'f'
+        LOOP
+            EXECUTE format('ALTER TABLE properties_property DROP CONSTRAINT %I', item.name);
+            statements := statements || format('ALTER TABLE properties_property ADD CONSTRAINT %I %s', item.name, item.definition);
+        END LOOP;
+        FOR item IN
+            SELECT parent.relname AS parent, child.relname AS child FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            JOIN pg_index ON pg_index.indexrelid = child.oid
+            WHERE pg_index.indrelid = 'properties_property_default'::regclass
+        LOOP
+            statements := statements || format('ALTER INDEX %I RENAME TO %I', item.child, item.parent);
+        END LOOP;
+
+        ALTER TABLE properties_property DETACH PARTITION properties_property_default;
+        DROP TABLE properties_property;
+        ALTER TABLE properties_property_default RENAME TO properties_property;
+        ALTER TABLE properties_property ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY;
+        PERFORM setval(pg_get_serial_sequence('properties_property', 'id'), COALESCE(MAX(id), 0) + 1, false)
+        FROM properties_property;
+        FOREACH statement IN ARRAY statements LOOP
+            EXECUTE statement;
+        END LOOP;
+    END $$;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('properties', '0008_property_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_SQL, DROP_SQL),
+    ]
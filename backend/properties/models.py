@@ -1,4 +1,12 @@
 from django.contrib.gis.db import models
+from django.contrib.postgres.indexes import GinIndex, GistIndex
+from django.db.models import Func, Q
+from django.db.models.functions import Cast
+
+class ClockTimestamp(Func):
+    # The time of the write itself, now() would give the start of its transaction
+    template = 'clock_timestamp()'
+    output_field = models.DateTimeField()
 
 class Portfolio(models.Model):
     name = models.CharField(max_length=255)
@@ -24,6 +32,143 @@ class Property(models.Model):
     relevant_risks = models.IntegerField()
     handled_risks = models.IntegerField()
     total_financial_risk = models.IntegerField(help_text="Risk in NOK")
+    # Bumped by the properties_touch trigger (migration 0008) on every change, also for
+    # bulk updates and raw SQL
+    updated_at = models.DateTimeField(db_default=ClockTimestamp(), db_index=True, editable=False)
+
+    class Meta:
+        # Composite indexes let keyset pagination seek on each ordering field with id as tie-breaker
+        indexes = [
+            models.Index(fields=['name', 'id'], name='property_name_id_idx'),
+            models.Index(fields=['estimated_value', 'id'], name='property_value_id_idx'),
+            models.Index(fields=['relevant_risks', 'id'], name='property_relevant_id_idx'),
+            models.Index(fields=['handled_risks', 'id'], name='property_handled_id_idx'),
+            # Serves KNN ordering and ST_DWithin in metres for the near filter
+            GistIndex(
+                Cast('location', output_field=models.PointField(geography=True)),
+                name='property_location_geog_idx'
+            ),
+            # Trigram indexes for ?search=, and a pattern index for zip code prefixes
+            GinIndex(fields=['name'], name='property_name_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['address'], name='property_address_trgm_idx', opclasses=['gin_trgm_ops']),
+            GinIndex(fields=['city'], name='property_city_trgm_idx', opclasses=['gin_trgm_ops']),
+            models.Index(fields=['zip_code'], name='property_zip_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
 
     def __str__(self):
         return str(self.name)
+
+class PropertyTombstone(models.Model):
+    # Written by triggers on the property table (migration 0008) for delta syncs: a deleted
+    # property, a property that left portfolio_id, or with property_id NULL a TRUNCATE
+    property_id = models.BigIntegerField(null=True)
+    portfolio_id = models.BigIntegerField(null=True)
+    deleted_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return str(self.property_id)
+
+class ThrottleBucket(models.Model):
+    # Token buckets for the API throttles, shared by every worker. The table is unlogged
+    # (see migration 0003) since losing it on a crash only resets the limits.
+    key = models.TextField(primary_key=True)
+    tokens = models.FloatField()
+    updated_at = models.FloatField(help_text="Unix time of the last refill")
+
+    def __str__(self):
+        return str(self.key)
+
+class MetricSample(models.Model):
+    # Prometheus samples summed over every worker, unlogged like ThrottleBucket
+    name = models.CharField(max_length=255)
+    labels = models.TextField(help_text="Label names and values as a JSON object")
+    value = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'labels'], name='metric_sample_name_labels_uniq'),
+        ]
+
+    def __str__(self):
+        return str(self.name)
+
+class RiskRollup(models.Model):
+    # Totals kept up to date by statement triggers on the property table (migration 0006),
+    # so bulk writes and COPY are counted too. Rows are removed when their count drops to 0.
+    property_count = models.BigIntegerField(default=0)
+    total_estimated_value = models.BigIntegerField(default=0)
+    total_financial_risk = models.BigIntegerField(default=0)
+    relevant_risks = models.BigIntegerField(default=0)
+    handled_risks = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class PortfolioRollup(RiskRollup):
+    # No database constraint, the row may briefly outlive a deleted portfolio within a transaction
+    portfolio = models.OneToOneField(
+        Portfolio,
+        related_name='rollup',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        primary_key=True
+    )
+
+    def __str__(self):
+        return str(self.portfolio_id)
+
+class CityRollup(RiskRollup):
+    city = models.CharField(max_length=255, primary_key=True)
+
+    def __str__(self):
+        return str(self.city)
+
+class Job(models.Model):
+    # Background work queued by the API and run by manage.py run_worker (properties.jobs)
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    kind = models.CharField(max_length=32)
+    portfolio = models.ForeignKey(Portfolio, related_name='jobs', on_delete=models.CASCADE, null=True, blank=True)
+    params = models.JSONField(default=dict)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    processed = models.BigIntegerField(default=0)
+    total = models.BigIntegerField(null=True)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=255, blank=True)
+    # JSON results are kept here, file results in JobResultChunk rows
+    result = models.JSONField(null=True)
+    content_type = models.CharField(max_length=255, blank=True)
+    filename = models.CharField(max_length=255, blank=True)
+    error = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    heartbeat_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest queued job, the index only holds the queued ones
+            models.Index(fields=['id'], condition=Q(status='queued'), name='job_queued_idx'),
+            models.Index(fields=['status', 'heartbeat_at'], name='job_status_heartbeat_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.pk}'
+
+class JobResultChunk(models.Model):
+    # A file result in pieces, so it is written and downloaded without holding it in memory
+    job = models.ForeignKey(Job, related_name='chunks', on_delete=models.CASCADE)
+    index = models.IntegerField()
+    data = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'index'], name='job_result_chunk_job_index_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.job_id} {self.index}'
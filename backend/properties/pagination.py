@@ -0,0 +1,286 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from functools import partial
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from rest_framework_gis.pagination import GeoJsonPagination
+from .cache import api_cache, can_store, count_cache_key, get_versions
+
+# How GeoPropertyPagination counts, picked by ?count= or the PROPERTY_COUNT_STRATEGY setting:
+#   exact     COUNT(*) on every page
+#   cached    COUNT(*) once per filter combination, until a write invalidates it
+#   estimate  the planner's row estimate when it is above estimate_threshold, else COUNT(*)
+#   none      no count, only has_next
+COUNT_STRATEGIES = ('exact', 'cached', 'estimate', 'none')
+# Query parameters that change the page or its encoding but not the rows being counted
+PAGE_PARAMS = {'page', 'page_size', 'pagination', 'cursor', 'ordering', 'fields', 'precision', 'format', 'count'}
+
+def estimated_count(queryset) -> int:
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
+
+class CachedCountPaginator(Paginator):
+    def __init__(self, object_list, per_page, cache_key, timeout, store=True, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+        self.timeout = timeout
+        self.store = store
+
+    @cached_property
+    def count(self):
+        count = api_cache.get(self.cache_key)
+        if count is None:
+            count = super().count
+            if self.store:
+                api_cache.set(self.cache_key, count, timeout=self.timeout)
+        return count
+
+class GeoPropertyPagination(GeoJsonPagination):
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_query_param = 'count'
+    count_cache_seconds = 600
+    # Below this many estimated rows the exact count is cheap enough to run
+    estimate_threshold = 10000
+
+    def get_count_strategy(self, request):
+        strategy = request.query_params.get(self.count_query_param, settings.PROPERTY_COUNT_STRATEGY)
+        if strategy not in COUNT_STRATEGIES:
+            raise ValidationError({self.count_query_param: f'Count must be one of {", ".join(COUNT_STRATEGIES)}'})
+        return strategy
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.count_strategy = self.get_count_strategy(request)
+        self.count_estimated = False
+        if self.count_strategy == 'cached' and view is not None:
+            versions = get_versions(view.get_cache_scopes())
+            self.django_paginator_class = partial(
+                CachedCountPaginator, cache_key=count_cache_key(view, request, PAGE_PARAMS, versions),
+                timeout=self.count_cache_seconds, store=can_store(versions)
+            )
+        if self.count_strategy not in ('estimate', 'none'):
+            return super().paginate_queryset(queryset, request, view)
+        return self._paginate_ahead(queryset, request)
+
+    def _paginate_ahead(self, queryset, request):
+        # Reads one row past the page to tell whether there is a next one, no count needed
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        page_number = request.query_params.get(self.page_query_param, '1')
+        if not page_number.isdecimal() or int(page_number) < 1:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message='Invalid page'))
+        self.page_number = int(page_number)
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        if not rows and self.page_number > 1:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message='That page contains no results'
+            ))
+        self.has_next = len(rows) > page_size
+        self.count = None
+        if self.count_strategy == 'estimate':
+            self.count = estimated_count(queryset)
+            if self.count < self.estimate_threshold:
+                self.count = queryset.count()
+            else:
+                self.count_estimated = True
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if self.count_strategy not in ('estimate', 'none'):
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.count_strategy not in ('estimate', 'none'):
+            return super().get_previous_link()
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def _envelope(self):
+        if self.count_strategy == 'none':
+            fields = [('has_next', self.has_next)]
+        elif self.count_strategy == 'estimate':
+            fields = [('count', self.count), ('count_estimated', self.count_estimated)]
+        else:
+            fields = [('count', self.page.paginator.count)]
+        return [*fields, ('next', self.get_next_link()), ('previous', self.get_previous_link())]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([('type', 'FeatureCollection'), *self._envelope(), ('features', data['features'])]))
+
+    def get_columnar_response(self, columns):
+        return Response(OrderedDict([*self._envelope(), *columns.items()]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['required'] = [field for field in response_schema.get('required', []) if field != 'count']
+        response_schema['properties']['count']['nullable'] = True
+        response_schema['properties']['count_estimated'] = {'type': 'boolean'}
+        response_schema['properties']['has_next'] = {'type': 'boolean'}
+        return response_schema
+
+# Keyset pagination: seeks past the last seen ordering values (with id as a tie-breaker)
+# instead of using OFFSET, and skips the count query, so deep pages cost the same as page 1
+class GeoCursorPagination(BasePagination):
+    page_size = GeoPropertyPagination.page_size
+    page_size_query_param = GeoPropertyPagination.page_size_query_param
+    max_page_size = GeoPropertyPagination.max_page_size
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, queryset, view)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = [self._flip(field) for field in self.ordering] if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self._seek_filter(ordering, position))
+            except (TypeError, ValueError, DjangoValidationError):
+                # A tampered cursor whose values do not fit the ordering fields
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = list(OrderingFilter().get_ordering(request, queryset, view) or [])
+        fields = [field.lstrip('-') for field in ordering]
+        if 'id' not in fields and 'pk' not in fields:
+            # Follow the direction of the primary field so one index scan serves the seek
+            descending = bool(ordering) and ordering[0].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('type', 'FeatureCollection'),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('features', data['features']),
+        ]))
+
+    def get_columnar_response(self, columns):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            *columns.items(),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['type', 'features'],
+            'properties': {
+                'type': {'type': 'string', 'enum': ['FeatureCollection']},
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'features': schema,
+            },
+        }
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # The ordering fields are never null, and only scalars compare against them
+        if not all(isinstance(value, (str, int, float)) and not isinstance(value, bool) for value in position):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, instance, reverse):
+        position = [self._value(instance, field.lstrip('-')) for field in self.ordering]
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_position(position, reverse))
+
+    @staticmethod
+    def encode_position(position, reverse=False):
+        cursor = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        return urlsafe_b64encode(cursor.encode()).decode('ascii')
+
+    @staticmethod
+    def _value(instance, field):
+        # Rows may be model instances, `.values()` dicts from the fast list path or named
+        # `.values_list()` rows from the columnar format
+        if isinstance(instance, dict):
+            return instance[field]
+        return getattr(instance, field)
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _seek_filter(ordering, position):
+        # (a > x) OR (a = x AND b > y) OR ..., plus a >= x so the index range starts at x
+        seek = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            seek |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        first = ordering[0].lstrip('-')
+        first_lookup = 'lte' if ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{first}__{first_lookup}': position[0]}) & seek
@@ -0,0 +1,177 @@
+import time
+from django.db import OperationalError, connection, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from .models import CityRollup, Portfolio, PortfolioRollup, Property, PropertyTombstone
+
+# Migration 0009 partitions the property table by portfolio_id. Portfolios live in the
+# default partition until they are moved to their own, which makes filters on portfolio
+# read only that partition and lets a portfolio delete drop it instead of deleting rows.
+DEFAULT_PARTITION = f'{Property._meta.db_table}_default'
+PARTITION_PREFIX = f'{Property._meta.db_table}_p'
+# Portfolios with at least this many properties are worth a partition of their own
+PARTITION_MIN_ROWS = 1_000_000
+# The DDL below needs locks that every property query would queue behind while it waits for
+# them, for instance behind a long export. It gives up after LOCK_TIMEOUT and tries again.
+LOCK_TIMEOUT = '1s'
+LOCK_ATTEMPTS = 3
+LOCK_NOT_AVAILABLE = '55P03'
+
+PARTITIONS_SQL = '''
+    SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = %s::regclass
+'''
+
+# Attaching next to a default partition scans the new table and the whole default partition
+# under an ACCESS EXCLUSIVE lock, unless CHECK constraints already prove neither scan would
+# find a row in the wrong place. The move adds them first:
+# 1. A NOT VALID check keeps new rows of the portfolio out of the default partition. Its rows
+#    can still be read, deleted or moved to another portfolio, but not added or changed.
+# 2. The rows are copied into a new table with a check of its own, without blocking anything.
+# 3. The rows are deleted from the default partition, and rows deleted or moved meanwhile from
+#    the copy. Validating the check only takes SHARE UPDATE EXCLUSIVE, so reads and writes go
+#    on while it scans, and the attach itself is a catalog change. The checks are dropped after.
+# Statement triggers on the parent do not fire since the rows themselves are unchanged.
+EXCLUDE_SQL = f'''
+    ALTER TABLE {DEFAULT_PARTITION} ADD CONSTRAINT {{excluded}}
+    CHECK (portfolio_id <> %(portfolio_id)s) NOT VALID;
+'''
+COPY_SQL = f'''
+    DROP TABLE IF EXISTS {{partition}};
+    CREATE TABLE {{partition}} (LIKE {Property._meta.db_table} INCLUDING STORAGE);
+    INSERT INTO {{partition}} SELECT * FROM {DEFAULT_PARTITION} WHERE portfolio_id = %(portfolio_id)s;
+    ALTER TABLE {{partition}} ADD PRIMARY KEY (id);
+    ALTER TABLE {{partition}} ADD CONSTRAINT {{included}} CHECK (portfolio_id = %(portfolio_id)s);
+'''
+ATTACH_SQL = f'''
+    WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE portfolio_id = %(portfolio_id)s RETURNING id)
+    DELETE FROM {{partition}} AS copied WHERE NOT EXISTS (SELECT 1 FROM moved WHERE moved.id = copied.id);
+    ALTER TABLE {DEFAULT_PARTITION} VALIDATE CONSTRAINT {{excluded}};
+    ALTER TABLE {Property._meta.db_table} ATTACH PARTITION {{partition}} FOR VALUES IN (%(portfolio_id)s);
+    ALTER TABLE {DEFAULT_PARTITION} DROP CONSTRAINT {{excluded}};
+    ALTER TABLE {{partition}} DROP CONSTRAINT {{included}};
+'''
+# Undoes a move that did not finish, the portfolio's rows are still in the default partition
+ABORT_SQL = f'''
+    DROP TABLE IF EXISTS {{partition}};
+    ALTER TABLE {DEFAULT_PARTITION} DROP CONSTRAINT IF EXISTS {{excluded}};
+'''
+
+# Dropping the partition skips the delete triggers, so their tombstones and rollup changes
+# are written here from the partition before it goes. DETACH CONCURRENTLY is not allowed
+# next to a default partition, so the drop takes its lock on the parent under LOCK_TIMEOUT.
+DROP_SQL = f'''
+    LOCK TABLE {{partition}} IN SHARE MODE;
+    INSERT INTO {PropertyTombstone._meta.db_table} (property_id, portfolio_id, deleted_at)
+    SELECT id, portfolio_id, clock_timestamp() FROM {{partition}};
+    DELETE FROM {PortfolioRollup._meta.db_table} WHERE portfolio_id = %(portfolio_id)s;
+    UPDATE {CityRollup._meta.db_table} AS rollup SET
+        property_count = rollup.property_count - gone.property_count,
+        total_estimated_value = rollup.total_estimated_value - gone.total_estimated_value,
+        total_financial_risk = rollup.total_financial_risk - gone.total_financial_risk,
+        relevant_risks = rollup.relevant_risks - gone.relevant_risks,
+        handled_risks = rollup.handled_risks - gone.handled_risks
+    FROM (
+        SELECT city, COUNT(*) AS property_count, SUM(estimated_value) AS total_estimated_value,
+            SUM(total_financial_risk) AS total_financial_risk, SUM(relevant_risks) AS relevant_risks,
+            SUM(handled_risks) AS handled_risks
+        FROM {{partition}} GROUP BY city
+    ) AS gone
+    WHERE rollup.city = gone.city;
+    DELETE FROM {CityRollup._meta.db_table} WHERE property_count = 0;
+    DROP TABLE {{partition}};
+'''
+
+class PartitionBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The properties are in use by long running queries, try again shortly'
+    default_code = 'partition_busy'
+
+def _execute_with_lock_timeout(sql: str, params: dict) -> None:
+    # Each attempt is rolled back when a lock is not granted in time, nothing is left half done.
+    # Inside an outer transaction there is one attempt, as it would keep its locks while waiting.
+    attempts = 1 if connection.in_atomic_block else LOCK_ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        try:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Reset at the end, an outer transaction goes on without the timeout
+                cursor.execute(
+                    f'SET LOCAL lock_timeout = %(lock_timeout)s; {sql.strip().rstrip(";")}; SET LOCAL lock_timeout TO DEFAULT',
+                    {**params, 'lock_timeout': LOCK_TIMEOUT}
+                )
+            return
+        except OperationalError as exc:
+            if getattr(exc.__cause__, 'pgcode', None) != LOCK_NOT_AVAILABLE:
+                raise
+            if attempt == attempts:
+                raise PartitionBusy from exc
+            time.sleep(0.5 * attempt)
+
+def partition_name(portfolio_id: int) -> str:
+    return f'{PARTITION_PREFIX}{int(portfolio_id)}'
+
+def portfolio_partitions() -> dict[int, str]:
+    # Portfolio id -> partition, the default partition is left out
+    with connection.cursor() as cursor:
+        cursor.execute(PARTITIONS_SQL, [Property._meta.db_table])
+        names = [row[0] for row in cursor.fetchall()]
+    return {
+        int(name[len(PARTITION_PREFIX):]): name
+        for name in names if name.startswith(PARTITION_PREFIX) and name[len(PARTITION_PREFIX):].isdigit()
+    }
+
+def partition_candidates(min_rows: int = PARTITION_MIN_ROWS) -> list[int]:
+    # The rollups already count the properties of every portfolio
+    partitioned = portfolio_partitions()
+    return [
+        portfolio_id for portfolio_id in PortfolioRollup.objects.filter(
+            property_count__gte=min_rows
+        ).order_by('portfolio_id').values_list('portfolio_id', flat=True)
+        if portfolio_id not in partitioned
+    ]
+
+def attach_portfolio_partition(portfolio_id: int) -> bool:
+    # Moves the properties of a portfolio from the default partition to their own
+    if portfolio_id in portfolio_partitions():
+        return False
+    name = partition_name(portfolio_id)
+    names = {
+        'partition': connection.ops.quote_name(name),
+        'included': connection.ops.quote_name(f'{name}_check'),
+        'excluded': connection.ops.quote_name(f'{DEFAULT_PARTITION}_not_{int(portfolio_id)}'),
+    }
+    params = {'portfolio_id': portfolio_id}
+    if connection.in_atomic_block:
+        # Foreign key checks deferred by the outer transaction would stop the ALTER TABLEs
+        with connection.cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    _execute_with_lock_timeout(EXCLUDE_SQL.format(**names), params)
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(COPY_SQL.format(**names), params)
+        _execute_with_lock_timeout(ATTACH_SQL.format(**names), params)
+    except Exception:
+        # The check must not outlive the move, writes to the portfolio fail while it is there
+        _execute_with_lock_timeout(ABORT_SQL.format(**names), {})
+        raise
+    return True
+
+def drop_portfolio_partition(portfolio_id: int) -> bool:
+    # Removes every property of the portfolio in one DDL statement, false when it has no partition
+    if portfolio_id not in portfolio_partitions():
+        return False
+    _execute_with_lock_timeout(
+        DROP_SQL.format(partition=connection.ops.quote_name(partition_name(portfolio_id))),
+        {'portfolio_id': portfolio_id}
+    )
+    return True
+
+def drop_orphaned_partitions() -> list[int]:
+    # Partitions left by portfolios deleted outside the API or by a TRUNCATE. The foreign
+    # key keeps them empty, so no tombstones or rollups are involved.
+    partitions = portfolio_partitions()
+    existing = set(Portfolio.objects.filter(pk__in=partitions).values_list('pk', flat=True))
+    orphaned = sorted(partitions.keys() - existing)
+    for portfolio_id in orphaned:
+        _execute_with_lock_timeout(f'DROP TABLE {connection.ops.quote_name(partitions[portfolio_id])}', {})
+    return orphaned
@@ -0,0 +1,36 @@
+import json
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+class BinaryErrorRenderer(BaseRenderer):
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            return bytes(data)
+        # Errors such as throttling or unknown tiles still carry a JSON body
+        return json.dumps(data).encode()
+
+class MVTRenderer(BinaryErrorRenderer):
+    media_type = 'application/vnd.mapbox-vector-tile'
+    format = 'mvt'
+
+# The export renderers only render errors, successful exports are streamed by the view
+class GeoJSONRenderer(BinaryErrorRenderer):
+    media_type = 'application/geo+json'
+    format = 'geojson'
+
+class NDJSONRenderer(BinaryErrorRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+class CSVRenderer(BinaryErrorRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+class ColumnarRenderer(JSONRenderer):
+    # Property lists as parallel arrays instead of a FeatureCollection, see property_columns
+    media_type = 'application/vnd.columnar+json'
+    format = 'columnar'
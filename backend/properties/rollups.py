@@ -0,0 +1,56 @@
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from .models import CityRollup, PortfolioRollup, Property
+
+ROLLUP_FIELDS = [
+    'property_count', 'total_estimated_value', 'total_financial_risk', 'relevant_risks', 'handled_risks'
+]
+# Rollup model -> the Property column it is grouped by
+ROLLUPS = {PortfolioRollup: 'portfolio_id', CityRollup: 'city'}
+
+def recompute(model) -> dict:
+    key = ROLLUPS[model]
+    rows = Property.objects.exclude(**{f'{key}__isnull': True}).order_by().values(key).annotate(
+        property_count=Count('id'),
+        total_estimated_value=Sum('estimated_value'),
+        total_financial_risk=Sum('total_financial_risk'),
+        relevant_risks=Sum('relevant_risks'),
+        handled_risks=Sum('handled_risks'),
+    )
+    return {row[key]: tuple(row[field] for field in ROLLUP_FIELDS) for row in rows}
+
+def stored(model) -> dict:
+    key = model._meta.pk.attname
+    return {
+        row[0]: tuple(row[1:])
+        for row in model.objects.values_list(key, *ROLLUP_FIELDS)
+    }
+
+def check_rollups() -> list[str]:
+    # Compares the trigger maintained totals with a full recompute in one snapshot
+    differences = []
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if outermost:
+            with connection.cursor() as cursor:
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        for model in ROLLUPS:
+            expected, actual = recompute(model), stored(model)
+            for key in sorted(expected.keys() | actual.keys(), key=str):
+                if expected.get(key) != actual.get(key):
+                    differences.append(
+                        f'{model.__name__} {key}: expected {expected.get(key)}, stored {actual.get(key)}'
+                    )
+    return differences
+
+def rebuild_rollups() -> None:
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            # Blocks property writes so no trigger update is lost between delete and insert
+            cursor.execute(f'LOCK TABLE {Property._meta.db_table} IN SHARE MODE')
+        for model, key in ROLLUPS.items():
+            model.objects.all().delete()
+            model.objects.bulk_create([
+                model(**{key: group, **dict(zip(ROLLUP_FIELDS, totals))})
+                for group, totals in recompute(model).items()
+            ])
@@ -0,0 +1,74 @@
+import random
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+# Set while a safe request on the API viewsets is handled, None sends reads to the primary
+_read_alias: ContextVar[str | None] = ContextVar('read_alias', default=None)
+
+# Clients that wrote recently carry this cookie and read from the primary until it expires
+STICKY_COOKIE = 'primary_until'
+# How long a replica that failed to connect is skipped by this process
+REPLICA_RETRY_SECONDS = 30
+
+_replica_down_until: dict[str, float] = {}
+
+def read_alias() -> str:
+    return _read_alias.get() or DEFAULT_DB_ALIAS
+
+def _is_sticky(request) -> bool:
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+def _healthy_replica() -> str | None:
+    now = time.monotonic()
+    candidates = [
+        alias for alias in settings.REPLICA_DATABASES
+        if _replica_down_until.get(alias, 0) <= now
+    ]
+    random.shuffle(candidates)
+    for alias in candidates:
+        connection = connections[alias]
+        try:
+            # Django only pings a reused connection on its first query, so do it now and let a dead replica fall back
+            connection.close_if_health_check_failed()
+            connection.ensure_connection()
+        except OperationalError:
+            _replica_down_until[alias] = now + REPLICA_RETRY_SECONDS
+            continue
+        return alias
+    return None
+
+def route_reads(request) -> None:
+    alias = None
+    if request.method in SAFE_METHODS and not _is_sticky(request):
+        alias = _healthy_replica()
+    _read_alias.set(alias)
+
+def finish_request(request, response) -> None:
+    _read_alias.set(None)
+    if request.method not in SAFE_METHODS and response.status_code < 400 and settings.REPLICA_STICKY_SECONDS:
+        # Read-your-writes: keep this client on the primary until the replicas have caught up
+        window = settings.REPLICA_STICKY_SECONDS
+        response.set_cookie(STICKY_COOKIE, str(time.time() + window), max_age=window, httponly=True, samesite='Lax')
+
+class ReplicaRouter:
+    # Reads for this app go to the replica picked for the current request, everything
+    # else (writes, the cache table, migrations) stays on the primary
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'properties':
+            return _read_alias.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -1,9 +1,47 @@
 from rest_framework import serializers
 from rest_framework_gis.serializers import GeoFeatureModelSerializer
-from .models import Property, Portfolio
+from .models import CityRollup, Job, Property, Portfolio, PortfolioRollup
 import re
 
-class PropertySerializer(GeoFeatureModelSerializer):
+# Decimals accepted by ?precision=, doubles carry no more than this
+MAX_COORDINATE_PRECISION = 15
+
+def parse_fields(request, serializer_class) -> list[str] | None:
+    value = request.query_params.get('fields')
+    if value is None:
+        return None
+    fields = [field for field in value.split(',') if field]
+    unknown = sorted(set(fields) - set(serializer_class.Meta.fields))
+    if unknown:
+        raise serializers.ValidationError({'fields': f'Unknown fields: {", ".join(unknown)}'})
+    return fields
+
+def parse_precision(request) -> int | None:
+    value = request.query_params.get('precision')
+    if value is None:
+        return None
+    if not value.isdecimal() or int(value) > MAX_COORDINATE_PRECISION:
+        raise serializers.ValidationError(
+            {'precision': f'Precision must be a whole number between 0 and {MAX_COORDINATE_PRECISION}'}
+        )
+    return int(value)
+
+class SparseFieldsMixin:
+    # Drops every field not picked by ?fields=, except the ones identifying the object
+    required_fields = ('id',)
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            keep = {*fields, *self.required_fields}
+            for name in list(self.fields):
+                if name not in keep:
+                    self.fields.pop(name)
+
+class PropertySerializer(SparseFieldsMixin, GeoFeatureModelSerializer):
+    # A GeoJSON feature always has an id and a geometry, ?fields= picks its properties
+    required_fields = ('id', 'location')
+
     class Meta:
         model = Property
         geo_field = 'location'
@@ -13,6 +51,18 @@ class PropertySerializer(GeoFeatureModelSerializer):
             'handled_risks', 'total_financial_risk'
         ]
 
+    def __init__(self, *args, precision=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if precision is not None:
+            self.fields['location'].precision = precision
+
+    def get_properties(self, instance, fields):
+        properties = super().get_properties(instance, fields)
+        # Metres from the ?near= point, only present on querysets annotated by NearFilter
+        if hasattr(instance, 'distance'):
+            properties['distance'] = instance.distance
+        return properties
+
     def validate_name(self, value):
         if len(value.strip()) < 1:
             raise serializers.ValidationError("Name is required")
@@ -85,12 +135,75 @@ class PropertySerializer(GeoFeatureModelSerializer):
             )
         return attrs
 
-class PortfolioSerializer(serializers.ModelSerializer):
-    properties = PropertySerializer(many=True, read_only=True)
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    # Resolves each distinct key once when one serializer validates many rows
+    def to_internal_value(self, data):
+        if not isinstance(data, (int, str)):
+            return super().to_internal_value(data)
+        resolved = self.__dict__.setdefault('_resolved', {})
+        if data not in resolved:
+            resolved[data] = super().to_internal_value(data)
+        return resolved[data]
+
+class BulkPropertySerializer(PropertySerializer):
+    portfolio = CachedPrimaryKeyRelatedField(
+        queryset=Portfolio.objects.all(), allow_null=True, required=False
+    )
+
+    class Meta(PropertySerializer.Meta):
+        pass
 
+# Attributes under "properties" of a feature, in the order PropertySerializer emits them
+PROPERTY_FEATURE_FIELDS = [
+    field for field in PropertySerializer.Meta.fields if field not in ('id', 'location')
+]
+
+def property_features(rows, fields=None, precision=None) -> list[dict]:
+    # Encodes `.values()` rows carrying `lon`/`lat` exactly like PropertySerializer would,
+    # without building model instances, GEOS geometries or running DRF fields
+    rows = list(rows)
+    if fields is None:
+        fields = PROPERTY_FEATURE_FIELDS
+    else:
+        fields = [field for field in PROPERTY_FEATURE_FIELDS if field in fields]
+    if rows and 'distance' in rows[0]:
+        fields = [*fields, 'distance']
+
+    def coordinates(row):
+        if precision is None:
+            return [row['lon'], row['lat']]
+        return [round(row['lon'], precision), round(row['lat'], precision)]
+
+    return [
+        {
+            'id': row['id'],
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': coordinates(row)},
+            'properties': {field: row[field] for field in fields},
+        }
+        for row in rows
+    ]
+
+def property_columns(rows, names, fields, precision=None) -> dict:
+    # Transposes `.values_list('id', 'lon', 'lat', *names)` rows into one array per column,
+    # coordinates are flattened to [lon, lat, lon, lat, ...]
+    ids, lons, lats, *values = list(zip(*rows)) or [()] * (3 + len(names))
+    if precision is not None:
+        lons = [round(lon, precision) for lon in lons]
+        lats = [round(lat, precision) for lat in lats]
+    coordinates = [0.0] * (2 * len(ids))
+    coordinates[0::2] = lons
+    coordinates[1::2] = lats
+    return {
+        'ids': list(ids),
+        'coordinates': coordinates,
+        'columns': {name: list(column) for name, column in zip(names, values) if name in fields},
+    }
+
+class PortfolioSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Portfolio
-        fields = ['id', 'name', 'created_at', 'properties']
+        fields = ['id', 'name', 'created_at']
 
     def validate_name(self, value):
         if len(value.strip()) < 1:
@@ -98,3 +211,75 @@ class PortfolioSerializer(serializers.ModelSerializer):
         if len(value) > 100:
             raise serializers.ValidationError("Name must be less than 100 characters")
         return value.strip().title()
+
+class PortfolioSummarySerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    property_count = serializers.IntegerField(read_only=True)
+    total_estimated_value = serializers.IntegerField(read_only=True)
+    average_estimated_value = serializers.FloatField(read_only=True)
+    total_financial_risk = serializers.IntegerField(read_only=True)
+    relevant_risks = serializers.IntegerField(read_only=True)
+    handled_risks = serializers.IntegerField(read_only=True)
+    handled_risk_ratio = serializers.SerializerMethodField()
+    bbox = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Portfolio
+        fields = [
+            'id', 'name', 'created_at', 'property_count', 'total_estimated_value',
+            'average_estimated_value', 'total_financial_risk', 'relevant_risks',
+            'handled_risks', 'handled_risk_ratio', 'bbox'
+        ]
+
+    def get_handled_risk_ratio(self, obj) -> float | None:
+        if not obj.relevant_risks:
+            return None
+        return obj.handled_risks / obj.relevant_risks
+
+    def get_bbox(self, obj) -> list[float] | None:
+        return list(obj.extent) if obj.extent else None
+
+class RollupSerializer(serializers.ModelSerializer):
+    average_estimated_value = serializers.SerializerMethodField()
+    handled_risk_ratio = serializers.SerializerMethodField()
+
+    def get_average_estimated_value(self, obj) -> float | None:
+        if not obj.property_count:
+            return None
+        return obj.total_estimated_value / obj.property_count
+
+    def get_handled_risk_ratio(self, obj) -> float | None:
+        if not obj.relevant_risks:
+            return None
+        return obj.handled_risks / obj.relevant_risks
+
+ROLLUP_STATS_FIELDS = [
+    'property_count', 'total_estimated_value', 'average_estimated_value', 'total_financial_risk',
+    'relevant_risks', 'handled_risks', 'handled_risk_ratio'
+]
+
+class PortfolioStatsSerializer(RollupSerializer):
+    class Meta:
+        model = PortfolioRollup
+        fields = ['portfolio', *ROLLUP_STATS_FIELDS]
+
+class CityStatsSerializer(RollupSerializer):
+    class Meta:
+        model = CityRollup
+        fields = ['city', *ROLLUP_STATS_FIELDS]
+
+class JobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'portfolio', 'status', 'processed', 'total', 'progress', 'error',
+            'created_at', 'started_at', 'finished_at'
+        ]
+
+    def get_progress(self, obj) -> float | None:
+        if obj.status == Job.SUCCEEDED:
+            return 1.0
+        if not obj.total:
+            return None
+        return min(obj.processed / obj.total, 1.0)
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import invalidate_portfolios
+from .models import Portfolio
+
+# Property writes invalidate explicitly in the views and properties.bulk. A receiver on
+# Property would turn off fast deletes, so a portfolio delete would load every property row.
+@receiver(post_save, sender=Portfolio)
+@receiver(post_delete, sender=Portfolio)
+def invalidate_portfolio(sender, instance, **kwargs):
+    invalidate_portfolios([instance.pk])
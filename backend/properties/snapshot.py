@@ -0,0 +1,63 @@
+import json
+from pathlib import Path
+from django.db import connection, transaction
+from .cache import invalidate_portfolios
+from .models import Portfolio, Property
+
+# Restored in this order, properties reference their portfolio
+SNAPSHOT_MODELS = [Portfolio, Property]
+MANIFEST = 'manifest.json'
+
+def _columns(model) -> list[str]:
+    return [field.column for field in model._meta.concrete_fields]
+
+def _manifest() -> dict:
+    return {model._meta.db_table: _columns(model) for model in SNAPSHOT_MODELS}
+
+def snapshot_matches(directory: Path) -> bool:
+    # A snapshot from before a migration that changed these tables is regenerated instead
+    try:
+        return json.loads((directory / MANIFEST).read_text()) == _manifest()
+    except (OSError, ValueError):
+        return False
+
+def save_snapshot(directory: Path) -> None:
+    directory.mkdir(parents=True, exist_ok=True)
+    (directory / MANIFEST).unlink(missing_ok=True)
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(), connection.cursor() as cursor:
+        if outermost:
+            # Both tables from one snapshot, so every property's portfolio is in the file
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        for model in SNAPSHOT_MODELS:
+            table = model._meta.db_table
+            # COPY TO reads no rows from partitions, a query does
+            with open(directory / f'{table}.copy', 'wb') as file:
+                cursor.copy_expert(
+                    f"COPY (SELECT {', '.join(_columns(model))} FROM {table} ORDER BY id) TO STDOUT WITH (FORMAT binary)",
+                    file
+                )
+    # Written last, a snapshot cut short has no manifest and is not restored
+    (directory / MANIFEST).write_text(json.dumps(_manifest(), indent=2))
+
+def restore_snapshot(directory: Path) -> dict[str, int]:
+    # One binary COPY per table, the rollup and tombstone triggers fire as for any insert
+    with transaction.atomic(), connection.cursor() as cursor:
+        for model in SNAPSHOT_MODELS:
+            table = model._meta.db_table
+            with open(directory / f'{table}.copy', 'rb') as file:
+                cursor.copy_expert(
+                    f"COPY {table} ({', '.join(_columns(model))}) FROM STDIN WITH (FORMAT binary)", file
+                )
+            # The ids come from the snapshot, new rows continue after them
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) "
+                f"FROM {table}"
+            )
+    with connection.cursor() as cursor:
+        for model in SNAPSHOT_MODELS:
+            cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    # Property writes do not invalidate cached API responses by themselves
+    invalidate_portfolios(Portfolio.objects.values_list('pk', flat=True))
+    return {model._meta.db_table: model.objects.count() for model in SNAPSHOT_MODELS}
@@ -0,0 +1,73 @@
+import json
+import random
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from .models import PropertyTombstone
+
+# Tokens older than this may have lost deletes and need a full reload
+TOMBSTONE_RETENTION = timedelta(days=30)
+CLEANUP_PROBABILITY = 0.001
+# A delta sync with more changes than this should reload the list instead
+MAX_SYNC_CHANGES = 5000
+
+# Changes are stamped with clock_timestamp() when written but only become visible on commit.
+# The watermark is moved back to the start of the oldest transaction that has written
+# anything, so a change committed after the token was issued still has a later timestamp.
+WATERMARK_SQL = '''
+    SELECT LEAST(clock_timestamp(), MIN(xact_start)) FROM pg_stat_activity
+    WHERE backend_xid IS NOT NULL
+'''
+
+class SyncReset(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = 'The sync token is too old or too far behind, reload the full list and sync from a new token'
+    default_code = 'sync_reset'
+
+def sync_watermark() -> datetime:
+    with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+        cursor.execute(WATERMARK_SQL)
+        return cursor.fetchone()[0]
+
+def encode_token(watermark: datetime) -> str:
+    return urlsafe_b64encode(json.dumps({'t': watermark.isoformat()}).encode()).decode('ascii')
+
+def parse_since(request) -> datetime | None:
+    # An empty ?since= asks for a token to start from
+    token = request.query_params.get('since', '')
+    if not token:
+        return None
+    try:
+        since = datetime.fromisoformat(json.loads(urlsafe_b64decode(token.encode('ascii')))['t'])
+    except (TypeError, ValueError, KeyError):
+        raise ValidationError({'since': 'Invalid sync token'})
+    if since.tzinfo is None:
+        raise ValidationError({'since': 'Invalid sync token'})
+    return since
+
+def changes_since(queryset, since: datetime, portfolio_id=None) -> tuple[list, list[int]]:
+    # Always read from the primary, a lagging replica could hide changes older than the token
+    if since < timezone.now() - TOMBSTONE_RETENTION:
+        raise SyncReset()
+    tombstones = PropertyTombstone.objects.using(DEFAULT_DB_ALIAS).filter(deleted_at__gte=since)
+    if random.random() < CLEANUP_PROBABILITY:
+        PropertyTombstone.objects.filter(deleted_at__lt=timezone.now() - TOMBSTONE_RETENTION).delete()
+    if tombstones.filter(property_id__isnull=True).exists():
+        raise SyncReset()
+
+    rows = list(queryset.using(DEFAULT_DB_ALIAS).filter(updated_at__gte=since).order_by('updated_at', 'id')[
+        :MAX_SYNC_CHANGES + 1
+    ])
+    if len(rows) > MAX_SYNC_CHANGES:
+        raise SyncReset()
+
+    if portfolio_id is not None:
+        tombstones = tombstones.filter(portfolio_id=portfolio_id)
+    # A property that moved back into the synced set is reported as changed, not deleted
+    tombstones = tombstones.exclude(Exists(queryset.using(DEFAULT_DB_ALIAS).filter(id=OuterRef('property_id'))))
+    deleted = sorted(set(tombstones.values_list('property_id', flat=True)))
+    return rows, deleted
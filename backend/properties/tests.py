@@ -1,10 +1,35 @@
-from django.test import TestCase
-from django.core.cache import cache
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.core.cache import caches
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.geos import Point
+from django.db import OperationalError, connection, connections
+from django.db.models.deletion import Collector
+from django.utils import timezone
+from datetime import timedelta
+import time
+import threading
+import json
+from unittest import mock
+from io import StringIO
+from pathlib import Path
+import tempfile
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
 from rest_framework import status
-from .models import Property, Portfolio
-from .serializers import PropertySerializer
+from . import async_views, cache, routers, warmup
+from .metrics import MetricsRegistry, RequestTimings, metrics
+from .jobs import MAX_JOB_ATTEMPTS, claim_job, requeue_stale_jobs
+from .models import CityRollup, Job, Property, PropertyTombstone, Portfolio, PortfolioRollup, ThrottleBucket
+from .pagination import GeoCursorPagination, GeoPropertyPagination
+from .partitions import DEFAULT_PARTITION, attach_portfolio_partition, partition_name, portfolio_partitions
+from .rollups import check_rollups
+from .serializers import PROPERTY_FEATURE_FIELDS, PropertySerializer
+from .sync import TOMBSTONE_RETENTION, encode_token
+from .throttles import TokenBucketThrottle
+from .views import PropertyViewSet
 
 class PropertyViewSetTests(TestCase):
     def setUp(self):
@@ -125,6 +150,399 @@ class PropertyViewSetTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Property.objects.count(), 1)
 
+    def test_fast_list_matches_serializer_output(self):
+        Property.objects.create(
+            portfolio=None,
+            name="Bryggen 7",
+            address="Bryggen 7",
+            zip_code="5003",
+            city="Bergen",
+            location=Point(5.324378123456789, 60.397612987654321),
+            estimated_value=9000000,
+            relevant_risks=2,
+            handled_risks=2,
+            total_financial_risk=400000
+        )
+        url = '/api/properties/?ordering=-estimated_value&page_size=100'
+        fast = self.client.get(url, format='json')
+        caches['api'].clear()
+        PropertyViewSet.fast_list = False
+        try:
+            slow = self.client.get(url, format='json')
+        finally:
+            PropertyViewSet.fast_list = True
+        self.assertEqual(fast.status_code, status.HTTP_200_OK)
+        self.assertEqual(fast.content, slow.content)
+
+        queryset = Property.objects.order_by('-estimated_value')
+        serialized = PropertySerializer(queryset, many=True).data['features']
+        self.assertEqual(
+            JSONRenderer().render(fast.data['features']),
+            JSONRenderer().render(serialized)
+        )
+
+    def test_export_geojson(self):
+        response = self.client.get(f'/api/properties/export/?portfolio={self.portfolio1.pk}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/geo+json')
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['type'], 'FeatureCollection')
+        self.assertEqual([feature['id'] for feature in data['features']], [self.property1.pk])
+
+    def test_export_ndjson_matches_list(self):
+        response = self.client.get('/api/properties/export/?format=ndjson&in_bbox=0,50,20,70')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        features = [json.loads(line) for line in lines]
+        listed = self.client.get('/api/properties/?in_bbox=0,50,20,70', format='json').json()['features']
+        self.assertEqual(features, listed)
+
+    def test_export_csv(self):
+        response = self.client.get('/api/properties/export/?format=csv&ordering=-estimated_value')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'lon', 'lat'])
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith(f'{self.property1.pk},'))
+
+    def test_clusters_group_points_at_low_zoom(self):
+        response = self.client.get('/api/properties/clusters/?zoom=0', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        features = response.json()['features']
+        self.assertEqual(len(features), 1)
+        self.assertEqual(features[0]['properties']['count'], 2)
+        self.assertEqual(features[0]['properties']['estimated_value'], 40000000)
+        self.assertEqual(features[0]['properties']['total_financial_risk'], 2000000)
+
+    def test_clusters_return_points_at_high_zoom(self):
+        response = self.client.get('/api/properties/clusters/?zoom=18', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        features = response.json()['features']
+        self.assertEqual(len(features), 2)
+        self.assertEqual(
+            {feature['properties']['id'] for feature in features},
+            {self.property1.pk, self.property2.pk}
+        )
+
+    def test_clusters_filter_by_bbox_and_portfolio(self):
+        url = f'/api/properties/clusters/?zoom=0&in_bbox=0,50,20,70&portfolio={self.portfolio2.pk}'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        features = response.json()['features']
+        self.assertEqual(len(features), 1)
+        self.assertEqual(features[0]['properties']['count'], 1)
+
+    def test_clusters_require_valid_zoom(self):
+        for zoom in ('abc', '²', '23'):
+            response = self.client.get(f'/api/properties/clusters/?zoom={zoom}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_cursor_pagination(self):
+        response = self.client.get('/api/properties/?pagination=cursor&page_size=1', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['type'], 'FeatureCollection')
+        self.assertNotIn('count', response.json())
+        self.assertIsNone(response.json()['previous'])
+        self.assertEqual(response.json()['features'][0]['id'], self.property1.pk)
+
+        response = self.client.get(response.json()['next'], format='json')
+        self.assertEqual(response.json()['features'][0]['id'], self.property2.pk)
+        self.assertIsNone(response.json()['next'])
+
+        response = self.client.get(response.json()['previous'], format='json')
+        self.assertEqual(response.json()['features'][0]['id'], self.property1.pk)
+
+    def test_cursor_pagination_with_ordering_and_filters(self):
+        url = '/api/properties/?pagination=cursor&page_size=1&ordering=-estimated_value&in_bbox=0,50,20,70'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.json()['features'][0]['id'], self.property1.pk)
+        response = self.client.get(response.json()['next'], format='json')
+        self.assertEqual(response.json()['features'][0]['id'], self.property2.pk)
+
+        url = f'/api/properties/?pagination=cursor&portfolio={self.portfolio2.pk}'
+        response = self.client.get(url, format='json')
+        self.assertEqual(len(response.json()['features']), 1)
+        self.assertIsNone(response.json()['next'])
+
+    def test_near_orders_by_distance(self):
+        response = self.client.get('/api/properties/?near=5.3,60.4', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        features = response.json()['features']
+        self.assertEqual([f['id'] for f in features], [self.property2.pk, self.property1.pk])
+        self.assertLess(features[0]['properties']['distance'], 5000)
+        # Oslo to Bergen is roughly 300 km
+        self.assertAlmostEqual(features[1]['properties']['distance'] / 1000, 305, delta=15)
+
+    def test_near_with_radius(self):
+        response = self.client.get('/api/properties/?near=10.75,59.91&radius_m=2000', format='json')
+        features = response.json()['features']
+        self.assertEqual([f['id'] for f in features], [self.property1.pk])
+        self.assertLessEqual(features[0]['properties']['distance'], 2000)
+
+        response = self.client.get('/api/properties/?near=10.75,59.91&radius_m=400000', format='json')
+        self.assertEqual(len(response.json()['features']), 2)
+
+    def test_near_k_with_portfolio_and_pagination(self):
+        response = self.client.get('/api/properties/?near=10.75,59.91&k=1', format='json')
+        self.assertEqual([f['id'] for f in response.json()['features']], [self.property1.pk])
+
+        url = f'/api/properties/?near=10.75,59.91&k=1&portfolio={self.portfolio2.pk}'
+        response = self.client.get(url, format='json')
+        self.assertEqual([f['id'] for f in response.json()['features']], [self.property2.pk])
+
+        response = self.client.get('/api/properties/?near=10.75,59.91&k=2&page_size=1&page=2', format='json')
+        self.assertEqual(response.json()['count'], 2)
+        self.assertEqual(response.json()['features'][0]['id'], self.property2.pk)
+
+        # The nearest matches of the search, not the nearest properties then searched
+        response = self.client.get('/api/properties/?near=10.75,59.91&k=1&search=Bergen', format='json')
+        self.assertEqual([f['id'] for f in response.json()['features']], [self.property2.pk])
+
+    def test_near_with_cursor_pagination(self):
+        response = self.client.get('/api/properties/?near=5.3,60.4&pagination=cursor&page_size=1', format='json')
+        self.assertEqual(response.json()['features'][0]['id'], self.property2.pk)
+        response = self.client.get(response.json()['next'], format='json')
+        self.assertEqual(response.json()['features'][0]['id'], self.property1.pk)
+        self.assertIsNone(response.json()['next'])
+
+    def test_near_distance_in_serializer_output(self):
+        PropertyViewSet.fast_list = False
+        try:
+            response = self.client.get('/api/properties/?near=10.75,59.91&k=1', format='json')
+        finally:
+            PropertyViewSet.fast_list = True
+        self.assertIn('distance', response.json()['features'][0]['properties'])
+
+    def test_near_validation(self):
+        for query in ['near=abc', 'near=200,10', 'near=10,59&k=0', 'near=10,59&k=²', 'near=10,59&radius_m=-5', 'k=5', 'radius_m=100']:
+            response = self.client.get(f'/api/properties/?{query}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_sparse_fields(self):
+        for fast_list in (True, False):
+            PropertyViewSet.fast_list = fast_list
+            try:
+                response = self.client.get(
+                    '/api/properties/?fields=name,total_financial_risk&ordering=-estimated_value&pagination=cursor',
+                    format='json'
+                )
+            finally:
+                PropertyViewSet.fast_list = True
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            feature = response.json()['features'][0]
+            self.assertEqual(feature['id'], self.property1.pk)
+            self.assertEqual(feature['geometry']['coordinates'], [10.7522, 59.9139])
+            self.assertEqual(feature['properties'], {'name': 'Karl Johans gate 1', 'total_financial_risk': 1200000})
+
+    def test_sparse_fields_retrieve_and_writes(self):
+        response = self.client.get(f'/api/properties/{self.property1.pk}/?fields=city', format='json')
+        self.assertEqual(response.json()['properties'], {'city': 'Oslo'})
+        response = self.client.patch(
+            f'/api/properties/{self.property1.pk}/?fields=city', {'properties': {'name': 'Ny Gate 1'}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('estimated_value', response.json()['properties'])
+
+    def test_coordinate_precision(self):
+        for url in ['/api/properties/?precision=2', f'/api/properties/{self.property1.pk}/?precision=2']:
+            response = self.client.get(url, format='json')
+            feature = response.json()['features'][0] if 'features' in response.json() else response.json()
+            self.assertEqual(feature['geometry']['coordinates'], [10.75, 59.91])
+
+    def test_sparse_fields_validation(self):
+        for query in ['fields=name,unknown', 'precision=-1', 'precision=16', 'precision=abc', 'precision=²']:
+            response = self.client.get(f'/api/properties/?{query}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_compressed_responses(self):
+        for page in range(15):
+            Property.objects.create(
+                portfolio=self.portfolio1, name=f"Gate {page}", address=f"Gate {page}", zip_code="0154",
+                city="Oslo", location=Point(10.7, 59.9), estimated_value=1000000, relevant_risks=1,
+                handled_risks=0, total_financial_risk=10000
+            )
+        plain = self.client.get('/api/properties/?page_size=20')
+        for encoding in ('gzip', 'br'):
+            response = self.client.get('/api/properties/?page_size=20', HTTP_ACCEPT_ENCODING=encoding)
+            self.assertEqual(response['Content-Encoding'], encoding)
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertLess(len(response.content), len(plain.content))
+        sparse = self.client.get('/api/properties/?page_size=20&fields=total_financial_risk&precision=4')
+        self.assertLess(len(sparse.content), len(plain.content) / 2)
+
+    def test_columnar_format(self):
+        response = self.client.get('/api/properties/?format=columnar&ordering=-estimated_value&page_size=1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.columnar+json')
+        data = response.json()
+        self.assertEqual(data['count'], 2)
+        self.assertIsNotNone(data['next'])
+        self.assertEqual(data['ids'], [self.property1.pk])
+        self.assertEqual(data['coordinates'], [10.7522, 59.9139])
+        self.assertEqual(data['columns']['name'], ['Karl Johans gate 1'])
+        self.assertEqual(list(data['columns']), PROPERTY_FEATURE_FIELDS)
+
+    def test_columnar_format_by_accept_header(self):
+        response = self.client.get(
+            f'/api/properties/?portfolio={self.portfolio2.pk}&fields=city&precision=1&pagination=cursor',
+            HTTP_ACCEPT='application/vnd.columnar+json'
+        )
+        self.assertEqual(response.json(), {
+            'next': None, 'previous': None, 'ids': [self.property2.pk],
+            'coordinates': [5.3, 60.4], 'columns': {'city': ['Bergen']},
+        })
+
+    def test_columnar_format_only_for_list(self):
+        response = self.client.get(f'/api/properties/{self.property1.pk}/?format=columnar')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_search_ranks_by_similarity(self):
+        closest = Property.objects.create(
+            portfolio=self.portfolio1, name="Karl Johans gate 12", address="Karl Johans gate 12", zip_code="0159",
+            city="Oslo", location=Point(10.74, 59.91), estimated_value=1000000, relevant_risks=1,
+            handled_risks=0, total_financial_risk=10000
+        )
+        for query in ['search=Karl Johans gate 12', 'search=Karl Johans gate 12&pagination=cursor']:
+            response = self.client.get(f'/api/properties/?{query}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids = [feature['id'] for feature in response.json()['features']]
+            self.assertEqual(ids, [closest.pk, self.property1.pk], query)
+
+    def test_search_tolerates_typos_and_matches_zip_prefix(self):
+        response = self.client.get('/api/properties/?search=torgalmenningen', format='json')
+        self.assertEqual([feature['id'] for feature in response.json()['features']], [self.property2.pk])
+        response = self.client.get('/api/properties/?search=015', format='json')
+        self.assertEqual([feature['id'] for feature in response.json()['features']], [self.property1.pk])
+
+    def test_autocomplete(self):
+        response = self.client.get('/api/properties/autocomplete/?search=karl', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), [
+            {'id': self.property1.pk, 'name': 'Karl Johans gate 1', 'location': [10.7522, 59.9139]}
+        ])
+        response = self.client.get('/api/properties/autocomplete/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_heatmap(self):
+        Property.objects.create(
+            portfolio=self.portfolio1, name="Karl Johans gate 3", address="Karl Johans gate 3", zip_code="0154",
+            city="Oslo", location=Point(10.7532, 59.9141), estimated_value=1000000, relevant_risks=2,
+            handled_risks=1, total_financial_risk=10000
+        )
+        for shape in ('hex', 'square'):
+            response = self.client.get(
+                f'/api/properties/heatmap/?in_bbox=0,55,20,65&cell_size=100000&shape={shape}&metric=unhandled_risks',
+                format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            cells = sorted(response.json()['features'], key=lambda cell: cell['properties']['count'])
+            self.assertEqual([cell['properties'] for cell in cells], [
+                {'count': 1, 'value': 2}, {'count': 2, 'value': 3}
+            ], shape)
+            self.assertEqual(cells[0]['geometry']['type'], 'Polygon')
+
+        response = self.client.get(
+            f'/api/properties/heatmap/?in_bbox=0,55,20,65&cell_size=100000&portfolio={self.portfolio1.pk}',
+            format='json'
+        )
+        self.assertEqual([cell['properties'] for cell in response.json()['features']], [
+            {'count': 2, 'value': 1210000}
+        ])
+
+    def test_heatmap_validation(self):
+        for query in [
+            'cell_size=1000', 'in_bbox=0,55,20,65', 'in_bbox=0,55,20,65&cell_size=-1',
+            'in_bbox=0,55,20,65&cell_size=1000', 'in_bbox=0,55,20,65&cell_size=100000&shape=triangle',
+            'in_bbox=0,55,20,65&cell_size=100000&metric=estimated_value',
+        ]:
+            response = self.client.get(f'/api/properties/heatmap/?{query}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_count_none_returns_has_next(self):
+        response = self.client.get('/api/properties/?count=none&page_size=1', format='json')
+        data = response.json()
+        self.assertNotIn('count', data)
+        self.assertTrue(data['has_next'])
+        self.assertIsNone(data['previous'])
+        self.assertEqual([feature['id'] for feature in data['features']], [self.property1.pk])
+
+        data = self.client.get(data['next'], format='json').json()
+        self.assertFalse(data['has_next'])
+        self.assertIsNone(data['next'])
+        self.assertIsNotNone(data['previous'])
+        self.assertEqual([feature['id'] for feature in data['features']], [self.property2.pk])
+
+        for page in ('3', '0', '²'):
+            response = self.client.get(f'/api/properties/?count=none&page_size=1&page={page}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_count_estimate(self):
+        data = self.client.get('/api/properties/?count=estimate&format=columnar', format='json').json()
+        self.assertEqual((data['count'], data['count_estimated']), (2, False))
+        with mock.patch.object(GeoPropertyPagination, 'estimate_threshold', 0):
+            data = self.client.get('/api/properties/?count=estimate&page_size=5', format='json').json()
+        self.assertTrue(data['count_estimated'])
+        self.assertIsInstance(data['count'], int)
+        self.assertEqual(len(data['features']), 2)
+
+    def test_count_cached_until_write(self):
+        data = self.client.get('/api/properties/?count=cached&page_size=1', format='json').json()
+        self.assertEqual(data['count'], 2)
+        # Writes outside the API do not invalidate, so the cached count is served
+        Property.objects.bulk_create([Property(
+            portfolio=self.portfolio1, name="Gate 1", address="Gate 1", zip_code="0154", city="Oslo",
+            location=Point(10.7, 59.9), estimated_value=1, relevant_risks=1, handled_risks=0,
+            total_financial_risk=1
+        )])
+        data = self.client.get('/api/properties/?count=cached&page_size=2', format='json').json()
+        self.assertEqual(data['count'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/properties/', {
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [10.7, 59.9]},
+                'properties': {
+                    'portfolio': self.portfolio1.pk, 'name': 'Gate 2', 'address': 'Gate 2', 'zip_code': '0154',
+                    'city': 'Oslo', 'estimated_value': 1, 'relevant_risks': 1, 'handled_risks': 0,
+                    'total_financial_risk': 1,
+                },
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = self.client.get('/api/properties/?count=cached&page_size=3', format='json').json()
+        self.assertEqual(data['count'], 4)
+
+    def test_invalid_count_strategy(self):
+        response = self.client.get('/api/properties/?count=sometimes', format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/properties/?pagination=cursor&cursor=invalid', format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tampered_cursor(self):
+        # Valid cursors whose values do not fit the ordering fields
+        for position in (['many', 1], [None, 1], [[1], 1], [{'a': 1}, 1], [True, 1], [1, 'x']):
+            cursor = GeoCursorPagination.encode_position(position)
+            response = self.client.get(
+                f'/api/properties/?pagination=cursor&ordering=estimated_value&cursor={cursor}', format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+    def test_vector_tile(self):
+        response = self.client.get('/api/properties/tiles/0/0/0.mvt')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertGreater(len(response.content), 0)
+
+    def test_vector_tile_filter_by_portfolio(self):
+        empty_portfolio = Portfolio.objects.create(name="Empty Portfolio")
+        response = self.client.get(f'/api/properties/tiles/0/0/0.mvt?portfolio={empty_portfolio.pk}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.content), 0)
+
+    def test_vector_tile_out_of_range(self):
+        response = self.client.get('/api/properties/tiles/1/2/0.mvt')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
 class PortfolioViewSetTests(TestCase):
     def setUp(self):
         self.client = APIClient()
@@ -158,10 +576,374 @@ class PortfolioViewSetTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
         self.assertEqual(Portfolio.objects.count(), 0)
 
+    def _create_property(self, **kwargs):
+        data = {
+            'portfolio': self.portfolio,
+            'name': 'Karl Johans gate 1',
+            'address': 'Karl Johans gate 1',
+            'zip_code': '0154',
+            'city': 'Oslo',
+            'location': Point(10.7522, 59.9139),
+            'estimated_value': 25000000,
+            'relevant_risks': 4,
+            'handled_risks': 1,
+            'total_financial_risk': 1200000,
+        }
+        data.update(kwargs)
+        return Property.objects.create(**data)
+
+    def test_list_portfolios_does_not_nest_properties(self):
+        self._create_property()
+        response = self.client.get('/api/portfolios/', format='json')
+        self.assertNotIn('properties', response.json()[0])
+
+    def test_portfolio_summary(self):
+        self._create_property()
+        self._create_property(
+            location=Point(10.8, 60.0), estimated_value=15000000,
+            relevant_risks=4, handled_risks=3, total_financial_risk=800000
+        )
+        Portfolio.objects.create(name="Empty Portfolio")
+        response = self.client.get('/api/portfolios/?view=summary', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        summary, empty = response.json()
+        self.assertEqual(summary['property_count'], 2)
+        self.assertEqual(summary['total_estimated_value'], 40000000)
+        self.assertEqual(summary['average_estimated_value'], 20000000)
+        self.assertEqual(summary['total_financial_risk'], 2000000)
+        self.assertEqual(summary['handled_risk_ratio'], 0.5)
+        self.assertEqual(summary['bbox'], [10.7522, 59.9139, 10.8, 60.0])
+        self.assertEqual(empty['property_count'], 0)
+        self.assertIsNone(empty['handled_risk_ratio'])
+        self.assertIsNone(empty['bbox'])
+
+    def test_portfolio_sparse_fields(self):
+        response = self.client.get('/api/portfolios/?fields=name', format='json')
+        self.assertEqual(response.json(), [{'id': self.portfolio.pk, 'name': 'Oslo Portfolio'}])
+        self._create_property()
+        response = self.client.get('/api/portfolios/?view=summary&fields=property_count', format='json')
+        self.assertEqual(response.json(), [{'id': self.portfolio.pk, 'property_count': 1}])
+        response = self.client.get(
+            f'/api/portfolios/{self.portfolio.pk}/properties/?fields=city&precision=1', format='json'
+        )
+        feature = response.json()['features'][0]
+        self.assertEqual(feature['properties'], {'city': 'Oslo'})
+        self.assertEqual(feature['geometry']['coordinates'], [10.8, 59.9])
+
+    def test_portfolio_properties_are_paginated(self):
+        for _ in range(3):
+            self._create_property()
+        response = self.client.get(f'/api/portfolios/{self.portfolio.pk}/properties/?page_size=2', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['count'], 3)
+        self.assertEqual(len(response.json()['features']), 2)
+        self.assertIsNotNone(response.json()['next'])
+
+class BulkPropertyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.portfolio = Portfolio.objects.create(name="Oslo Portfolio")
+
+    def _feature(self, **properties):
+        data = {
+            'portfolio': self.portfolio.pk,
+            'name': 'Karl Johans gate 1',
+            'address': 'Karl Johans gate 1',
+            'zip_code': '0154',
+            'city': 'Oslo',
+            'estimated_value': 25000000,
+            'relevant_risks': 5,
+            'handled_risks': 3,
+            'total_financial_risk': 1200000
+        }
+        data.update(properties)
+        return {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [10.7522, 59.9139]},
+            'properties': data
+        }
+
+    def _collection(self, *features):
+        return {'type': 'FeatureCollection', 'features': list(features)}
+
+    def test_bulk_create(self):
+        data = self._collection(self._feature(), self._feature(address='Torggata 2'))
+        response = self.client.post('/api/properties/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['created'], 2)
+        self.assertEqual(len(response.json()['ids']), 2)
+        self.assertEqual(Property.objects.count(), 2)
+
+    def test_bulk_reports_errors_per_feature(self):
+        data = self._collection(
+            self._feature(),
+            self._feature(relevant_risks=1, handled_risks=4),
+            self._feature(zip_code='12345')
+        )
+        response = self.client.post('/api/properties/bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()['errors']
+        self.assertEqual([error['index'] for error in errors], [1, 2])
+        self.assertIn('non_field_errors', errors[0]['errors'])
+        self.assertIn('zip_code', errors[1]['errors'])
+        self.assertEqual(Property.objects.count(), 0)
+
+    def test_bulk_update_by_id(self):
+        response = self.client.post('/api/properties/bulk/', self._collection(self._feature()), format='json')
+        feature = self._feature(estimated_value=30000000)
+        feature['id'] = response.json()['ids'][0]
+        response = self.client.post('/api/properties/bulk/', self._collection(feature), format='json')
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual(Property.objects.get().estimated_value, 30000000)
+
+        feature['id'] = 999999
+        response = self.client.post('/api/properties/bulk/', self._collection(feature), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_upsert_by_natural_key(self):
+        self.client.post('/api/properties/bulk/', self._collection(self._feature()), format='json')
+        data = self._collection(self._feature(estimated_value=30000000), self._feature(address='Torggata 2'))
+        response = self.client.post('/api/properties/bulk/?upsert=true', data, format='json')
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertEqual(response.json()['created'], 1)
+        self.assertEqual(Property.objects.count(), 2)
+        self.assertEqual(Property.objects.get(address='Karl Johans Gate 1').estimated_value, 30000000)
+
+    def test_bulk_rejects_repeated_and_boolean_ids(self):
+        pk = self.client.post('/api/properties/bulk/', self._collection(self._feature()), format='json').json()['ids'][0]
+        features = [self._feature(), self._feature(), self._feature()]
+        features[0]['id'] = pk
+        features[1]['id'] = pk
+        features[2]['id'] = True
+        response = self.client.post('/api/properties/bulk/', self._collection(*features), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()['errors']
+        self.assertEqual([error['index'] for error in errors], [1, 2])
+        self.assertEqual(errors[0]['errors']['id'], ['Repeats the id of feature 0'])
+        self.assertEqual(errors[1]['errors']['id'], ['Id must be a whole number'])
+
+        response = self.client.delete('/api/properties/bulk/', {'ids': [True]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Property.objects.count(), 1)
+
+    def test_bulk_upsert_rejects_repeated_natural_keys(self):
+        # The serializer title-cases addresses, so these two are the same property
+        data = self._collection(self._feature(), self._feature(address='KARL JOHANS GATE 1'))
+        response = self.client.post('/api/properties/bulk/?upsert=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.json()['errors']
+        self.assertEqual([error['index'] for error in errors], [1])
+        self.assertEqual(errors[0]['errors']['non_field_errors'], ['Repeats the portfolio, address and zip code of feature 0'])
+
+        pk = self.client.post('/api/properties/bulk/', self._collection(self._feature()), format='json').json()['ids'][0]
+        feature = self._feature(estimated_value=30000000)
+        feature['id'] = pk
+        response = self.client.post('/api/properties/bulk/?upsert=true', self._collection(feature, self._feature()), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json()['errors'][0]['errors']['non_field_errors'], ['Matches the same property as feature 0'])
+        self.assertEqual(Property.objects.get().estimated_value, 25000000)
+
+    def test_bulk_delete(self):
+        data = self._collection(self._feature(), self._feature(address='Torggata 2'))
+        ids = self.client.post('/api/properties/bulk/', data, format='json').json()['ids']
+        response = self.client.delete('/api/properties/bulk/', {'ids': ids + ids}, format='json')
+        self.assertEqual(response.json()['deleted'], 2)
+        self.assertEqual(Property.objects.count(), 0)
+
+    def test_bulk_write_invalidates_cache(self):
+        self.client.get('/api/properties/', format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/properties/bulk/', self._collection(self._feature()), format='json')
+        response = self.client.get('/api/properties/', format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['features']), 1)
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.portfolio = Portfolio.objects.create(name="Oslo Portfolio")
+        self.property = Property.objects.create(
+            portfolio=self.portfolio,
+            name="Karl Johans gate 1",
+            address="Karl Johans gate 1",
+            zip_code="0154",
+            city="Oslo",
+            location=Point(10.7522, 59.9139),
+            estimated_value=25000000,
+            relevant_risks=5,
+            handled_risks=3,
+            total_financial_risk=1200000
+        )
+
+    def _update_property(self, **properties):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/properties/{self.property.pk}/', {'properties': properties}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_writes_are_invalidated_once_committed(self):
+        url = f'/api/properties/?portfolio={self.portfolio.pk}'
+        self.client.get(url, format='json')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.patch(f'/api/properties/{self.property.pk}/', {'properties': {'name': 'Ny Gate 1'}}, format='json')
+            # Still the old version while the write is uncommitted
+            self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'HIT')
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'MISS')
+
+    def test_property_deletes_stay_fast(self):
+        # No receivers on Property, so a portfolio delete removes its properties in one query
+        self.assertTrue(Collector(using='default').can_fast_delete(Property.objects.all()))
+
+    def test_repeated_list_is_served_from_cache(self):
+        first = self.client.get('/api/properties/', format='json')
+        second = self.client.get('/api/properties/', format='json')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_if_none_match_returns_not_modified(self):
+        response = self.client.get(f'/api/portfolios/{self.portfolio.pk}/', format='json')
+        etag = response['ETag']
+        response = self.client.get(
+            f'/api/portfolios/{self.portfolio.pk}/', format='json', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_writes_invalidate_cached_responses(self):
+        url = f'/api/properties/?portfolio={self.portfolio.pk}'
+        self.client.get(url, format='json')
+        self.client.get('/api/portfolios/?view=summary', format='json')
+
+        self._update_property(estimated_value=30000000)
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['features'][0]['properties']['estimated_value'], 30000000)
+        response = self.client.get('/api/portfolios/?view=summary', format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()[0]['total_estimated_value'], 30000000)
+
+    def test_writes_invalidate_padded_portfolio_ids(self):
+        url = f'/api/properties/?portfolio=0{self.portfolio.pk}'
+        self.client.get(url, format='json')
+        self.client.get(f'/api/portfolios/0{self.portfolio.pk}/', format='json')
+
+        self._update_property(estimated_value=30000000)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.portfolio.name = "Oslo Portfolio 2"
+            self.portfolio.save()
+
+        response = self.client.get(url, format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['features'][0]['properties']['estimated_value'], 30000000)
+        response = self.client.get(f'/api/portfolios/0{self.portfolio.pk}/', format='json')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], "Oslo Portfolio 2")
+
+    def test_writes_keep_other_portfolios_cached(self):
+        other = Portfolio.objects.create(name="Bergen Portfolio")
+        url = f'/api/properties/?portfolio={other.pk}'
+        self.client.get(url, format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/properties/{self.property.pk}/')
+        response = self.client.get(url, format='json')
+        self.assertEqual(response['X-Cache'], 'HIT')
+
+    @override_settings(REPLICA_STICKY_SECONDS=5)
+    def test_replica_reads_after_a_write_are_not_cached(self):
+        url = f'/api/properties/?portfolio={self.portfolio.pk}'
+        self._update_property(estimated_value=30000000)
+
+        # A lagging replica could still return the old value, so its response is not stored
+        with mock.patch.object(cache, 'read_alias', return_value='replica_0'):
+            self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'MISS')
+            self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'MISS')
+            with mock.patch.object(cache, 'time') as clock:
+                clock.time.return_value = time.time() + 6
+                self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'MISS')
+                self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'HIT')
+
+        # Reads from the primary are stored right after the write
+        self._update_property(estimated_value=35000000)
+        self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url, format='json')['X-Cache'], 'HIT')
+
+    def test_cache_stats(self):
+        before = self.client.get('/api/cache/stats/', format='json').json()
+        self.client.get('/api/properties/', format='json')
+        self.client.get('/api/properties/', format='json')
+        after = self.client.get('/api/cache/stats/', format='json').json()
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.factory = AsyncRequestFactory()
+        self.portfolio = Portfolio.objects.create(name="Oslo Portfolio")
+        for number in range(3):
+            Property.objects.create(
+                portfolio=self.portfolio,
+                name=f"Karl Johans gate {number}",
+                address=f"Karl Johans gate {number}",
+                zip_code="0154",
+                city="Oslo",
+                location=Point(10.7522 + number / 100, 59.9139),
+                estimated_value=25000000,
+                relevant_risks=5,
+                handled_risks=3,
+                total_financial_risk=1200000
+            )
+
+    async def test_property_list_matches_sync_view(self):
+        url = f'/api/properties/?portfolio={self.portfolio.pk}&ordering=-name&page_size=2&page=2'
+        response = await async_views.property_list_view(self.factory.get(url))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        await caches['api'].aclear()
+        expected = await self._sync_get(url)
+        self.assertEqual(json.loads(response.content), expected)
+
+    async def test_property_list_invalid_page(self):
+        response = await async_views.property_list_view(self.factory.get('/api/properties/?page=5'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_property_retrieve(self):
+        prop = await Property.objects.afirst()
+        request = self.factory.get(f'/api/properties/{prop.pk}/')
+        response = await async_views.property_detail_view(request, pk=str(prop.pk))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['id'], prop.pk)
+
+        response = await async_views.property_detail_view(self.factory.get('/api/properties/999999/'), pk='999999')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_portfolio_summary_list(self):
+        response = await async_views.portfolio_list_view(self.factory.get('/api/portfolios/?view=summary'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)[0]['property_count'], 3)
+
+    async def test_writes_use_sync_view(self):
+        request = self.factory.post('/api/portfolios/', {'name': 'New Portfolio'}, content_type='application/json')
+        response = await async_views.portfolio_list_view(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(await Portfolio.objects.filter(name='New Portfolio').aexists())
+
+    async def _sync_get(self, url):
+        response = await sync_to_async(self.client.get)(url)
+        return response.json()
+
 class ThrottleTests(TestCase):
     def setUp(self):
         self.client = APIClient()
-        cache.clear()
+        # Freeze the clock so no tokens are refilled while the requests run
+        self.now = 1700000000.0
+        patcher = mock.patch.object(TokenBucketThrottle, 'timer', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_property_throttling(self):
         for _ in range(100):
@@ -170,6 +952,7 @@ class ThrottleTests(TestCase):
 
         response = self.client.get('/api/properties/')
         self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', response)
 
     def test_portfolio_throttling(self):
         for _ in range(100):
@@ -179,8 +962,38 @@ class ThrottleTests(TestCase):
         response = self.client.get('/api/portfolios/')
         self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
 
-    def tearDown(self):
-        cache.clear()
+    def test_tokens_refill_over_time(self):
+        for _ in range(100):
+            self.client.get('/api/portfolios/')
+        self.assertEqual(self.client.get('/api/portfolios/').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        # 100/minute refills one token every 0.6 seconds
+        self.now += 0.6
+        self.assertEqual(self.client.get('/api/portfolios/').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/api/portfolios/').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        self.now += 3600
+        for _ in range(100):
+            self.assertEqual(self.client.get('/api/portfolios/').status_code, status.HTTP_200_OK)
+
+    def test_reads_and_writes_have_separate_rates(self):
+        for _ in range(100):
+            self.client.get('/api/portfolios/')
+        self.assertEqual(self.client.get('/api/portfolios/').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        for number in range(30):
+            response = self.client.post('/api/portfolios/', {'name': f'Portfolio {number}'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post('/api/portfolios/', {'name': 'One too many'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_buckets_are_shared(self):
+        # Every worker reads the same row, so state outlives a single throttle instance or process
+        for _ in range(100):
+            self.client.get('/api/portfolios/')
+        bucket = ThrottleBucket.objects.get()
+        self.assertEqual(bucket.tokens, 0)
+        self.assertEqual(bucket.updated_at, self.now)
 
 class SerializerValidationTests(TestCase):
     def setUp(self):
@@ -318,3 +1131,588 @@ class SerializerValidationTests(TestCase):
         serializer = PropertySerializer(data=data)
         self.assertFalse(serializer.is_valid())
         self.assertIn('total_financial_risk', serializer.errors)
+
+@override_settings(REPLICA_DATABASES=['replica_0'], REPLICA_STICKY_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.factory = RequestFactory()
+        self.router = routers.ReplicaRouter()
+        patcher = mock.patch.object(routers, 'connections')
+        self.connections = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(routers._replica_down_until.clear)
+        self.addCleanup(routers._read_alias.set, None)
+
+    def test_safe_requests_read_from_replica(self):
+        routers.route_reads(self.factory.get('/api/properties/'))
+        self.assertEqual(routers.read_alias(), 'replica_0')
+        self.assertEqual(self.router.db_for_read(Property), 'replica_0')
+        self.assertEqual(self.router.db_for_write(Property), 'default')
+        # Other apps, such as the database cache table, stay on the primary
+        self.assertIsNone(self.router.db_for_read(ContentType))
+
+    def test_writes_and_recent_writers_use_primary(self):
+        routers.route_reads(self.factory.post('/api/properties/'))
+        self.assertEqual(routers.read_alias(), 'default')
+
+        request = self.factory.get('/api/properties/')
+        request.COOKIES[routers.STICKY_COOKIE] = str(time.time() + 5)
+        routers.route_reads(request)
+        self.assertEqual(routers.read_alias(), 'default')
+
+        request.COOKIES[routers.STICKY_COOKIE] = str(time.time() - 1)
+        routers.route_reads(request)
+        self.assertEqual(routers.read_alias(), 'replica_0')
+
+    def test_falls_back_to_primary_when_replica_is_down(self):
+        self.connections.__getitem__.return_value.ensure_connection.side_effect = OperationalError
+        routers.route_reads(self.factory.get('/api/properties/'))
+        self.assertEqual(routers.read_alias(), 'default')
+
+        # The failed replica is skipped without another connection attempt
+        routers.route_reads(self.factory.get('/api/properties/'))
+        self.assertEqual(self.connections.__getitem__.return_value.ensure_connection.call_count, 1)
+
+    def test_falls_back_when_persistent_connection_died(self):
+        replica = self.connections.__getitem__.return_value
+        # The open connection fails its health check and is closed, reconnecting then fails too
+        replica.close_if_health_check_failed.side_effect = lambda: setattr(replica.ensure_connection, 'side_effect', OperationalError)
+        routers.route_reads(self.factory.get('/api/properties/'))
+        self.assertEqual(routers.read_alias(), 'default')
+        replica.close_if_health_check_failed.assert_called_once_with()
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_no_replicas_configured(self):
+        routers.route_reads(self.factory.get('/api/properties/'))
+        self.assertEqual(routers.read_alias(), 'default')
+        self.assertIsNone(self.router.db_for_read(Property))
+
+    @override_settings(REPLICA_DATABASES=[])
+    def test_write_sets_sticky_cookie(self):
+        response = self.client.get('/api/portfolios/')
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+        response = self.client.post('/api/portfolios/', {'name': 'New Portfolio'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.cookies[routers.STICKY_COOKIE]['max-age'], 5)
+        self.assertEqual(routers.read_alias(), 'default')
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        metrics.pending.clear()
+        self.addCleanup(metrics.pending.clear)
+        Portfolio.objects.create(name="Oslo Portfolio")
+
+    def test_server_timing_header(self):
+        response = self.client.get('/api/portfolios/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response['Server-Timing'], r'^db;dur=[\d.]+;desc="\d+ queries", serialize;dur=[\d.]+, render;dur=[\d.]+, total;dur=[\d.]+$')
+
+    def test_metrics_endpoint(self):
+        self.client.get('/api/portfolios/')
+        self.client.get('/api/portfolios/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        text = response.content.decode()
+        self.assertIn('# TYPE api_request_duration_seconds histogram', text)
+        self.assertIn('api_requests_total{action="list",method="GET",status="200",view="portfolio-list"} 2.0', text)
+        self.assertIn('api_request_duration_seconds_bucket{action="list",view="portfolio-list",le="+Inf"} 2.0', text)
+        self.assertIn('api_request_duration_seconds_count{action="list",view="portfolio-list"} 2.0', text)
+
+    def test_metrics_aggregate_across_workers(self):
+        # Each worker process has its own registry, the shared table sums them
+        timings = RequestTimings()
+        timings.queries = 3
+        for _ in range(2):
+            worker = MetricsRegistry()
+            worker.record('property-list', 'list', 'GET', 200, 0.02, timings)
+            worker.flush()
+
+        text = metrics.render()
+        self.assertIn('api_db_queries_total{action="list",view="property-list"} 6.0', text)
+        self.assertIn('api_request_duration_seconds_bucket{action="list",view="property-list",le="0.01"} 0.0', text)
+        self.assertIn('api_request_duration_seconds_bucket{action="list",view="property-list",le="0.025"} 2.0', text)
+
+    def test_serialization_is_timed(self):
+        for url in ('/api/portfolios/', '/api/properties/', '/api/properties/?format=columnar'):
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        text = metrics.render()
+        self.assertIn('api_serialize_duration_seconds_total{action="list",view="portfolio-list"}', text)
+        self.assertIn('api_serialize_duration_seconds_total{action="list",view="property-list"}', text)
+
+    def test_failed_flush_keeps_the_response(self):
+        with mock.patch.object(metrics, 'flush_due', return_value=True):
+            with mock.patch.object(metrics, 'flush', side_effect=OperationalError):
+                with self.assertLogs('properties.metrics', level='ERROR'):
+                    response = self.client.get('/api/portfolios/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_idle_workers_flush_on_a_timer(self):
+        worker = MetricsRegistry()
+        worker.flush_seconds = 0.01
+        flushed = threading.Event()
+        with mock.patch.object(worker, 'flush', side_effect=flushed.set):
+            thread = worker.start_flushing()
+            self.assertTrue(flushed.wait(timeout=5))
+            worker.stopping.set()
+            thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+    def test_failed_flush_keeps_samples(self):
+        worker = MetricsRegistry()
+        worker.record('property-list', 'list', 'GET', 200, 0.02, RequestTimings())
+        with mock.patch('properties.metrics.connection') as failing:
+            failing.cursor.side_effect = OperationalError
+            with self.assertRaises(OperationalError):
+                worker.flush()
+        # Flushed on worker exit
+        worker.stop()
+        self.assertIn('api_requests_total{action="list",method="GET",status="200",view="property-list"} 1.0', metrics.render())
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_are_logged_with_plan(self):
+        with self.assertLogs('properties.metrics', level='WARNING') as logs:
+            self.client.get('/api/portfolios/')
+        self.assertTrue(any('Slow query' in line and 'Scan' in line for line in logs.output))
+
+class RollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oslo = Portfolio.objects.create(name="Oslo Portfolio")
+        self.bergen = Portfolio.objects.create(name="Bergen Portfolio")
+
+    def _create_property(self, portfolio, city, estimated_value, **kwargs):
+        return Property.objects.create(
+            portfolio=portfolio,
+            name="Test Street 1",
+            address="Test Street 1",
+            zip_code="0154",
+            city=city,
+            location=Point(10.7522, 59.9139),
+            estimated_value=estimated_value,
+            relevant_risks=kwargs.get('relevant_risks', 4),
+            handled_risks=kwargs.get('handled_risks', 2),
+            total_financial_risk=kwargs.get('total_financial_risk', 1000)
+        )
+
+    def _totals(self, model, key):
+        return model.objects.filter(pk=key).values_list('property_count', 'total_estimated_value').first()
+
+    def test_rollups_follow_inserts_updates_and_deletes(self):
+        first = self._create_property(self.oslo, 'Oslo', 100)
+        self._create_property(self.oslo, 'Oslo', 300)
+        self._create_property(self.bergen, 'Bergen', 50)
+        self.assertEqual(self._totals(PortfolioRollup, self.oslo.pk), (2, 400))
+        self.assertEqual(self._totals(CityRollup, 'Bergen'), (1, 50))
+
+        # Reassigning a property moves its totals between portfolios and cities
+        first.portfolio = self.bergen
+        first.city = 'Bergen'
+        first.estimated_value = 150
+        first.save()
+        self.assertEqual(self._totals(PortfolioRollup, self.oslo.pk), (1, 300))
+        self.assertEqual(self._totals(PortfolioRollup, self.bergen.pk), (2, 200))
+        self.assertEqual(self._totals(CityRollup, 'Bergen'), (2, 200))
+
+        first.delete()
+        self.assertEqual(self._totals(CityRollup, 'Bergen'), (1, 50))
+        Property.objects.filter(city='Bergen').delete()
+        self.assertFalse(CityRollup.objects.filter(city='Bergen').exists())
+        self.assertEqual(check_rollups(), [])
+
+    def test_rollups_follow_bulk_writes(self):
+        Property.objects.bulk_create([
+            Property(
+                portfolio=self.oslo, name="Bulk", address="Bulk", zip_code="0154", city='Oslo',
+                location=Point(10.7522, 59.9139), estimated_value=10, relevant_risks=1,
+                handled_risks=1, total_financial_risk=5
+            )
+            for _ in range(5)
+        ])
+        Property.objects.filter(city='Oslo').update(estimated_value=20)
+        self.assertEqual(self._totals(PortfolioRollup, self.oslo.pk), (5, 100))
+
+        self.oslo.delete()
+        self.assertFalse(PortfolioRollup.objects.exists())
+        self.assertEqual(check_rollups(), [])
+
+    def test_check_and_rebuild_command(self):
+        self._create_property(self.oslo, 'Oslo', 100)
+        CityRollup.objects.filter(city='Oslo').update(total_estimated_value=1)
+        CityRollup.objects.create(city='Nowhere', property_count=1)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(check_rollups(), [])
+        call_command('rebuild_rollups', check=True, stdout=StringIO())
+
+    def test_portfolio_stats(self):
+        self._create_property(self.oslo, 'Oslo', 100, relevant_risks=4, handled_risks=1)
+        self._create_property(self.oslo, 'Bergen', 300, relevant_risks=4, handled_risks=3)
+        response = self.client.get(f'/api/portfolios/{self.oslo.pk}/stats/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), {
+            'portfolio': self.oslo.pk,
+            'property_count': 2,
+            'total_estimated_value': 400,
+            'average_estimated_value': 200.0,
+            'total_financial_risk': 2000,
+            'relevant_risks': 8,
+            'handled_risks': 4,
+            'handled_risk_ratio': 0.5,
+        })
+
+        response = self.client.get(f'/api/portfolios/{self.bergen.pk}/stats/', format='json')
+        self.assertEqual(response.json()['property_count'], 0)
+        self.assertIsNone(response.json()['average_estimated_value'])
+
+        response = self.client.get('/api/portfolios/999999/stats/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_city_stats(self):
+        self._create_property(self.oslo, 'Oslo', 100)
+        self._create_property(self.bergen, 'Bergen', 300)
+        self._create_property(None, 'Bergen', 200)
+        response = self.client.get('/api/stats/cities/', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['city'], row['property_count'], row['total_estimated_value']) for row in response.json()],
+            [('Bergen', 2, 500), ('Oslo', 1, 100)]
+        )
+
+class DeltaSyncTests(TransactionTestCase):
+    # The sync watermark steps back to the oldest open write transaction, which under
+    # TestCase would always be the test itself
+    def setUp(self):
+        self.client = APIClient()
+        self.oslo = Portfolio.objects.create(name="Oslo Portfolio")
+        self.bergen = Portfolio.objects.create(name="Bergen Portfolio")
+        self.changed = self._create_property(self.oslo, 'Karl Johans gate 1')
+        self.deleted = self._create_property(self.oslo, 'Karl Johans gate 2')
+        self.moved = self._create_property(self.oslo, 'Karl Johans gate 3')
+
+    def _create_property(self, portfolio, name):
+        return Property.objects.create(
+            portfolio=portfolio, name=name, address=name, zip_code='0154', city='Oslo',
+            location=Point(10.7522, 59.9139), estimated_value=100, relevant_risks=2,
+            handled_risks=1, total_financial_risk=10
+        )
+
+    def _sync(self, token='', query=''):
+        response = self.client.get(f'/api/properties/?since={token}{query}', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()
+
+    def test_sync_returns_changes_and_deletes(self):
+        start = self._sync()
+        self.assertEqual((start['features'], start['deleted']), ([], []))
+
+        Property.objects.filter(pk=self.changed.pk).update(estimated_value=200)
+        # Updates that change nothing are not reported
+        Property.objects.filter(pk=self.moved.pk).update(name='Karl Johans gate 3')
+        self.deleted.delete()
+        created = self._create_property(self.bergen, 'Torgallmenningen 1')
+
+        changes = self._sync(start['token'], '&fields=estimated_value')
+        self.assertEqual([feature['id'] for feature in changes['features']], [self.changed.pk, created.pk])
+        self.assertEqual(changes['features'][0]['properties'], {'estimated_value': 200})
+        self.assertEqual(changes['deleted'], [self.deleted.pk])
+
+        latest = self._sync(changes['token'])
+        self.assertEqual((latest['features'], latest['deleted']), ([], []))
+
+    def test_portfolio_sync_reports_moved_properties(self):
+        start = self._sync()
+        Property.objects.filter(pk=self.moved.pk).update(portfolio=self.bergen)
+
+        oslo = self._sync(start['token'], f'&portfolio={self.oslo.pk}')
+        self.assertEqual((oslo['features'], oslo['deleted']), ([], [self.moved.pk]))
+        bergen = self._sync(start['token'], f'&portfolio={self.bergen.pk}')
+        self.assertEqual(([feature['id'] for feature in bergen['features']], bergen['deleted']), ([self.moved.pk], []))
+        everything = self._sync(start['token'])
+        self.assertEqual(everything['deleted'], [])
+
+    def test_sync_reset(self):
+        start = self._sync()
+        response = self.client.get('/api/properties/?since=invalid', format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        expired = encode_token(timezone.now() - TOMBSTONE_RETENTION - timedelta(hours=1))
+        response = self.client.get(f'/api/properties/?since={expired}', format='json')
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {Property._meta.db_table}')
+        response = self.client.get(f'/api/properties/?since={start["token"]}', format='json')
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+
+class PartitionTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.oslo = Portfolio.objects.create(name="Oslo Portfolio")
+        self.bergen = Portfolio.objects.create(name="Bergen Portfolio")
+        self.oslo_ids = [self._create_property(self.oslo, 'Oslo').pk for _ in range(3)]
+        self.bergen_id = self._create_property(self.bergen, 'Bergen').pk
+
+    def _create_property(self, portfolio, city):
+        return Property.objects.create(
+            portfolio=portfolio, name="Test Street 1", address="Test Street 1", zip_code='0154',
+            city=city, location=Point(10.7522, 59.9139), estimated_value=100, relevant_risks=2,
+            handled_risks=1, total_financial_risk=10
+        )
+
+    def _ids(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT id FROM {table} ORDER BY id')
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_command_moves_large_portfolios_to_their_own_partition(self):
+        call_command('partition_properties', min_rows=2, stdout=StringIO())
+        partition = partition_name(self.oslo.pk)
+        self.assertEqual(portfolio_partitions(), {self.oslo.pk: partition})
+        self.assertEqual(self._ids(partition), self.oslo_ids)
+        self.assertEqual(self._ids(DEFAULT_PARTITION), [self.bergen_id])
+        self.assertEqual(check_rollups(), [])
+
+        # The portfolio filter only reads the portfolio's partition
+        plan = Property.objects.filter(portfolio_id=self.oslo.pk).explain()
+        self.assertIn(partition, plan)
+        self.assertNotIn(DEFAULT_PARTITION, plan)
+        response = self.client.get(f'/api/properties/?portfolio={self.oslo.pk}', format='json')
+        self.assertEqual(sorted(feature['id'] for feature in response.json()['features']), self.oslo_ids)
+        for portfolio in ('oslo', '²'):
+            response = self.client.get(f'/api/properties/?portfolio={portfolio}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/portfolios/²/', format='json').status_code, status.HTTP_404_NOT_FOUND)
+
+        # Moving a property to the partitioned portfolio moves its row, the triggers still follow it
+        Property.objects.filter(pk=self.bergen_id).update(portfolio=self.oslo)
+        self.assertEqual(self._ids(partition), [*self.oslo_ids, self.bergen_id])
+        self.assertEqual(check_rollups(), [])
+        self.assertTrue(PropertyTombstone.objects.filter(property_id=self.bergen_id, portfolio_id=self.bergen.pk).exists())
+
+    def test_portfolio_delete_drops_its_partition(self):
+        self.assertTrue(attach_portfolio_partition(self.oslo.pk))
+        self.assertFalse(attach_portfolio_partition(self.oslo.pk))
+        # The checks that let the attach skip its scans are gone again
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT conname FROM pg_constraint WHERE contype = 'c' AND conrelid IN (%s::regclass, %s::regclass)",
+                [DEFAULT_PARTITION, partition_name(self.oslo.pk)]
+            )
+            self.assertEqual(cursor.fetchall(), [])
+        response = self.client.delete(f'/api/portfolios/{self.oslo.pk}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(portfolio_partitions(), {})
+        self.assertEqual(list(Property.objects.values_list('id', flat=True)), [self.bergen_id])
+        # The tombstones and rollups the delete triggers would have written
+        self.assertEqual(sorted(PropertyTombstone.objects.values_list('property_id', flat=True)), self.oslo_ids)
+        self.assertFalse(PortfolioRollup.objects.filter(pk=self.oslo.pk).exists())
+        self.assertEqual(check_rollups(), [])
+
+    def test_portfolio_delete_gives_up_behind_long_queries(self):
+        attach_portfolio_partition(self.oslo.pk)
+        # Another connection reading the property table, such as a streaming export
+        reader = connections.create_connection('default')
+        reader.set_autocommit(False)
+        self.addCleanup(reader.close)
+        with reader.cursor() as cursor:
+            cursor.execute("SET lock_timeout = '5s'")
+            cursor.execute(f'LOCK TABLE ONLY {Property._meta.db_table} IN ACCESS SHARE MODE')
+
+        with mock.patch('properties.partitions.LOCK_TIMEOUT', '50ms'), mock.patch('properties.partitions.time'):
+            response = self.client.delete(f'/api/portfolios/{self.oslo.pk}/')
+        reader.rollback()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(portfolio_partitions(), {self.oslo.pk: partition_name(self.oslo.pk)})
+        self.assertTrue(Portfolio.objects.filter(pk=self.oslo.pk).exists())
+        self.assertFalse(PropertyTombstone.objects.exists())
+        self.assertEqual(check_rollups(), [])
+
+    def test_command_drops_partitions_of_deleted_portfolios(self):
+        attach_portfolio_partition(self.oslo.pk)
+        self.oslo.delete()
+        with self.assertRaises(CommandError):
+            call_command('partition_properties', portfolio=[999999], stdout=StringIO())
+        self.assertEqual(portfolio_partitions(), {})
+
+class JobTests(TransactionTestCase):
+    # The worker threads use their own connections, which would not see a TestCase transaction
+    def setUp(self):
+        self.client = APIClient()
+        self.portfolio = Portfolio.objects.create(name="Oslo Portfolio")
+        for name in ('Karl Johans gate 1', 'Karl Johans gate 2'):
+            Property.objects.create(
+                portfolio=self.portfolio, name=name, address=name, zip_code='0154', city='Oslo',
+                location=Point(10.7522, 59.9139), estimated_value=100, relevant_risks=2,
+                handled_risks=1, total_financial_risk=10
+            )
+
+    def _run_worker(self):
+        call_command('run_worker', burst=True, concurrency=2, stdout=StringIO())
+
+    def test_export_job(self):
+        response = self.client.post(
+            f'/api/properties/jobs/?portfolio={self.portfolio.pk}', {'kind': 'export', 'format': 'csv'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job_url = response['Location']
+        self.assertEqual(response.json()['status'], Job.QUEUED)
+        response = self.client.get(f'{job_url}result/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        self._run_worker()
+        job = self.client.get(job_url).json()
+        self.assertEqual((job['status'], job['processed'], job['total'], job['progress']), (Job.SUCCEEDED, 2, 2, 1.0))
+        response = self.client.get(job['result_url'])
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].startswith('id,lon,lat'))
+
+    def test_import_and_failed_jobs(self):
+        feature = {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [10.7522, 59.9139]},
+            'properties': {
+                'portfolio': self.portfolio.pk, 'name': 'Torggata 2', 'address': 'Torggata 2',
+                'zip_code': '0181', 'city': 'Oslo', 'estimated_value': 100, 'relevant_risks': 2,
+                'handled_risks': 1, 'total_financial_risk': 10
+            }
+        }
+        invalid = {**feature, 'properties': {**feature['properties'], 'handled_risks': 5}}
+        urls = []
+        for collection in (feature, invalid):
+            response = self.client.post('/api/properties/jobs/', {
+                'kind': 'import', 'collection': {'type': 'FeatureCollection', 'features': [collection]}
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            urls.append(response['Location'])
+
+        self._run_worker()
+        imported = self.client.get(urls[0]).json()
+        self.assertEqual(imported['status'], Job.SUCCEEDED)
+        self.assertEqual(self.client.get(imported['result_url']).json()['created'], 1)
+        failed = self.client.get(urls[1]).json()
+        self.assertEqual(failed['status'], Job.FAILED)
+        self.assertEqual(failed['error']['errors'][0]['index'], 0)
+        self.assertEqual(self.client.get(f'{urls[1]}result/').status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Property.objects.count(), 3)
+
+        for data in ({'kind': 'rebuild'}, {'kind': 'export', 'format': 'xlsx'}, {'kind': 'import', 'collection': []}):
+            response = self.client.post('/api/properties/jobs/', data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/properties/jobs/?near=1', {'kind': 'export'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_portfolio_summary_job(self):
+        response = self.client.post(f'/api/portfolios/{self.portfolio.pk}/jobs/', {'kind': 'summary'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self._run_worker()
+        job = self.client.get(response['Location']).json()
+        self.assertEqual(job['status'], Job.SUCCEEDED)
+        summary = self.client.get(job['result_url']).json()
+        self.assertEqual((summary['id'], summary['property_count']), (self.portfolio.pk, 2))
+
+        other = Portfolio.objects.create(name="Bergen Portfolio")
+        response = self.client.get(f'/api/portfolios/{other.pk}/jobs/{job["id"]}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_claim_skips_locked_jobs_and_requeues_stale_ones(self):
+        first = Job.objects.create(kind='summary', portfolio=self.portfolio)
+        second = Job.objects.create(kind='summary', portfolio=self.portfolio)
+        other = connection.copy()
+        try:
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                cursor.execute(f'SELECT id FROM {Job._meta.db_table} WHERE id = %s FOR UPDATE', [first.pk])
+                self.assertEqual(claim_job('test:0').pk, second.pk)
+            other.rollback()
+        finally:
+            other.close()
+
+        Job.objects.filter(pk=second.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(Job.objects.get(pk=second.pk).status, Job.QUEUED)
+        claimed = claim_job('test:0')
+        Job.objects.filter(pk=claimed.pk).update(
+            attempts=MAX_JOB_ATTEMPTS, heartbeat_at=timezone.now() - timedelta(hours=1)
+        )
+        self.assertEqual(requeue_stale_jobs(), 0)
+        self.assertEqual(Job.objects.get(pk=claimed.pk).status, Job.FAILED)
+
+class WarmStartTests(TestCase):
+    def test_warm_start_restores_the_snapshot_and_skips_loaded_data(self):
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot = Path(directory)
+            stdout = StringIO()
+            call_command('warm_start', snapshot=snapshot, properties=30, seed=3, stdout=stdout)
+            self.assertIn('generated seed data', stdout.getvalue())
+            columns = ('id', 'portfolio_id', 'name', 'location', 'estimated_value', 'updated_at')
+            generated = list(Property.objects.order_by('id').values_list(*columns))
+            self.assertEqual(len(generated), 30)
+
+            stdout = StringIO()
+            call_command('warm_start', snapshot=snapshot, stdout=stdout)
+            self.assertIn('data already loaded', stdout.getvalue())
+
+            Portfolio.objects.all().delete()
+            stdout = StringIO()
+            call_command('warm_start', snapshot=snapshot, stdout=stdout)
+            self.assertIn('restored', stdout.getvalue())
+            self.assertEqual(list(Property.objects.order_by('id').values_list(*columns)), generated)
+            self.assertEqual(check_rollups(), [])
+            # New rows get ids after the restored ones
+            created = Portfolio.objects.create(name="New Portfolio")
+            self.assertGreater(created.pk, max(row[1] for row in generated))
+
+    def test_schema_is_built_once(self):
+        warmup.api_schema.cache_clear()
+        for _ in range(2):
+            response = self.client.get('/api/schema/?format=json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('/api/properties/', response.json()['paths'])
+        self.assertEqual(warmup.api_schema.cache_info().misses, 1)
+
+class GenerateFixturesTests(TestCase):
+    def test_generate_fixtures(self):
+        call_command('generate_fixtures', properties=250, portfolios=10, seed=1, batch_size=100, stdout=StringIO())
+        self.assertEqual(Portfolio.objects.count(), 10)
+        self.assertEqual(Property.objects.count(), 250)
+        for prop in Property.objects.all():
+            self.assertLessEqual(prop.handled_risks, prop.relevant_risks)
+        # COPY fires the rollup triggers like any other insert
+        self.assertEqual(check_rollups(), [])
+
+    def test_generate_fixtures_is_reproducible(self):
+        call_command('generate_fixtures', properties=20, seed=7, stdout=StringIO())
+        first = list(Property.objects.order_by('id').values_list('name', 'estimated_value'))
+        Property.objects.all().delete()
+        call_command('generate_fixtures', properties=20, seed=7, stdout=StringIO())
+        second = list(Property.objects.order_by('id').values_list('name', 'estimated_value'))
+        self.assertEqual(first, second)
+
+class BenchmarkCommandTests(TestCase):
+    def test_benchmark_outputs_json_and_rolls_back(self):
+        Portfolio.objects.create(name="Existing Portfolio")
+        stdout = StringIO()
+        call_command('benchmark', sizes=[30], iterations=2, stdout=stdout, stderr=StringIO())
+        results = json.loads(stdout.getvalue())
+        scenarios = {scenario['name']: scenario for scenario in results['runs'][0]['scenarios']}
+        self.assertIn('list_order_estimated_value', scenarios)
+        self.assertIn('bbox_city', scenarios)
+        self.assertIn('portfolio_summary', scenarios)
+        for scenario in scenarios.values():
+            self.assertEqual(scenario['status'], 200)
+            self.assertGreater(scenario['queries'], 0)
+            self.assertIn('p95', scenario['latency_ms'])
+        self.assertLess(scenarios['list_sparse']['bytes'], scenarios['list_order_id']['bytes'])
+        self.assertLess(scenarios['list_order_id']['bytes_br'], scenarios['list_order_id']['bytes'])
+        self.assertEqual(Portfolio.objects.count(), 1)
+        self.assertEqual(Property.objects.count(), 0)
@@ -1,4 +1,68 @@
-from rest_framework.throttling import AnonRateThrottle
+import random
+from django.db import connection
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import SimpleRateThrottle
+from .models import ThrottleBucket
 
-class PropertyRateThrottle(AnonRateThrottle):
-    rate = '100/minute'
+# Buckets idle this long are full again and can be dropped
+BUCKET_IDLE_SECONDS = 86400
+CLEANUP_PROBABILITY = 0.001
+
+# Refills the bucket for the time since the last request and takes a token in one statement.
+# When the bucket is empty the WHERE clause skips the update and no row is returned.
+TAKE_TOKEN_SQL = f'''
+    INSERT INTO {ThrottleBucket._meta.db_table} AS bucket (key, tokens, updated_at)
+    VALUES (%(key)s, %(capacity)s - 1, %(now)s)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = LEAST(%(capacity)s, bucket.tokens + GREATEST(0, %(now)s - bucket.updated_at) * %(refill)s) - 1,
+        updated_at = GREATEST(bucket.updated_at, %(now)s)
+    WHERE LEAST(%(capacity)s, bucket.tokens + GREATEST(0, %(now)s - bucket.updated_at) * %(refill)s) >= 1
+    RETURNING tokens
+'''
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    # Keeps the token buckets in PostgreSQL rather than the per-process cache, so the
+    # limit holds across gunicorn workers and restarts, at one query per request.
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        now = self.timer()
+        with connection.cursor() as cursor:
+            cursor.execute(TAKE_TOKEN_SQL, {
+                'key': self.key,
+                'capacity': self.num_requests,
+                'refill': self.num_requests / self.duration,
+                'now': now,
+            })
+            allowed = cursor.fetchone() is not None
+            if random.random() < CLEANUP_PROBABILITY:
+                ThrottleBucket.objects.filter(updated_at__lt=now - BUCKET_IDLE_SECONDS).delete()
+        return allowed
+
+    def wait(self):
+        # An empty bucket gets its next token within one refill interval
+        return self.duration / self.num_requests
+
+class PropertyReadThrottle(TokenBucketThrottle):
+    scope = 'property_read'
+
+    def get_cache_key(self, request, view):
+        if request.method not in SAFE_METHODS:
+            return None
+        return super().get_cache_key(request, view)
+
+class PropertyWriteThrottle(TokenBucketThrottle):
+    scope = 'property_write'
+
+    def get_cache_key(self, request, view):
+        if request.method in SAFE_METHODS:
+            return None
+        return super().get_cache_key(request, view)
@@ -1,11 +1,33 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import path, include, re_path
 from rest_framework.routers import DefaultRouter
-from .views import PropertyViewSet, PortfolioViewSet
+from .renderers import MVTRenderer
+from .views import CacheStatsView, CityStatsView, PropertyViewSet, PortfolioViewSet
 
 router = DefaultRouter()
 router.register(r'properties', PropertyViewSet)
 router.register(r'portfolios', PortfolioViewSet)
 
 urlpatterns = [
+    path(
+        'properties/tiles/<int:z>/<int:x>/<int:y>.mvt',
+        PropertyViewSet.as_view({'get': 'tiles'}, renderer_classes=[MVTRenderer]),
+        name='property-tiles'
+    ),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('stats/cities/', CityStatsView.as_view(), name='city-stats'),
     path('', include(router.urls)),
 ]
+
+if settings.ASYNC_VIEWS:
+    from .async_views import (
+        portfolio_detail_view, portfolio_list_view, property_detail_view, property_list_view
+    )
+
+    # Take precedence over the router for the list and detail routes
+    urlpatterns = [
+        path('properties/', property_list_view, name='property-list'),
+        re_path(r'^properties/(?P<pk>[^/.]+)/$', property_detail_view, name='property-detail'),
+        path('portfolios/', portfolio_list_view, name='portfolio-list'),
+        re_path(r'^portfolios/(?P<pk>[^/.]+)/$', portfolio_detail_view, name='portfolio-detail'),
+    ] + urlpatterns
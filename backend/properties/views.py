@@ -1,38 +1,620 @@
+import json
+import math
+from django.contrib.gis.db.models import Collect, Extent
+from django.contrib.gis.db.models.functions import Centroid, SnapToGrid
+from django.contrib.gis.geos import Polygon
+from django.db import connections
+from django.db.models import Avg, Count, F, FloatField, Func, Sum
+from django.db.models.functions import Coalesce
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
 from rest_framework import viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.request import Request
-from rest_framework_gis.pagination import GeoJsonPagination
+from rest_framework.reverse import reverse
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework_gis.filters import InBBoxFilter
 from rest_framework.filters import OrderingFilter
 from typing import Any, cast
-from .models import Property, Portfolio
-from .serializers import PropertySerializer, PortfolioSerializer
-from .throttles import PropertyRateThrottle
+from .bulk import delete_properties, save_features
+from .cache import ALL_SCOPE, cache_response, invalidate_portfolios, portfolio_scope, stats
+from .export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS
+from .filters import NearFilter, TrigramSearchFilter, parse_search
+from .jobs import JobNotFinished, export_params, get_job, import_params, result_chunks, submit_job
+from .metrics import serializing
+from .models import CityRollup, Job, Property, Portfolio, PortfolioRollup
+from .pagination import GeoCursorPagination, GeoPropertyPagination
+from .partitions import drop_portfolio_partition
+from .renderers import CSVRenderer, ColumnarRenderer, GeoJSONRenderer, NDJSONRenderer
+from .routers import finish_request, read_alias, route_reads
+from .serializers import (
+    PROPERTY_FEATURE_FIELDS, CityStatsSerializer, JobSerializer, PropertySerializer, PortfolioSerializer,
+    PortfolioStatsSerializer, PortfolioSummarySerializer, parse_fields, parse_precision,
+    property_columns, property_features
+)
+from .sync import changes_since, encode_token, parse_since, sync_watermark
+from .throttles import PropertyReadThrottle, PropertyWriteThrottle
 
-class GeoPropertyPagination(GeoJsonPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+# Above this zoom level the clusters endpoint returns individual points
+CLUSTER_MAX_ZOOM = 16
+# Approximate cluster diameter in screen pixels on a 256px web mercator tile
+CLUSTER_RADIUS_PX = 60
 
-class PortfolioViewSet(viewsets.ModelViewSet):
-    queryset = Portfolio.objects.prefetch_related('properties').all()
+# Heatmap cells are built in web mercator, so cell_size is in mercator metres
+HEATMAP_GRIDS = {'hex': ('ST_HexagonGrid', 'ST_Hexagon'), 'square': ('ST_SquareGrid', 'ST_Square')}
+HEATMAP_METRICS = {
+    'total_financial_risk': 'p.total_financial_risk',
+    'unhandled_risks': 'p.relevant_risks - p.handled_risks',
+}
+# Upper bound on the cells a viewport may cover, keeps the response size bounded
+HEATMAP_MAX_CELLS = 10000
+# Decimals of the cell coordinates, about 10 cm
+HEATMAP_PRECISION = 6
+MERCATOR_MAX_LAT = 85.0511
+
+# Suggestions returned by the autocomplete action
+AUTOCOMPLETE_LIMIT = 10
+
+# Vector tile geometry extent and buffer, in tile coordinate units
+MVT_EXTENT = 4096
+MVT_BUFFER = 64
+MVT_MAX_AGE = 60
+MVT_FIELDS = [
+    'id', 'portfolio_id', 'name', 'estimated_value', 'relevant_risks',
+    'handled_risks', 'total_financial_risk'
+]
+
+class ReplicaReadMixin:
+    # Safe requests read from a replica unless the client wrote within the sticky window
+    def initial(self, request: Request, *args: Any, **kwargs: Any) -> None:
+        route_reads(request)
+        super().initial(request, *args, **kwargs)  # type: ignore[misc]
+
+    def finalize_response(self, request: Request, response: Any, *args: Any, **kwargs: Any) -> Any:
+        finish_request(request, response)
+        return super().finalize_response(request, response, *args, **kwargs)  # type: ignore[misc]
+
+class FieldSelectionMixin:
+    # ?fields= on list and retrieve, the unselected columns are deferred in the query too.
+    # Writes always validate and return every field.
+    def get_sparse_fields(self) -> list[str] | None:
+        if self.action not in ('list', 'retrieve'):  # type: ignore[attr-defined]
+            return None
+        return parse_fields(self.request, self.get_serializer_class())  # type: ignore[attr-defined]
+
+    def defer_unselected(self, queryset: Any) -> Any:
+        fields = self.get_sparse_fields()
+        if fields is None:
+            return queryset
+        serializer_class = self.get_serializer_class()  # type: ignore[attr-defined]
+        columns = {field.name for field in queryset.model._meta.concrete_fields}
+        selected = dict.fromkeys([*serializer_class.required_fields, *fields])
+        return queryset.only(*[field for field in selected if field in columns])
+
+    def get_serializer(self, *args: Any, **kwargs: Any) -> Any:
+        fields = self.get_sparse_fields()
+        if fields is not None:
+            kwargs.setdefault('fields', fields)
+        return super().get_serializer(*args, **kwargs)  # type: ignore[misc]
+
+class SerializationTimingMixin:
+    # The generic list and retrieve, with serialization timed for Server-Timing and /metrics
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        queryset = self.filter_queryset(self.get_queryset())  # type: ignore[attr-defined]
+        page = self.paginate_queryset(queryset)  # type: ignore[attr-defined]
+        if page is not None:
+            return self.get_paginated_response(self.serialized(page, many=True))  # type: ignore[attr-defined]
+        return Response(self.serialized(queryset, many=True))
+
+    def retrieve(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        return Response(self.serialized(self.get_object()))  # type: ignore[attr-defined]
+
+    def serialized(self, instance: Any, **kwargs: Any) -> Any:
+        serializer = self.get_serializer(instance, **kwargs)  # type: ignore[attr-defined]
+        with serializing(self.request):  # type: ignore[attr-defined]
+            return serializer.data
+
+class JobMixin:
+    # Jobs run by manage.py run_worker (properties.jobs), polled and downloaded under jobs/<id>/
+    def job_response(self, job: Job, status_code: int = 200) -> Response:
+        request = self.request  # type: ignore[attr-defined]
+        url_kwargs = {'job_id': job.pk}
+        if 'pk' in self.kwargs:  # type: ignore[attr-defined]
+            url_kwargs['pk'] = self.kwargs['pk']  # type: ignore[attr-defined]
+        data = JobSerializer(job).data
+        data['url'] = reverse(f'{self.basename}-job', kwargs=url_kwargs, request=request)  # type: ignore[attr-defined]
+        if job.status == Job.SUCCEEDED:
+            data['result_url'] = reverse(f'{self.basename}-job-result', kwargs=url_kwargs, request=request)  # type: ignore[attr-defined]
+        headers = {'Location': data['url']} if status_code == 202 else None
+        return Response(data, status=status_code, headers=headers)
+
+    def job_result_response(self, job: Job) -> Any:
+        if job.status != Job.SUCCEEDED:
+            raise JobNotFinished()
+        if not job.content_type:
+            return Response(job.result)
+        response = StreamingHttpResponse(result_chunks(job), content_type=job.content_type)
+        response['Content-Disposition'] = f'attachment; filename="{job.filename}"'
+        return response
+
+class PortfolioViewSet(FieldSelectionMixin, SerializationTimingMixin, JobMixin, ReplicaReadMixin, viewsets.ModelViewSet):
+    queryset = Portfolio.objects.all()
     serializer_class = PortfolioSerializer
-    throttle_classes = [PropertyRateThrottle]
+    throttle_classes = [PropertyReadThrottle, PropertyWriteThrottle]
     pagination_class = None
 
-class PropertyViewSet(viewsets.ModelViewSet):
+    def get_queryset(self) -> Any:
+        if self._is_summary():
+            # All rollups come from a single GROUP BY over the properties join
+            queryset = Portfolio.objects.annotate(
+                property_count=Count('properties'),
+                total_estimated_value=Coalesce(Sum('properties__estimated_value'), 0),
+                average_estimated_value=Avg('properties__estimated_value'),
+                total_financial_risk=Coalesce(Sum('properties__total_financial_risk'), 0),
+                relevant_risks=Coalesce(Sum('properties__relevant_risks'), 0),
+                handled_risks=Coalesce(Sum('properties__handled_risks'), 0),
+                extent=Extent('properties__location'),
+            ).order_by('id')
+            return self.defer_unselected(queryset)
+        return self.defer_unselected(Portfolio.objects.all())
+
+    def get_serializer_class(self) -> Any:
+        if self._is_summary():
+            return PortfolioSummarySerializer
+        return PortfolioSerializer
+
+    def _is_summary(self) -> bool:
+        request = cast(Request, self.request)
+        return self.action in ('list', 'retrieve') and request.query_params.get('view') == 'summary'
+
+    def get_cache_scopes(self) -> list[str]:
+        # Ids that are not numbers only ever get a 404, which is not cached
+        if self.action == 'retrieve' and str(self.kwargs['pk']).isdecimal():
+            return [portfolio_scope(self.kwargs['pk'])]
+        return [ALL_SCOPE]
+
+    @cache_response
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        return super().list(request, *args, **kwargs)
+
+    @cache_response
+    def retrieve(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_destroy(self, instance: Portfolio) -> None:
+        # A portfolio with its own partition drops it, the cascade then finds no properties to
+        # delete. The drop commits on its own, so its retries do not hold the delete's locks.
+        # Should the delete fail after it, the portfolio is left without properties.
+        drop_portfolio_partition(instance.pk)
+        instance.delete()
+
+    @action(detail=True, methods=['get'])
+    def properties(self, request: Request, pk: Any = None) -> Response:
+        portfolio = self.get_object()
+        paginator = GeoPropertyPagination()
+        fields = parse_fields(request, PropertySerializer)
+        queryset = portfolio.properties.order_by('id')
+        if fields is not None:
+            queryset = queryset.only(*PropertySerializer.required_fields, *fields)
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = PropertySerializer(
+            page, many=True, context=self.get_serializer_context(),
+            fields=fields, precision=parse_precision(request)
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request: Request, pk: Any = None) -> Response:
+        # Read from the trigger maintained rollup instead of aggregating the properties
+        portfolio = self.get_object()
+        rollup = PortfolioRollup.objects.filter(portfolio=portfolio).first() or PortfolioRollup(portfolio=portfolio)
+        return Response(PortfolioStatsSerializer(rollup).data)
+
+    @action(detail=True, methods=['post'], url_path='jobs')
+    def jobs(self, request: Request, pk: Any = None) -> Response:
+        # An export of the portfolio's properties (filtered by the query string) or its summary
+        portfolio = self.get_object()
+        data = request.data if isinstance(request.data, dict) else {}
+        kind = data.get('kind')
+        if kind == 'export':
+            query = request.query_params.copy()
+            query['portfolio'] = str(portfolio.pk)
+            params = export_params(data, query.urlencode())
+        elif kind == 'summary':
+            params = {}
+        else:
+            raise ValidationError({'kind': 'Expected export or summary'})
+        return self.job_response(submit_job(kind, params, portfolio=portfolio), status_code=202)
+
+    @action(detail=True, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9]+)')
+    def job(self, request: Request, pk: Any = None, job_id: Any = None) -> Response:
+        return self.job_response(get_job(job_id, portfolio=self.get_object()))
+
+    @action(detail=True, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9]+)/result')
+    def job_result(self, request: Request, pk: Any = None, job_id: Any = None) -> Any:
+        return self.job_result_response(get_job(job_id, portfolio=self.get_object()))
+
+class PropertyViewSet(FieldSelectionMixin, SerializationTimingMixin, JobMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
-    throttle_classes = [PropertyRateThrottle]
+    throttle_classes = [PropertyReadThrottle, PropertyWriteThrottle]
     pagination_class = GeoPropertyPagination
     bbox_filter_field = 'location'
-    filter_backends = (InBBoxFilter, OrderingFilter)
+    # NearFilter's ?k= takes the k nearest of what the filters before it left
+    filter_backends = (InBBoxFilter, TrigramSearchFilter, NearFilter, OrderingFilter)
     ordering_fields = ['id', 'name', 'estimated_value', 'relevant_risks', 'handled_risks']
-    ordering = ['id']
+    # Serve list pages from `.values()` rows instead of PropertySerializer instances
+    fast_list = True
 
     def get_queryset(self) -> Any:
         queryset = Property.objects.all()
         request = cast(Request, self.request)
         portfolio_id = request.query_params.get('portfolio', None)
         if portfolio_id is not None:
-            queryset = queryset.filter(portfolio_id=portfolio_id)
-        return queryset
+            # A constant equality on the partition key, so only that portfolio's partition is read
+            if not portfolio_id.isdecimal():
+                raise ValidationError({'portfolio': 'Expected a portfolio id'})
+            queryset = queryset.filter(portfolio_id=int(portfolio_id))
+        return self.defer_unselected(queryset)
+
+    def get_serializer(self, *args: Any, **kwargs: Any) -> Any:
+        if self.action in ('list', 'retrieve'):
+            kwargs.setdefault('precision', parse_precision(self.request))
+        return super().get_serializer(*args, **kwargs)
+
+    @property
+    def ordering(self) -> list[str]:
+        # Near searches come back closest first and text searches best match first,
+        # unless another ordering is asked for
+        request = getattr(self, 'request', None)
+        if request is not None and 'near' in request.query_params:
+            return ['distance', 'id']
+        if request is not None and parse_search(request) is not None:
+            return ['-search_rank', 'id']
+        return ['id']
+
+    def get_cache_scopes(self) -> list[str]:
+        request = cast(Request, self.request)
+        portfolio_id = request.query_params.get('portfolio', None)
+        # get_queryset rejects a portfolio that is not a number before anything is cached
+        if self.action == 'list' and portfolio_id is not None and portfolio_id.isdecimal():
+            return [portfolio_scope(portfolio_id)]
+        return [ALL_SCOPE]
+
+    @cache_response
+    def retrieve(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_create(self, serializer: Any) -> None:
+        serializer.save()
+        invalidate_portfolios([serializer.instance.portfolio_id])
+
+    def perform_update(self, serializer: Any) -> None:
+        # A property moved to another portfolio changes the responses of both
+        previous_portfolio_id = serializer.instance.portfolio_id
+        serializer.save()
+        invalidate_portfolios([previous_portfolio_id, serializer.instance.portfolio_id])
+
+    def perform_destroy(self, instance: Property) -> None:
+        instance.delete()
+        invalidate_portfolios([instance.portfolio_id])
+
+    def list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        # A delta sync depends on the moment it runs, so it never comes from the response cache
+        if 'since' in request.query_params:
+            return self._changes()
+        return self._list(request, *args, **kwargs)
+
+    def _changes(self) -> Response:
+        request = cast(Request, self.request)
+        since = parse_since(request)
+        # Taken before reading, anything committed later is picked up by the next sync
+        token = encode_token(sync_watermark())
+        if since is None:
+            return Response({'type': 'FeatureCollection', 'features': [], 'deleted': [], 'token': token})
+        rows, deleted = changes_since(
+            self._feature_rows(self.get_queryset()), since, request.query_params.get('portfolio')
+        )
+        return Response({
+            'type': 'FeatureCollection', 'features': self.features(rows), 'deleted': deleted, 'token': token
+        })
+
+    @cache_response
+    def _list(self, request: Request, *args: Any, **kwargs: Any) -> Response:
+        if isinstance(request.accepted_renderer, ColumnarRenderer):
+            return self._columnar_list()
+        if not self.fast_list:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self._feature_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response({'features': self.features(page)})
+        return Response({'type': 'FeatureCollection', 'features': self.features(queryset)})
+
+    def _columnar_list(self) -> Response:
+        queryset = self.filter_queryset(self.get_queryset())
+        names = self._row_columns(queryset)
+        # Named rows are plain tuples, so the cursor paginator can still read the ordering values
+        rows = self._with_coordinates(queryset).values_list('id', 'lon', 'lat', *names, named=True)
+        fields = [*(self.get_sparse_fields() or PROPERTY_FEATURE_FIELDS), 'distance']
+        precision = parse_precision(self.request)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            with serializing(self.request):
+                columns = property_columns(page, names, fields, precision)
+            return self.paginator.get_columnar_response(columns)
+        with serializing(self.request):
+            return Response(property_columns(rows, names, fields, precision))
+
+    def get_renderers(self) -> list:
+        renderers = super().get_renderers()
+        if self.action == 'list':
+            renderers.append(ColumnarRenderer())
+        return renderers
+
+    def features(self, rows: Any) -> list[dict]:
+        with serializing(self.request):
+            return property_features(rows, self.get_sparse_fields(), parse_precision(self.request))
+
+    def _feature_rows(self, queryset: Any) -> Any:
+        return self._with_coordinates(queryset).values('id', 'lon', 'lat', *self._row_columns(queryset))
+
+    def _row_columns(self, queryset: Any) -> list[str]:
+        fields = self.get_sparse_fields()
+        if fields is None:
+            fields = PROPERTY_FEATURE_FIELDS
+        # The cursor paginator reads the ordering values from the rows
+        ordering = [
+            field.lstrip('-') for field in queryset.query.order_by
+            if isinstance(field, str) and field.lstrip('-') in PROPERTY_FEATURE_FIELDS
+        ]
+        extra = [field for field in ('distance', 'search_rank') if field in queryset.query.annotations]
+        return list(dict.fromkeys([field for field in PROPERTY_FEATURE_FIELDS if field in fields] + ordering + extra))
+
+    @staticmethod
+    def _with_coordinates(queryset: Any) -> Any:
+        return queryset.annotate(
+            lon=Func(F('location'), function='ST_X', output_field=FloatField()),
+            lat=Func(F('location'), function='ST_Y', output_field=FloatField()),
+        )
+
+    @property
+    def paginator(self) -> Any:
+        if not hasattr(self, '_paginator'):
+            request = cast(Request, self.request)
+            if request.query_params.get('pagination') == 'cursor':
+                self._paginator = GeoCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    @action(detail=False, methods=['post', 'delete'])
+    def bulk(self, request: Request) -> Response:
+        if request.method == 'DELETE':
+            ids = request.data.get('ids') if isinstance(request.data, dict) else None
+            return Response(delete_properties(ids))
+        upsert = request.query_params.get('upsert') == 'true'
+        return Response(save_features(request.data, upsert=upsert))
+
+    @action(detail=False, methods=['get'])
+    @cache_response
+    def autocomplete(self, request: Request) -> Response:
+        # Type-ahead: the best matches for ?search= with just enough to label and place them
+        if parse_search(request) is None:
+            raise ValidationError({'search': 'A search term is required'})
+        rows = self._with_coordinates(self.filter_queryset(self.get_queryset())).values(
+            'id', 'name', 'lon', 'lat'
+        )[:AUTOCOMPLETE_LIMIT]
+        return Response([
+            {'id': row['id'], 'name': row['name'], 'location': [row['lon'], row['lat']]} for row in rows
+        ])
+
+    @action(detail=False, methods=['get'], renderer_classes=[GeoJSONRenderer, NDJSONRenderer, CSVRenderer])
+    def export(self, request: Request) -> StreamingHttpResponse:
+        export_format = request.accepted_renderer.format
+        stream, content_type = EXPORT_FORMATS[export_format]
+        rows = self.export_rows(self.filter_queryset(self.get_queryset()))
+        response = StreamingHttpResponse(
+            (part.encode() for part in stream(rows)), content_type=content_type
+        )
+        response['Content-Disposition'] = f'attachment; filename="properties.{export_format}"'
+        return response
+
+    def export_rows(self, queryset: Any) -> Any:
+        # A server-side cursor keeps memory flat regardless of the portfolio size
+        return self._feature_rows(queryset).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    @action(detail=False, methods=['post'], url_path='jobs')
+    def jobs(self, request: Request) -> Response:
+        # Exports of the filters in the query string, or bulk imports too large for a request
+        data = request.data if isinstance(request.data, dict) else {}
+        kind = data.get('kind')
+        if kind == 'export':
+            params = export_params(data, request.query_params.urlencode())
+        elif kind == 'import':
+            params = import_params(data)
+        else:
+            raise ValidationError({'kind': 'Expected export or import'})
+        return self.job_response(submit_job(kind, params), status_code=202)
+
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9]+)')
+    def job(self, request: Request, job_id: Any = None) -> Response:
+        return self.job_response(get_job(job_id))
+
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9]+)/result')
+    def job_result(self, request: Request, job_id: Any = None) -> Any:
+        return self.job_result_response(get_job(job_id))
+
+    @action(detail=False, methods=['get'])
+    def clusters(self, request: Request) -> Response:
+        zoom = request.query_params.get('zoom', '')
+        if not zoom.isdecimal() or int(zoom) > 22:
+            raise ValidationError({'zoom': 'Zoom must be a whole number between 0 and 22'})
+        zoom_level = int(zoom)
+
+        # Ordering would otherwise leak into the GROUP BY clause
+        queryset = self.filter_queryset(self.get_queryset()).order_by()
+
+        if zoom_level > CLUSTER_MAX_ZOOM:
+            rows = queryset.values('id', 'location', 'estimated_value', 'total_financial_risk')
+            features = [
+                self._cluster_feature(
+                    row['location'], 1, row['estimated_value'], row['total_financial_risk'], row['id']
+                )
+                for row in rows
+            ]
+        else:
+            # Snap every point to a grid whose cell size matches the cluster radius at this zoom
+            cell_size = 360 / 2 ** zoom_level * CLUSTER_RADIUS_PX / 256
+            rows = queryset.annotate(
+                cell=SnapToGrid('location', cell_size)
+            ).values('cell').annotate(
+                count=Count('id'),
+                centroid=Centroid(Collect('location')),
+                estimated_value=Sum('estimated_value'),
+                total_financial_risk=Sum('total_financial_risk'),
+            )
+            features = [
+                self._cluster_feature(
+                    row['centroid'], row['count'], row['estimated_value'], row['total_financial_risk']
+                )
+                for row in rows
+            ]
+
+        return Response({'type': 'FeatureCollection', 'features': features})
+
+    @action(detail=False, methods=['get'])
+    @cache_response
+    def heatmap(self, request: Request) -> Response:
+        bbox = InBBoxFilter().get_filter_bbox(request)
+        if bbox is None:
+            raise ValidationError({'in_bbox': 'A bounding box is required'})
+        try:
+            cell_size = float(request.query_params.get('cell_size', ''))
+        except ValueError:
+            cell_size = 0
+        if not (cell_size > 0 and math.isfinite(cell_size)):
+            raise ValidationError({'cell_size': 'Cell size must be a positive number of metres'})
+        shape = request.query_params.get('shape', 'hex')
+        if shape not in HEATMAP_GRIDS:
+            raise ValidationError({'shape': f'Shape must be one of {", ".join(HEATMAP_GRIDS)}'})
+        metric = request.query_params.get('metric', 'total_financial_risk')
+        if metric not in HEATMAP_METRICS:
+            raise ValidationError({'metric': f'Metric must be one of {", ".join(HEATMAP_METRICS)}'})
+        width, height = self._mercator_size(bbox.extent)
+        if width * height / cell_size ** 2 > HEATMAP_MAX_CELLS:
+            raise ValidationError({'cell_size': 'Cell size is too small for this bounding box'})
+
+        queryset = self.filter_queryset(self.get_queryset()).order_by().values(
+            'location', 'total_financial_risk', 'relevant_risks', 'handled_risks'
+        )
+        inner_sql, inner_params = queryset.query.sql_with_params()
+        grid, cell = HEATMAP_GRIDS[shape]
+        # Each point looks up its own cell from a grid over just its bounds, so the cost
+        # grows with the matching points and the output with the number of cells
+        sql = f'''
+            SELECT ST_AsGeoJSON(
+                ST_Transform(ST_SetSRID({cell}(%s, cells.i, cells.j), 3857), 4326), {HEATMAP_PRECISION}
+            ), COUNT(*), SUM({HEATMAP_METRICS[metric]})
+            FROM ({inner_sql}) AS p
+            CROSS JOIN LATERAL (
+                SELECT grid.i, grid.j FROM {grid}(%s, ST_Transform(p.location, 3857)) AS grid
+                WHERE ST_Intersects(grid.geom, ST_Transform(p.location, 3857))
+                LIMIT 1
+            ) AS cells
+            GROUP BY cells.i, cells.j
+        '''
+        with connections[read_alias()].cursor() as cursor:
+            cursor.execute(sql, [cell_size, *inner_params, cell_size])
+            rows = cursor.fetchall()
+
+        return Response({
+            'type': 'FeatureCollection',
+            'features': [
+                {
+                    'type': 'Feature',
+                    'geometry': json.loads(geometry),
+                    'properties': {'count': count, 'value': value},
+                }
+                for geometry, count, value in rows
+            ],
+        })
+
+    @staticmethod
+    def _mercator_size(extent: tuple) -> tuple[float, float]:
+        min_lon, min_lat, max_lon, max_lat = extent
+
+        def y(lat: float) -> float:
+            lat = max(-MERCATOR_MAX_LAT, min(MERCATOR_MAX_LAT, lat))
+            return 6378137 * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+        return 6378137 * math.radians(max_lon - min_lon), y(max_lat) - y(min_lat)
+
+    def tiles(self, request: Request, z: int, x: int, y: int) -> Response:
+        if z > 22 or x >= 2 ** z or y >= 2 ** z:
+            raise NotFound('Tile does not exist')
+
+        # Let the spatial index find candidate rows before PostGIS encodes the tile
+        queryset = self.filter_queryset(self.get_queryset()).order_by().filter(
+            location__bboxoverlaps=self._tile_bounds(z, x, y)
+        )
+        inner_sql, inner_params = queryset.values(*MVT_FIELDS, 'location').query.sql_with_params()
+        columns = ', '.join(f'p.{field}' for field in MVT_FIELDS)
+        sql = f'''
+            SELECT ST_AsMVT(tile, 'properties', {MVT_EXTENT}, 'geom') FROM (
+                SELECT ST_AsMVTGeom(
+                    ST_Transform(p.location, 3857), ST_TileEnvelope(%s, %s, %s),
+                    {MVT_EXTENT}, {MVT_BUFFER}, true
+                ) AS geom, {columns}
+                FROM ({inner_sql}) AS p
+            ) AS tile
+        '''
+        with connections[read_alias()].cursor() as cursor:
+            cursor.execute(sql, [z, x, y, *inner_params])
+            tile = cursor.fetchone()[0]
+
+        response = Response(tile, content_type='application/vnd.mapbox-vector-tile')
+        patch_cache_control(response, public=True, max_age=MVT_MAX_AGE)
+        return response
+
+    @staticmethod
+    def _tile_bounds(z: int, x: int, y: int) -> Polygon:
+        tiles = 2 ** z
+        margin = MVT_BUFFER / MVT_EXTENT
+
+        def lon(tile_x: float) -> float:
+            return tile_x / tiles * 360 - 180
+
+        def lat(tile_y: float) -> float:
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / tiles))))
+
+        return Polygon.from_bbox((
+            lon(x - margin), lat(min(y + 1 + margin, tiles)),
+            lon(x + 1 + margin), lat(max(y - margin, 0)),
+        ))
+
+    @staticmethod
+    def _cluster_feature(point, count, estimated_value, total_financial_risk, property_id=None) -> dict:
+        return {
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [point.x, point.y]},
+            'properties': {
+                'id': property_id,
+                'count': count,
+                'estimated_value': estimated_value,
+                'total_financial_risk': total_financial_risk,
+            },
+        }
+
+class CacheStatsView(APIView):
+    def get(self, request: Request) -> Response:
+        return Response(stats.snapshot())
+
+class CityStatsView(APIView):
+    throttle_classes = [PropertyReadThrottle]
+
+    def get(self, request: Request) -> Response:
+        return Response(CityStatsSerializer(CityRollup.objects.order_by('city'), many=True).data)
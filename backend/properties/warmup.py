@@ -0,0 +1,29 @@
+import functools
+from django.db import OperationalError, connections
+from drf_spectacular.generators import SchemaGenerator
+from drf_spectacular.views import SpectacularAPIView
+from rest_framework.response import Response
+
+@functools.cache
+def api_schema() -> dict:
+    # The schema only changes with the code, so each process builds it once
+    return SchemaGenerator().get_schema(request=None, public=True)
+
+class SchemaView(SpectacularAPIView):
+    def _get_schema_response(self, request):
+        return Response(api_schema())
+
+def warm_up_master() -> None:
+    # Runs in the gunicorn master after the app is preloaded, the workers fork with the
+    # schema built. Connections must not be shared across the fork, so none stay open.
+    api_schema()
+    connections.close_all()
+
+def prime_connections() -> None:
+    # Runs in each worker after the fork, so the first request finds its connections open
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except OperationalError:
+            # A replica that is down is skipped by the router, the primary is retried by the request
+            pass
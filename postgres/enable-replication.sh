@@ -0,0 +1,3 @@
+#!/bin/bash
+# Runs once when the primary's data directory is initialised, lets replicas stream WAL from it
+echo "host replication all all scram-sha-256" >> "$PGDATA/pg_hba.conf"